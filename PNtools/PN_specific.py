@@ -1,10 +1,15 @@
-import pymaid
-import pandas as pd
 import numpy as np
-import itertools
 from . import misc
-
-def PN_axon_prune(neurons,vols = None, resize = 1):
+from . import utils
+from . import volume_cache
+from . import topology
+from . import parallel
+from . import volume_index
+pymaid = utils.lazy_import('pymaid')
+pd = utils.lazy_import('pandas')
+
+@utils.stage('PN_axon_prune')
+def PN_axon_prune(neurons,vols = None, resize = 1, n_jobs = 1):
     """ Rough pruning of PNs to the axon.
 
     This is done by first isolating the longest neurite, and finding either the first branch point in the final neuropil which is
@@ -17,12 +22,18 @@ def PN_axon_prune(neurons,vols = None, resize = 1):
     neurons  :   CatmaidNeuron | CatmaidNeuronList
                  Projection neuron(s) which you wish to prune to the axon
 
-    vols     :  dict
-                Dictionary of all FAFB neuropils (see PNtools.FAFB_vols function). If None (default), will run PNtools.FAFB_vols.
+    vols     :  dict | VolumeLabeller | VoxelLabelGrid
+                Dictionary of all FAFB neuropils (see PNtools.FAFB_vols function), or a labeller of them. If None (default),
+                will run PNtools.FAFB_vols.
 
     resize   :  int
                 Scaling factor by which to resize the Antenal lobe volumes. 1 (no scaling) by default. Useful if you want to remove
-                a broader area of dendrites, but runs the risk of returning neurons with no nodes.
+                a broader area of dendrites, but runs the risk of returning neurons with no nodes. The ALs are resized
+                once (on copies), not per neuron.
+
+    n_jobs   :  int
+                Number of processes to prune neurons over. 1 (default) prunes in this process, -1 uses all CPUs.
+                Neurons are sent to the workers as node/connector arrays, and the volumes once per worker.
 
     Returns
     -------
@@ -38,84 +49,66 @@ def PN_axon_prune(neurons,vols = None, resize = 1):
     if vols is None:
         vols = misc.FAFB_vols()
 
-    AL_R = pymaid.get_volume('AL_R_manual')
-    AL_L = pymaid.get_volume('AL_L')
-    pruned = pymaid.CatmaidNeuronList([])
+    with utils.stage('PN_axon_prune.get_volumes'):
+        AL = volume_cache._get_volume(['AL_R_manual', 'AL_L'], session = True)
+        # resized copies of the ALs, indexed once for all neurons
+        AL_R = volume_index.indexed_volume(AL['AL_R_manual'], resize)
+        AL_L = volume_index.indexed_volume(AL['AL_L'], resize)
+    with utils.stage('PN_axon_prune.prune'):
+        res = parallel.map_neurons(_axon_prune, neurons, n_jobs = n_jobs,
+                                   shared = {'vols': vols, 'AL_R': AL_R, 'AL_L': AL_L})
+    pruned = pymaid.CatmaidNeuronList([n for n in res if n is not None])
 
-    for N in neurons:
+    return (pruned)
 
-        pymaid.reroot_neuron(N,N.soma,inplace = True)
-        ##Bit 1
+def _axon_prune(N, vols, AL_R, AL_L):
+    """ Axon pruning of a single PN, None if the end of its longest neurite is not in any volume.
 
-        # get neurite of whole neuron
-        neurite = pymaid.longest_neurite(N)
-        # get end node of neurite in a volume...
-        location = []
-        limit = 0
-        while (len(location) == 0 and limit <= 15):
-            limit += 1
-            last_node = list(set(neurite.nodes.treenode_id.values) - set(neurite.nodes.parent_id.values))[0]
-            last_node_coords = neurite.nodes.loc[neurite.nodes.treenode_id == last_node][['x','y','z']]
-            # determine which volume it is in
-            location = misc.point_in_vol(last_node_coords,vols)
-
-        if limit > 15:
-            print(N.skeleton_id)
-            continue
-        # get branch points on neurite
-        # get all branch nodes within the neuron
-        dist = set(N.nodes.loc[N.nodes.type == 'branch'].treenode_id.values)
-        # keep only those which are along the primary neurite
-        dist = dist.intersection(set(neurite.nodes.treenode_id))
-        # subset to the volume
-
-        # coords of nodes
-        # get the xyz coords of these and check which are in the final volume
-        coords = pd.DataFrame()
-        for i in dist:
-            coords = pd.concat([coords,N.nodes.loc[N.nodes.treenode_id == i][['x','y','z']]], sort = False)
-
-        # binary list showing which branches are in the final volume.
-        keep = list(pymaid.in_volume(coords, pymaid.get_volume(location)))
-
-        if sum(keep) > 0:
-            dist = list(itertools.compress(dist,keep))
-
-
-            # Find the branch closest to the root
-            # of the remaining nodes, get distance to root
-            dist = pd.DataFrame.from_dict({str(n) : pymaid.dist_between(N,n,N.root) for n in dist},
-                                                   orient = 'index',
-                                                   columns = ['Dist'])
-            # Parent
-            cut = neurite.nodes.loc[neurite.nodes.treenode_id.values == int(dist['Dist'].idxmin())]['parent_id']
-            neurite.prune_distal_to(cut)
-            # Get set of nodes along neurite between parents and root (set A)
-            neurite = set(neurite.nodes.treenode_id)
-        else:
-                    # Find the branch closest to the root
-            # of the remaining nodes, get distance to root
-            dist = pd.DataFrame.from_dict({str(n) : pymaid.dist_between(N,n,N.root) for n in dist},
-                                                   orient = 'index',
-                                                   columns = ['Dist'])
-            # Parent
-            cut = neurite.nodes.loc[neurite.nodes.treenode_id.values == int(dist['Dist'].idxmax())]['parent_id']
-            neurite.prune_distal_to(cut)
-            # Get set of nodes along neurite between parents and root (set A)
-            neurite = set(neurite.nodes.treenode_id)
-
-        ### Bit TWO
-
-        # Expand the AL by some factor
-        AL_R.resize(resize)
-        AL_L.resize(resize)
-        # prune the larger AL out of the neuron
-        prune = N.prune_by_volume(AL_R,mode = 'OUT', inplace = False)
-        prune = prune.prune_by_volume(AL_L,mode = 'OUT', inplace = False)
-        # work out which nodes to keep (set of all nodes - neurite set)
-        keep = list(set(prune.nodes.treenode_id) - neurite)
-        # subset neuron
-        prune = pymaid.subset_neuron(prune, keep)
-        pruned += prune
+    Works on views of the neuron (see `PNtools.NeuronView`), so N is not changed and only the result is copied.
+    """
 
-    return (pruned)
+    with utils.stage('axon_prune.longest_neurite'):
+        ##Bit 1
+        view = topology.NeuronView(N, root = N.soma)
+        # get neurite of whole neuron, soma rooted
+        neurite = view.longest_neurite()
+        # distances to the root of every node, in one traversal
+        topo = view.topology
+    # get end node of neurite in a volume...
+    with utils.stage('axon_prune.locate_end'):
+        last_node = topo.longest_neurite()[-1]
+        last_node_coords = N.nodes[['x','y','z']].values[topo.index([last_node])]
+        # determine which volume it is in
+        location = misc.point_in_vol(last_node_coords,vols)
+
+    if len(location) == 0:
+        print(N.skeleton_id)
+        return None
+    # branch points along the primary neurite
+    dist = topo.index((view.branch_points() & neurite).node_ids)
+
+    # binary array showing which branches are in the final volume (already in vols, so no need to fetch it again)
+    coords = N.nodes[['x','y','z']].values[dist]
+    if isinstance(vols, volume_index._Labeller):
+        # VolumeLabeller or VoxelLabelGrid: look the volume up by name in the labeller's own results
+        keep = vols.in_volume(coords)[location[0]]
+    else:
+        keep = volume_index._inside(coords, vols[location[0]])
+
+    if keep.any():
+        # Find the branch closest to the root
+        # of the remaining nodes, get distance to root
+        dist = dist[keep]
+        cut = dist[np.argmin(topo.distances[dist])]
+    else:
+        # Find the branch furthest from the root
+        cut = dist[np.argmax(topo.distances[dist])]
+    # nodes along neurite between the parent of the cut and root (set A)
+    neurite = neurite.upstream_of(topo.node_ids[topo.parent[cut]])
+
+    ### Bit TWO
+
+    with utils.stage('axon_prune.remove_AL'):
+        # prune the (already expanded) AL out of the neuron, and remove set A
+        prune = view.in_volume(AL_R, mode = 'OUT').in_volume(AL_L, mode = 'OUT')
+        return (prune - neurite).materialise()
@@ -1,7 +1,57 @@
 __version__ = "0.0.1"
 
-from .misc import *
-from .processing import *
-from .connectivity_sampling import *
-from .PN_specific import *
-from .plotting import *
+import importlib
+
+# Public names, by the submodule they live in. Submodules (and their dependencies, e.g. pymaid or matplotlib) are
+# only imported the first time one of their names is used, so `import PNtools` itself is quick.
+_exports = {
+    'misc':                  ['vol_of_vol', 'volume_metrics', 'clear_volume_metrics', 'FAFB_vols', 'get_gloms',
+                              'calc_ltk', 'calc_lts', 'point_in_vol', 'seed_sheet'],
+    'processing':            ['ends_matrix', 'path_to_root', 'first_branch', 'pruning', 'cable_length_matrix'],
+    'connectivity_sampling': ['upstream_node_check', 'upstream_sheet', 'connectors_in_vol'],
+    'PN_specific':           ['PN_axon_prune'],
+    'plotting':              ['radar_plot'],
+    'volume_cache':          ['VolumeCache', 'default_cache', 'set_default_cache'],
+    'matrix_store':          ['MatrixStore'],
+    'skeleton_store':        ['SkeletonStore'],
+    'volume_index':          ['VolumeLabeller', 'VoxelLabelGrid', 'cable_per_volume', 'indexed_volume',
+                              'scaled_volume', 'prune_by_volume'],
+    'topology':              ['Topology', 'NeuronView', 'cached_topology'],
+    'connectors':            ['get_connector_details', 'clear_connector_cache'],
+    'segmentation':          ['SegmentCache', 'ArraySegmentation', 'default_segment_cache', 'set_segment_cache'],
+    'stats':                 ['permutation_test', 'bootstrap_ci'],
+    'datasource':            ['LiveSource', 'RecordingSource', 'ReplaySource', 'get_source', 'set_source', 'recording',
+                              'replaying'],
+    'parallel':              ['map_neurons', 'map_tasks'],
+    'utils':                 ['stage', 'enable_instrumentation', 'disable_instrumentation', 'clear_instrumentation',
+                              'instrumentation_trace', 'instrumentation_summary', 'export_trace'],
+}
+_submodules = list(_exports)
+_lookup = {name: module for module, names in _exports.items() for name in names}
+
+# Modules the star imports of earlier versions passed through (e.g. `PNtools.pymaid`), kept for old code: name ->
+# (module, attribute). Not part of __all__.
+_legacy = {'pymaid': ('pymaid', None), 'pd': ('pandas', None), 'np': ('numpy', None), 'itertools': ('itertools', None),
+           'tqdm': ('tqdm', 'tqdm'), 'fafbseg': ('fafbseg', None), 'plt': ('matplotlib.pyplot', None),
+           'pi': ('math', 'pi')}
+
+__all__ = [name for names in _exports.values() for name in names]
+
+def __getattr__(name):
+    if name in _lookup:
+        value = getattr(importlib.import_module('.' + _lookup[name], __name__), name)
+    elif name in _submodules:
+        value = importlib.import_module('.' + name, __name__)
+    elif name in _legacy:
+        module, attr = _legacy[name]
+        value = importlib.import_module(module)
+        if attr is not None:
+            value = getattr(value, attr)
+    else:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    # keep it, so the next look up doesn't come back here
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_submodules) | set(_legacy))
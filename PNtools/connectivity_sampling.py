@@ -1,8 +1,14 @@
 # Upstream sheet generation function
-import pymaid
-import pandas as pd
-import fafbseg
+import numpy as np
 from . import misc
+from . import utils
+from . import volume_index
+from . import connectors
+from . import segmentation
+from . import datasource
+pymaid = utils.lazy_import('pymaid')
+pd = utils.lazy_import('pandas')
+scipy_sparse = utils.lazy_import('scipy.sparse')
 
 def upstream_node_check(neurons,volume = None):
     """ Check if upstream connectors have a node attached to them. If not, creates a DataFrame with URLs to v14 at site of the connector.
@@ -30,25 +36,46 @@ def upstream_node_check(neurons,volume = None):
     if isinstance(neurons,pymaid.CatmaidNeuron):
         neurons = pymaid.CatmaidNeuronList(neurons)
 
-    # get missing bits
-    missing_pre = pd.DataFrame()
-    for i in neurons:
-        conn = pymaid.get_connector_details(i.postsynapses)
-        missing = conn[conn.presynaptic_to_node.isnull()].connector_id.values
-        missing = i.connectors[i.connectors.connector_id.isin(missing)]
-        missing_pre = pd.concat([missing_pre,missing])
-    missing_pre = missing_pre[['connector_id','x','y','z']]
+    # nothing to check if there are no neurons, or none with postsynapses (in the volume)
+    postsynapses = [i.postsynapses for i in neurons if len(i.postsynapses)]
+    if len(postsynapses) == 0:
+        return(None)
 
-    # generate URLs
-    coords = [[missing_pre.loc[i].x , missing_pre.loc[i].y, missing_pre.loc[i].z] for i in missing_pre.index]
-    missing_pre['Manual_URL'] = [pymaid.url_to_coordinates(coords[i],5) for i in range(len(coords))]
+    # get missing bits, fetching details for the connectors of all neurons in one go
+    conn = connectors.get_connector_details(pd.concat(postsynapses))
+    missing = conn[conn.presynaptic_to_node.isnull()].connector_id.values
+    missing_pre = pd.concat([i.connectors[i.connectors.connector_id.isin(missing)] for i in neurons])
+    missing_pre = missing_pre[['connector_id','x','y','z']]
 
     if len(missing_pre) == 0:
         return(None)
-    else:
-        return(missing_pre)
 
-def upstream_sheet(neuron,volume = None,order='manual',auto_version = 'v3'):
+    # generate URLs
+    missing_pre['Manual_URL'] = _urls(missing_pre)
+    return(missing_pre)
+
+def _urls(data, auto_version = None):
+    """ URLs to the x/y/z coordinates of each row of data in v14 and, if auto_version is given, in the autoseg instance."""
+    manual = pd.Series(datasource.url_to_coordinates(data[['x','y','z']].values, 5), index = data.index)
+    if auto_version is None:
+        return manual
+    return manual, manual.str.replace('v14', auto_version, regex = False)
+
+def _upstream_nodes(conn):
+    """ Upstream treenodes of a set of connectors, with the connector each one belongs to."""
+    conn = conn.dropna(subset = ['presynaptic_to_node'])
+    upstream = datasource.find_treenodes(treenode_ids = list(conn.presynaptic_to_node.values))
+    # join on (node, skeleton) with a hashed merge, keeping the first connector of each, as before
+    links = pd.DataFrame({'treenode_id': conn.presynaptic_to_node.values.astype('int64'),
+                          'skid': conn.presynaptic_to.values.astype('int64'),
+                          'connector_id': conn.connector_id.values}).drop_duplicates(['treenode_id','skid'])
+    upstream = upstream.assign(treenode_id = upstream.treenode_id.astype('int64'),
+                               skid = upstream.skeleton_id.astype('int64'))
+    upstream = upstream.merge(links, on = ['treenode_id','skid'], how = 'left')
+    return upstream[['skeleton_id','treenode_id','connector_id','parent_id','x','y','z']]
+
+@utils.stage('upstream_sheet')
+def upstream_sheet(neuron,volume = None,order='manual',auto_version = 'v3', missing = None, seg_cache = None):
     """ Generate a sheet with urls for all upstream neurons of a neuron.
 
     By default will try to order the output by number of inputs. If you have connectors without an upstream
@@ -56,7 +83,8 @@ def upstream_sheet(neuron,volume = None,order='manual',auto_version = 'v3'):
     instead.
 
     IMPORTANT: if using order = 'auto' you NEED to use fafbseg.use_google_storage, fafbseg.use_brainmaps or fafbseg.use_remote_service
-    to set the way you want to fetch segmentation IDs.
+    to set the way you want to fetch segmentation IDs. Segmentation IDs are cached (see `PNtools.SegmentCache`), so only
+    locations not looked up before are sent to fafbseg.
 
     Perameters
     ----------
@@ -77,6 +105,15 @@ def upstream_sheet(neuron,volume = None,order='manual',auto_version = 'v3'):
     auto_version:   str
                     The autoseg version to use, default is 'v3' but 'v2' and 'v1' are also accepted
 
+    missing:        Bool
+                    What to return if some connectors have no upstream node. If True, returns the sheet of those
+                    connectors, if False the upstream sheet anyway. If None (default), asks. Set this to run
+                    without a prompt, e.g. in batch jobs.
+
+    seg_cache:      SegmentCache
+                    Cache to look up segmentation IDs through if order = 'auto'. If not given, the session cache from
+                    `PNtools.default_segment_cache` is used.
+
     Returns
     -------
 
@@ -89,13 +126,12 @@ def upstream_sheet(neuron,volume = None,order='manual',auto_version = 'v3'):
     if volume is not None:
         neuron = pymaid.in_volume(neuron,volume)
 
-    # Get connectors
-    conn = pymaid.get_connector_details(neuron.postsynapses)
+    # Get connectors (remembered for the rest of the session, so checking for missing upstream nodes is free)
+    with utils.stage('upstream_sheet.connectors'):
+        conn = connectors.get_connector_details(neuron.postsynapses)
     # get upstream nodes/neurons
-    upstream = pymaid.find_treenodes(treenode_ids = list(conn.presynaptic_to_node.values))
-    upstream['connector_id'] = [conn.loc[((conn.presynaptic_to_node == upstream.loc[i].treenode_id)
-                                      & (conn.presynaptic_to == upstream.loc[i].skeleton_id))].connector_id.values[0] for i in upstream.index]
-    upstream = upstream[['skeleton_id','treenode_id','connector_id','parent_id','x','y','z']]
+    with utils.stage('upstream_sheet.upstream_nodes'):
+        upstream = _upstream_nodes(conn)
 
     if auto_version == 'v3':
         auto_version = 'v14-seg-li-190805.0'
@@ -104,10 +140,13 @@ def upstream_sheet(neuron,volume = None,order='manual',auto_version = 'v3'):
     elif auto_version == 'v1':
         auto_version = 'v14-seg'
 
-    # Check for connectors with no upstream node
-    missing_pre = upstream_node_check(neuron,volume)
+    # Check for connectors with no upstream node (neuron has already been pruned to volume)
+    with utils.stage('upstream_sheet.missing_check'):
+        missing_pre = upstream_node_check(neuron)
 
     ans = 'z'
+    if missing is not None and missing_pre is not None:
+        ans = 'y' if missing else 'n'
 
     while ans not in ['y','n']:
         if missing_pre is not None:
@@ -125,13 +164,15 @@ def upstream_sheet(neuron,volume = None,order='manual',auto_version = 'v3'):
         data = upstream
 
     if ans == 'n':
-        # Add list of x,y,z coords and URLs
-        coords = [[data.loc[i].x , data.loc[i].y, data.loc[i].z] for i in data.index]
-        data['Manual_URL'] = [pymaid.url_to_coordinates(coords[i],5) for i in range(len(coords))]
-        data['Auto_URL'] = [data.Manual_URL[i].replace('v14', auto_version) for i in range(len(data.Manual_URL))]
+        # Add URLs for all rows at once
+        with utils.stage('upstream_sheet.urls'):
+            data['Manual_URL'], data['Auto_URL'] = _urls(data, auto_version)
         if order == 'auto':
             # add fragment id column
-            data['Fragment_id'] = fafbseg.segmentation.get_seg_ids(coords)
+            if seg_cache is None:
+                seg_cache = segmentation.default_segment_cache()
+            with utils.stage('upstream_sheet.seg_ids'):
+                data['Fragment_id'] = seg_cache.get_seg_ids(data[['x','y','z']].values)
             # order
             grouper = data.groupby('Fragment_id')
             N_dict = grouper.treenode_id.count().to_dict()
@@ -149,7 +190,8 @@ def upstream_sheet(neuron,volume = None,order='manual',auto_version = 'v3'):
             data = data.sample(frac=1).reset_index(drop = True)
     return(data)
 
-def connectors_in_vol(source, volumes = None, direction = 'Both', count = False):
+@utils.stage('connectors_in_vol')
+def connectors_in_vol(source, volumes = None, direction = 'Both', count = False, sparse = False):
     """ Returns the volume(s) a neuron(s) synapses are located in.
 
     Parameters
@@ -161,9 +203,11 @@ def connectors_in_vol(source, volumes = None, direction = 'Both', count = False)
                 with the relevant information in.
                 A list of connector IDs can be passed, in which case skids will be determined as the presynaptic neuron.
 
-    volumes:    Volume
+    volumes:    Volume | dict | VolumeLabeller | VoxelLabelGrid
                 The volume(s) to count connectos in. If not given, falls back to a list of all volumes used to
-                make up the FAFB full neuropil volume. See `PNtools.FAFB_vols`.
+                make up the FAFB full neuropil volume. See `PNtools.FAFB_vols`. A VolumeLabeller labels every
+                connector against all volumes in a single pass, and a VoxelLabelGrid by looking up precomputed
+                labels (see `PNtools.VoxelLabelGrid`).
 
     direction:  str
                 'Both' (default) returns all connectors, 'Presynaptic' returns output sites, and 'Postsynaptic'
@@ -173,7 +217,13 @@ def connectors_in_vol(source, volumes = None, direction = 'Both', count = False)
                 If False (default) DataFrame with each connector as a row is returned, with a column for skid, and
                 a column for the volume the connector is in.
                 If True a DataFrame is returned with a row for each volume, and each column as a neuron, where values
-                are a count of the number of connectors that neuron has within the volume.
+                are a count of the number of connectors that neuron has within the volume. All connectors are
+                labelled in one pass and counted together, whatever the number of neurons.
+
+    sparse:     Bool
+                Only used if count is True. If True, return the counts as a volumes by neurons scipy.sparse CSR
+                matrix instead of a DataFrame, with the row (volume name) and column (skid) labels. Much smaller
+                than the DataFrame when most neurons have connectors in only a few volumes.
 
     Returns
     -------
@@ -182,6 +232,9 @@ def connectors_in_vol(source, volumes = None, direction = 'Both', count = False)
                 Either a connectors by [Skids, Volume] data frame, or a Volume by neurons data frame with connector counts
                 (see count option above).
 
+    (csr_matrix, Index, Index)
+                If count and sparse are True: the volumes by neurons counts, the volume names and the skids.
+
     """
 
     # if source is neuron/neuron list get connectors data frame
@@ -199,10 +252,10 @@ def connectors_in_vol(source, volumes = None, direction = 'Both', count = False)
     if isinstance(source, list):
 
         # get node locations, order by node_id
-        source = pymaid.get_node_location(source)
+        source = datasource.get_node_location(source)
         source = source.sort_values(by = 'node_id', axis = 0)
         # get connector deets, order by connector id
-        conn = pymaid.get_connector_details(source.node_id)
+        conn = datasource.get_connector_details(source.node_id)
         conn = conn.sort_values(by = 'connector_id', axis = 0)
         # add skeleton id col. from connector deets to node locations etc...
         source['skeleton_id'] = conn.presynaptic_to
@@ -214,17 +267,21 @@ def connectors_in_vol(source, volumes = None, direction = 'Both', count = False)
     elif isinstance(volumes, pymaid.Volume):
         volumes = {volumes.name : volumes}
 
-    skids = set(source.skeleton_id)
-    skids = [str(s) for s in skids]
-    # for each unique skid in source:
     data = pd.DataFrame()
     if count:
-        for s in skids:
-            # subset source to that skid, then get dictionary
-            dictionary = pymaid.in_volume(source.loc[source.skeleton_id == s],volumes)
-            data = pd.concat([data,pd.DataFrame.from_dict({n:sum(dictionary[n]) for n in dictionary.keys()},
-                                          orient = 'index',
-                                          columns = [str(s)])],axis = 1)
+        # label every connector once, then count (volume, skid) pairs in one go
+        codes, skids = pd.factorize(source.skeleton_id.astype(str).values)
+        pi, vi, names = volume_index._hits(source, volumes)
+        counts = scipy_sparse.coo_matrix((np.ones(len(pi), dtype = np.int64), (vi, codes[pi])),
+                                         shape = (len(names), len(skids))).tocsr()
+        if sparse:
+            return counts, pd.Index(names), pd.Index(skids)
+        data = pd.DataFrame(counts.toarray(), index = names, columns = skids)
+    elif isinstance(volumes, (volume_index.VolumeLabeller, volume_index.VoxelLabelGrid)):
+        data = pd.DataFrame(data = source.skeleton_id.values,
+                               index = source.connector_id,
+                               columns = ['skeleton_id'])
+        data['Volume'] = volumes.label(source)
     else:
         dictionary = pymaid.in_volume(source,volumes)
         data = pd.DataFrame(data = source.skeleton_id.values,
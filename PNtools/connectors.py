@@ -0,0 +1,96 @@
+# Bulk, memoised fetching of connector details
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from . import datasource
+from . import utils
+pd = utils.lazy_import('pandas')
+
+# Connector details fetched this session, per (server, project): the frames as they were fetched, one per chunk,
+# and where in them each connector ID is, so a call only concatenates the rows it asks for
+_chunks = {}
+_where = {}
+_fetched = {}
+_lock = threading.Lock()
+
+_COLUMNS = ['connector_id', 'presynaptic_to', 'postsynaptic_to', 'presynaptic_to_node', 'postsynaptic_to_node']
+
+def get_connector_details(connectors, chunk_size = 1000, max_workers = 4, remote_instance = None):
+    """ Get connector details, fetching each connector from CATMAID at most once per session.
+
+    Connector IDs not already fetched are requested in chunks, several chunks at a time, and the results kept in
+    memory. Functions such as `upstream_sheet` and `upstream_node_check` which need the same connectors
+    therefore only pay for them once.
+
+    Parameters
+    ----------
+
+    connectors:         list | array | DataFrame
+                        Connector IDs, or a data frame with a 'connector_id' column (e.g. `neurons.postsynapses`).
+
+    chunk_size:         int
+                        Number of connectors per request.
+
+    max_workers:        int
+                        Number of requests to run at the same time.
+
+    remote_instance:    CatmaidInstance
+                        Instance to fetch from. If not given, falls back to the global instance.
+
+    Returns
+    -------
+
+    DataFrame
+                        Connector details in the format of `pymaid.get_connector_details`, one row per unique
+                        connector ID, in the order they were given.
+
+    """
+    if isinstance(connectors, pd.DataFrame):
+        connectors = connectors.connector_id.values
+    ids = pd.unique(np.asarray(connectors, dtype = np.int64))
+
+    key = datasource.instance_key(remote_instance)
+    with _lock:
+        fetched = _fetched.setdefault(key, set())
+        missing = [i for i in ids.tolist() if i not in fetched]
+
+    if missing:
+        # fetched without holding the lock, so other threads can read the cache meanwhile
+        chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+        with ThreadPoolExecutor(max_workers) as pool:
+            frames = list(pool.map(lambda c: datasource.get_connector_details(c, remote_instance = remote_instance), chunks))
+        with _lock:
+            _add(key, [f for f in frames if f is not None and len(f)])
+            fetched.update(missing)
+
+    with _lock:
+        frames = _chunks.get(key, [])
+        where = _where.get(key, {})
+        found = np.array([where[i] for i in ids.tolist() if i in where], dtype = np.int64).reshape(-1, 2)
+    if not len(found):
+        return frames[0].iloc[:0] if frames else pd.DataFrame(columns = _COLUMNS)
+
+    # rows of each chunk that was asked for, put back in the order they were given
+    chunk, row = found[:, 0], found[:, 1]
+    order = np.argsort(chunk, kind = 'stable')
+    starts = np.flatnonzero(np.concatenate([[True], chunk[order][1:] != chunk[order][:-1]]))
+    pieces = [frames[c].iloc[r] for c, r in zip(chunk[order][starts], np.split(row[order], starts[1:]))]
+    details = pd.concat(pieces, ignore_index = True)
+    return details.iloc[np.argsort(order)].reset_index(drop = True)
+
+def _add(key, frames):
+    """ Add fetched frames to the cache of `key`. Later rows of a connector replace earlier ones."""
+    chunks = _chunks.setdefault(key, [])
+    where = _where.setdefault(key, {})
+    for f in frames:
+        f = f.reset_index(drop = True)
+        f['connector_id'] = f.connector_id.astype(np.int64)
+        where.update(zip(f.connector_id.tolist(), ((len(chunks), r) for r in range(len(f)))))
+        chunks.append(f)
+
+def clear_connector_cache():
+    """ Forget all connector details fetched this session, e.g. after connectors have been edited."""
+    with _lock:
+        _chunks.clear()
+        _where.clear()
+        _fetched.clear()
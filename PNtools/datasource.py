@@ -0,0 +1,221 @@
+# Pluggable source of CATMAID data - live, recording to an archive, or replaying from one
+import os
+import json
+import time
+import pickle
+import hashlib
+import threading
+import contextlib
+import numpy as np
+from . import utils
+pymaid = utils.lazy_import('pymaid')
+pd = utils.lazy_import('pandas')
+
+class LiveSource:
+    """ Fetches everything straight from CATMAID through pymaid. This is the default source."""
+
+    def __repr__(self):
+        return '<{}>'.format(type(self).__name__)
+
+    def is_available(self):
+        """ True if there is a global CatmaidInstance to fetch from."""
+        pymaid.set_loggers('ERROR')
+        rm = pymaid.utils._eval_remote_instance(None, raise_error = False)
+        pymaid.set_loggers('INFO')
+        return bool(rm)
+
+    def instance_key(self, remote_instance = None):
+        """ (server, project ID) of the given instance, or of the global one."""
+        rm = pymaid.utils._eval_remote_instance(remote_instance)
+        return (rm.server, rm.project_id)
+
+    def call(self, name, *args, **kwargs):
+        """ Call the pymaid function `name`."""
+        return getattr(pymaid, name)(*args, **kwargs)
+
+class RecordingSource(LiveSource):
+    """ Fetches from CATMAID like LiveSource, and keeps every response in an archive for `ReplaySource`.
+
+    The archive is a directory holding one pickle per call, plus a manifest.json listing which function each
+    response came from. Recording into an existing archive adds to it.
+
+    Parameters
+    ----------
+
+    path:       str
+                Directory to keep the archive in.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+        self._lock = threading.Lock()
+        self._manifest = _read_manifest(path)
+
+    def __repr__(self):
+        return '<RecordingSource: {} responses at {}>'.format(len(self._manifest['calls']), self.path)
+
+    def call(self, name, *args, **kwargs):
+        res = super().call(name, *args, **kwargs)
+        key = fingerprint(name, args, kwargs)
+        with open(os.path.join(self.path, key + '.pkl'), 'wb') as f:
+            pickle.dump(res, f, protocol = pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if self._manifest['instance'] is None:
+                self._manifest['instance'] = list(self.instance_key(kwargs.get('remote_instance')))
+            self._manifest['calls'][key] = name
+            _write_manifest(self.path, self._manifest)
+        return res
+
+class ReplaySource:
+    """ Serves responses recorded by `RecordingSource`, without any network access.
+
+    Calls are matched on the function name and arguments, so a pipeline replays exactly if it makes the same
+    calls, with the same arguments, as when it was recorded. The `remote_instance` argument is only matched on
+    the server and project it points to.
+
+    Parameters
+    ----------
+
+    path:       str
+                Directory of the recorded archive.
+
+    """
+
+    def __init__(self, path):
+        if not os.path.isfile(os.path.join(path, 'manifest.json')):
+            raise ValueError('No recorded archive at {}'.format(path))
+        self.path = path
+        self._manifest = _read_manifest(path)
+
+    def __repr__(self):
+        return '<ReplaySource: {} responses at {}>'.format(len(self._manifest['calls']), self.path)
+
+    def is_available(self):
+        return True
+
+    def instance_key(self, remote_instance = None):
+        if remote_instance is not None:
+            return (remote_instance.server, remote_instance.project_id)
+        return tuple(self._manifest['instance'] or ('replay', 0))
+
+    def call(self, name, *args, **kwargs):
+        key = fingerprint(name, args, kwargs)
+        if key not in self._manifest['calls']:
+            raise KeyError('No recorded response for {} with these arguments in {}'.format(name, self.path))
+        with open(os.path.join(self.path, key + '.pkl'), 'rb') as f:
+            return pickle.load(f)
+
+_source = LiveSource()
+
+def get_source():
+    """ Returns the data source currently used by PNtools."""
+    return _source
+
+def set_source(source):
+    """ Set the data source used by PNtools.
+
+    Parameters
+    ----------
+
+    source:     LiveSource | RecordingSource | ReplaySource | None
+                Source to use. None goes back to the live server.
+
+    """
+    global _source
+    _source = LiveSource() if source is None else source
+
+@contextlib.contextmanager
+def recording(path):
+    """ Context manager recording every CATMAID response PNtools gets into the archive at `path`."""
+    previous = get_source()
+    set_source(RecordingSource(path))
+    try:
+        yield _source
+    finally:
+        set_source(previous)
+
+@contextlib.contextmanager
+def replaying(path):
+    """ Context manager serving CATMAID responses from the archive at `path`, instead of the server."""
+    previous = get_source()
+    set_source(ReplaySource(path))
+    try:
+        yield _source
+    finally:
+        set_source(previous)
+
+def instance_key(remote_instance = None):
+    """ (server, project ID) identifying the instance data comes from, for keying caches."""
+    return _source.instance_key(remote_instance)
+
+def fingerprint(name, args, kwargs):
+    """ Hash identifying a call to the pymaid function `name` with the given arguments."""
+    kwargs = dict(kwargs)
+    rm = kwargs.pop('remote_instance', None)
+    if rm is not None:
+        kwargs['remote_instance'] = (rm.server, rm.project_id)
+    desc = repr((name, _plain(list(args)), _plain(kwargs)))
+    return hashlib.sha1(desc.encode()).hexdigest()
+
+def _plain(x):
+    """ Turn arguments into plain, consistently ordered python objects, so equal arguments repr the same."""
+    if isinstance(x, dict):
+        return sorted((str(k), _plain(v)) for k, v in x.items())
+    if isinstance(x, (set, frozenset)):
+        return sorted(_plain(v) for v in x)
+    if isinstance(x, (list, tuple)):
+        return [_plain(v) for v in x]
+    if isinstance(x, (pd.Series, pd.Index)):
+        return _plain(x.values)
+    if isinstance(x, pd.DataFrame):
+        return [list(x.columns), [_plain(x.iloc[:, i].values) for i in range(x.shape[1])]]
+    if isinstance(x, np.ndarray):
+        # hash the data rather than spelling it out - arguments can be whole tables
+        data = pd.util.hash_array(x.ravel()) if x.dtype == object else np.ascontiguousarray(x)
+        return [list(x.shape), x.dtype.str, hashlib.sha1(data.tobytes()).hexdigest()]
+    if isinstance(x, np.generic):
+        return x.item()
+    return x
+
+def _read_manifest(path):
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {'instance': None, 'calls': {}}
+
+def _write_manifest(path, manifest):
+    tmp = os.path.join(path, 'manifest.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(path, 'manifest.json'))
+
+# The CATMAID calls PNtools makes, routed through the current source
+def _call(name, *args, **kwargs):
+    if not utils._enabled:
+        return _source.call(name, *args, **kwargs)
+    # count the call, its time and the size of the response
+    start = time.perf_counter()
+    res = _source.call(name, *args, **kwargs)
+    utils._record(name, 'remote', start, time.perf_counter(), utils.payload_size(res))
+    return res
+
+def get_volume(*args, **kwargs):
+    return _call('get_volume', *args, **kwargs)
+
+def get_neurons(*args, **kwargs):
+    return _call('get_neurons', *args, **kwargs)
+
+def get_connector_details(*args, **kwargs):
+    return _call('get_connector_details', *args, **kwargs)
+
+def find_treenodes(*args, **kwargs):
+    return _call('find_treenodes', *args, **kwargs)
+
+def get_node_location(*args, **kwargs):
+    return _call('get_node_location', *args, **kwargs)
+
+def url_to_coordinates(*args, **kwargs):
+    return _call('url_to_coordinates', *args, **kwargs)
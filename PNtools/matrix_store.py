@@ -0,0 +1,230 @@
+# On-disk store of neuron by volume matrices, recomputing only the rows of neurons which changed
+import os
+import hashlib
+import numpy as np
+from . import utils
+from . import datasource
+from . import volume_index
+pymaid = utils.lazy_import('pymaid')
+pd = utils.lazy_import('pandas')
+
+def _cable(neurons, volumes, **kwargs):
+    from .processing import cable_length_matrix
+    return cable_length_matrix(neurons, volumes, **kwargs)
+
+def _ends(neurons, volumes, **kwargs):
+    from .processing import ends_matrix
+    return ends_matrix(neurons, volumes, **kwargs)
+
+def _connectors(neurons, volumes, **kwargs):
+    from .connectivity_sampling import connectors_in_vol
+    return connectors_in_vol(neurons, volumes, count = True, **kwargs).T
+
+# Matrices the store knows how to build: name -> (function returning neurons by volumes, transpose on the way out)
+_KINDS = {'cable_length_matrix': (_cable, False),
+          'ends_matrix':         (_ends, False),
+          'connectors_in_vol':   (_connectors, True)}
+
+class MatrixStore:
+    """ On-disk store of neuron by volume matrices, kept one row per neuron.
+
+    Each row is stored with the skeleton ID and edition of the neuron it was computed from, in a table keyed by
+    the kind of matrix, a hash of the volume set (names and meshes) and any other arguments. When a matrix is asked
+    for again, only the rows of new neurons, or neurons whose edition has changed, are recomputed - the rest of
+    the matrix comes straight from disk. Rebuilding e.g. the cable matrix of a few thousand neurons, of which a
+    few dozen changed since the last run, only costs those few dozen.
+
+    The edition of a neuron is taken from `editions` if given, otherwise from the latest `edition_time` of its
+    nodes if there is such a column, otherwise from a hash of its nodes and connectors.
+
+    Parameters
+    ----------
+
+    path:       str
+                Directory to keep the store in.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+
+    def __repr__(self):
+        return '<MatrixStore: {} tables at {}>'.format(len(self._tables()), self.path)
+
+    def __len__(self):
+        return len(self._tables())
+
+    def matrix(self, kind, neurons, volumes, editions = None, **kwargs):
+        """ Get a matrix, recomputing only stale or missing rows.
+
+        Parameters
+        ----------
+
+        kind:       str
+                    'cable_length_matrix', 'ends_matrix' or 'connectors_in_vol' (the count=True form).
+
+        neurons:    CatmaidNeuron | CatmaidNeuronList | list
+                    Neuron(s), or a list of skids. If skids are given, `editions` is required and only the neurons
+                    with stale rows are fetched.
+
+        volumes:    Volume | dict | VolumeLabeller | VoxelLabelGrid
+                    Volume(s), as accepted by the function for `kind`.
+
+        editions:   dict | Series
+                    (optional) Skid to last edition (e.g. the timestamp of the last change) of each neuron.
+
+        **kwargs
+                    Passed on to the function for `kind`, e.g. method = 'clip' or direction = 'Presynaptic'. Rows
+                    computed with different arguments are stored separately - except for data frames with a row per
+                    neuron (e.g. the `mask` of cable_length_matrix), where a neuron's row is only recomputed if its
+                    row of the frame has changed.
+
+        Returns
+        -------
+
+        DataFrame
+                    Same layout as the function for `kind` returns: neurons by volumes, except for connectors_in_vol
+                    which is volumes by neurons.
+
+        """
+        if kind not in _KINDS:
+            raise ValueError('kind must be one of {}'.format(list(_KINDS)))
+        func, transpose = _KINDS[kind]
+
+        if isinstance(neurons, pymaid.CatmaidNeuron):
+            neurons = pymaid.CatmaidNeuronList(neurons)
+        fetch = not isinstance(neurons, pymaid.CatmaidNeuronList)
+        if fetch:
+            if editions is None:
+                raise ValueError('editions are needed to tell which neurons are stale when only skids are given')
+            skids = [str(s) for s in neurons]
+            stamps = [str(editions[s] if s in editions else editions[int(s)]) for s in skids]
+        else:
+            skids = [str(n.skeleton_id) for n in neurons]
+            stamps = [_edition(n, editions) for n in neurons]
+
+        # data frames with a row per neuron (e.g. a mask) are kept out of the key, and a hash of each neuron's row
+        # goes with its edition instead - so editing the frame only makes the rows of the neurons it changed stale
+        frames = {k: v for k, v in kwargs.items() if isinstance(v, pd.DataFrame)}
+        plain = dict(kwargs, **{k: 'per neuron' for k in frames})
+        for k in sorted(frames):
+            stamps = ['{}|{}:{}'.format(e, k, h) for e, h in zip(stamps, _row_hashes(frames[k], skids))]
+
+        key = datasource.fingerprint(kind, [_volume_hash(volumes)], plain)
+        rows, stored = self._load(key)
+        stale = [i for i, (s, e) in enumerate(zip(skids, stamps)) if stored.get(s) != e]
+
+        if stale:
+            with utils.stage('matrix_store.compute'):
+                if fetch:
+                    todo = datasource.get_neurons([skids[i] for i in stale])
+                    if isinstance(todo, pymaid.CatmaidNeuron):
+                        todo = pymaid.CatmaidNeuronList(todo)
+                else:
+                    todo = pymaid.CatmaidNeuronList([neurons[i] for i in stale])
+                fresh = func(todo, volumes, **kwargs)
+            fresh.index = fresh.index.astype(str)
+            # neurons without anything in any volume may be missing from the output altogether. Fill masks
+            # (as_mask = True) with False, so they stay bool rather than becoming objects
+            fill = False if len(fresh.columns) and (fresh.dtypes == bool).all() else 0
+            fresh = fresh.reindex([skids[i] for i in stale], fill_value = fill)
+            if len(rows.columns):
+                fresh = fresh.reindex(columns = rows.columns, fill_value = fill)
+            rows = fresh if rows.empty else pd.concat([rows.drop(fresh.index, errors = 'ignore'), fresh])
+            stored.update({skids[i]: stamps[i] for i in stale})
+            self._save(key, rows, stored)
+
+        out = rows.loc[skids]
+        return out.T if transpose else out
+
+    def cable_length_matrix(self, neurons, volumes, editions = None, **kwargs):
+        """ `PNtools.cable_length_matrix`, recomputing only stale rows. See `matrix`."""
+        return self.matrix('cable_length_matrix', neurons, volumes, editions, **kwargs)
+
+    def ends_matrix(self, neurons, volumes, editions = None, **kwargs):
+        """ `PNtools.ends_matrix`, recomputing only stale rows. See `matrix`."""
+        return self.matrix('ends_matrix', neurons, volumes, editions, **kwargs)
+
+    def connectors_in_vol(self, neurons, volumes, editions = None, **kwargs):
+        """ `PNtools.connectors_in_vol` with count = True, recomputing only stale columns. See `matrix`."""
+        return self.matrix('connectors_in_vol', neurons, volumes, editions, **kwargs)
+
+    def clear(self):
+        """ Remove every stored table."""
+        for f in self._tables():
+            os.remove(os.path.join(self.path, f))
+
+    def _tables(self):
+        return [f for f in os.listdir(self.path) if f.endswith('.npz')]
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def _load(self, key):
+        if not os.path.isfile(self._file(key)):
+            return pd.DataFrame(), {}
+        with np.load(self._file(key), allow_pickle = False) as f:
+            rows = pd.DataFrame(f['values'], index = f['skids'].astype(str), columns = f['columns'].tolist())
+            stored = dict(zip(f['skids'].astype(str), f['editions'].astype(str)))
+        return rows, stored
+
+    def _save(self, key, rows, stored):
+        tmp = self._file(key) + '.tmp.npz'
+        np.savez(tmp,
+                 values = _values(rows),
+                 skids = np.asarray(rows.index, dtype = str),
+                 columns = np.asarray(rows.columns, dtype = str),
+                 editions = np.asarray([stored[s] for s in rows.index], dtype = str))
+        os.replace(tmp, self._file(key))
+
+def _values(rows):
+    """ Values of a matrix as bool, int64 or float64, so they are saved without pickling."""
+    kinds = {dtype.kind for dtype in rows.dtypes}
+    if kinds <= {'b'}:
+        return rows.values.astype(bool)
+    if kinds <= {'b', 'i', 'u'}:
+        return rows.values.astype(np.int64)
+    return rows.values.astype(np.float64)
+
+def _edition(neuron, editions = None):
+    """ Edition of a neuron: from `editions`, the latest node edition time, or a hash of its nodes and connectors."""
+    skid = str(neuron.skeleton_id)
+    if editions is not None:
+        if skid in editions:
+            return str(editions[skid])
+        if skid.isdigit() and int(skid) in editions:
+            return str(editions[int(skid)])
+    if 'edition_time' in neuron.nodes.columns:
+        return str(neuron.nodes.edition_time.max())
+    h = hashlib.sha1(pd.util.hash_pandas_object(neuron.nodes[['treenode_id','parent_id','x','y','z']],
+                                                index = False).values.tobytes())
+    connectors = getattr(neuron, 'connectors', None)
+    if connectors is not None and len(connectors):
+        h.update(pd.util.hash_pandas_object(connectors[['connector_id','x','y','z']], index = False).values.tobytes())
+    return 'hash:' + h.hexdigest()
+
+def _row_hashes(frame, skids):
+    """ Hash of each neuron's row of a data frame indexed by skid (with its columns), or '' if it has none."""
+    frame = frame.set_axis(frame.index.astype(str), axis = 0)
+    frame = frame[~frame.index.duplicated(keep = 'last')]
+    columns = hashlib.sha1(repr([str(c) for c in frame.columns]).encode()).hexdigest()
+    hashes = pd.util.hash_pandas_object(frame, index = True).astype(str)
+    return [columns + hashes[s] if s in hashes.index else '' for s in skids]
+
+def _volume_hash(volumes):
+    """ Hash of the names and meshes of a set of volumes."""
+    if isinstance(volumes, volume_index.VoxelLabelGrid):
+        if volumes.labeller is not None:
+            return _volume_hash(volumes.labeller)
+        h = hashlib.sha1(repr((volumes.names, volumes.origin.tolist(), volumes.resolution.tolist())).encode())
+        h.update(np.ascontiguousarray(volumes.labels).tobytes())
+        return h.hexdigest()
+    if isinstance(volumes, volume_index.VolumeLabeller):
+        volumes = volumes.volumes
+    if isinstance(volumes, pymaid.Volume):
+        volumes = {volumes.name: volumes}
+    h = hashlib.sha1()
+    for name in sorted(volumes):
+        h.update('{}|{}|'.format(name, volume_index._mesh_hash(volumes[name])).encode())
+    return h.hexdigest()
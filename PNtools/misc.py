@@ -1,11 +1,18 @@
-import pymaid
-import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from . import utils
+from . import datasource
+from . import volume_cache
+from . import volume_index
+pymaid = utils.lazy_import('pymaid')
+pd = utils.lazy_import('pandas')
+trimesh = utils.lazy_import('trimesh')
 
 def vol_of_vol(volumes):
     """ Get the volume of volumes in CATMAID in nanometers cubed.
 
+    Volumes are looked up in the session cache of `volume_metrics`, so asking again for the same meshes is free.
+
     Parameters
     ----------
     volumes:     Volume | dict
@@ -16,17 +23,75 @@ def vol_of_vol(volumes):
     DataFrame
                  A data frame with the volume in nanomters cubed of each volume passed.
 
+    """
+    return volume_metrics(volumes)[['Volume']]
+
+def volume_metrics(volumes, max_workers = 4):
+    """ Volume, surface area, bounding box and watertightness of volume meshes.
+
+    Metrics are remembered for the rest of the session, keyed by a hash of each mesh's vertices and faces, so they
+    are only computed once for each mesh however many times they are asked for (and recomputed if a mesh changes;
+    `clear_volume_metrics` forgets them all).
+    Meshes not seen before are measured on a pool of threads.
+
+    Parameters
+    ----------
+    volumes:        Volume | dict
+                    Either a pymaid volume, or a dictionary of pymaid volumes.
+
+    max_workers:    int
+                    Number of meshes to measure at the same time.
+
+    Returns
+    -------
+    DataFrame
+                    One row per volume, with columns 'Volume' (nm^3), 'Area' (nm^2), 'xmin', 'ymin', 'zmin', 'xmax',
+                    'ymax', 'zmax' and 'Watertight'.
+
     """
     if isinstance(volumes, pymaid.Volume):
         volumes = {volumes.name: volumes}
 
-    volumes = pd.DataFrame(data = [volumes[a].to_trimesh().volume for a in volumes],
-                           index = volumes.keys(),
-                           columns = ['Volume'])
-    return (volumes)
+    keys = {n: volume_index._mesh_hash(v) for n, v in volumes.items()}
+    todo = {k: volumes[n] for n, k in keys.items() if k not in _metrics}
+    if todo:
+        with ThreadPoolExecutor(max_workers) as pool:
+            _metrics.update(zip(todo, pool.map(_measure, todo.values())))
+
+    return pd.DataFrame([_metrics[keys[n]] for n in volumes], index = list(volumes),
+                        columns = ['Volume', 'Area', 'xmin', 'ymin', 'zmin', 'xmax', 'ymax', 'zmax', 'Watertight'])
+
+# Metrics of each mesh measured this session, by content hash
+_metrics = {}
+
+def clear_volume_metrics():
+    """ Forget the metrics of all meshes measured this session, e.g. to free memory after many one-off meshes."""
+    _metrics.clear()
+
+def _measure(volume):
+    """ Metrics of a single mesh."""
+    verts = np.asarray(volume.vertices, dtype = np.float64)
+    faces = np.asarray(volume.faces, dtype = np.int64)
+    a, b, c = verts[faces[:, 0]], verts[faces[:, 1]], verts[faces[:, 2]]
+    area = np.linalg.norm(np.cross(b - a, c - a), axis = 1).sum() / 2
+    # watertight: every edge shared by exactly two faces, in opposite directions
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    n = len(verts)
+    directed = np.unique(edges[:, 0] * n + edges[:, 1])
+    _, counts = np.unique(edges.min(axis = 1) * n + edges.max(axis = 1), return_counts = True)
+    watertight = len(directed) == len(edges) and bool(np.all(counts == 2))
+    if watertight:
+        # sum of signed tetrahedra from the origin to each face: consistent winding, so only the sign can be off
+        vol = abs(np.einsum('ij,ij->', a, np.cross(b, c)) / 6)
+    else:
+        # faces not consistently wound, leave it to trimesh as vol_of_vol always did
+        vol = abs(trimesh.Trimesh(verts, faces).volume)
+    lo, hi = verts.min(axis = 0), verts.max(axis = 0)
+    return {'Volume': vol, 'Area': area, 'xmin': lo[0], 'ymin': lo[1], 'zmin': lo[2],
+            'xmax': hi[0], 'ymax': hi[1], 'zmax': hi[2], 'Watertight': watertight}
 
 @utils.has_remote_instance
-def FAFB_vols(print_list = False):
+def FAFB_vols(print_list = False, cache = True):
     """ Returns core neuropils used to generate the FAFB mesh.
 
     Based on the `FAFBNP.surf$RegionList` function in the elmr R package.
@@ -37,6 +102,11 @@ def FAFB_vols(print_list = False):
     list:  Bool
             (optional) If True, function prints a list of volumes, rather than fetch them. False by default.
 
+    cache: Bool | VolumeCache
+            (optional) If True (default), meshes are loaded from the default on-disk VolumeCache, and only fetched
+            from CATMAID if missing or changed on the server. A VolumeCache can be passed to use a different cache.
+            False or None skips the cache, and fetches every volume from the server.
+
     Returns
     -------
 
@@ -58,11 +128,11 @@ def FAFB_vols(print_list = False):
     if print_list:
         return (eugh)
     else:
-        vols = pymaid.get_volume(eugh)
+        vols = volume_cache._get_volume(eugh, cache = cache)
         return (vols)
 
 @utils.has_remote_instance
-def get_gloms(Side = 'Right', instance = None):
+def get_gloms(Side = 'Right', instance = None, cache = True):
     """ Collects all of the Glomeruli volumes from CATMAID.
 
     Parameters
@@ -75,6 +145,11 @@ def get_gloms(Side = 'Right', instance = None):
     instance:   CatmaidInstance
                 Which remote instance to use to pull glomeruli form. If not give (default) will fall back to global instance.
 
+    cache:      Bool | VolumeCache
+                If True (default), meshes are loaded from the default on-disk VolumeCache, and only fetched from CATMAID
+                if missing or changed on the server. A VolumeCache can be passed to use a different cache, or False to
+                always fetch from the server.
+
     Retruns
     -------
     dict
@@ -82,16 +157,12 @@ def get_gloms(Side = 'Right', instance = None):
 
     """
 
-    if instance is None:
-        instance = pymaid.utils._eval_remote_instance(instance)
-
+    # list the volumes of the same instance the meshes come from, so their freshness is checked against it too
+    all_vols = datasource.get_volume(remote_instance = instance)
     if Side == 'FIB':
-        all_vols = pymaid.get_volume(remote_instance = instance)
         glom_names = [n for n in all_vols.name.values if n.startswith('FIB') and
                      not n.endswith('neuropil')]
     else:
-        # Get a list of all volumes
-        all_vols = pymaid.get_volume()
         # get a rough list of names we are interested in
         glom_names = [n for n in all_vols.name.values if n.startswith('v14') and
                      True not in [k in n for k in ['Lo','LC6', 'neuropil', 'LPC', 'LP_', 'right', '_ORNs']]]
@@ -108,10 +179,7 @@ def get_gloms(Side = 'Right', instance = None):
             # Remove right hand side Glomeruli
             glom_names = [g for g in glom_names if g.endswith('_L')]
 
-    if instance is None:
-        gloms = pymaid.get_volume(glom_names)
-    else:
-        gloms = pymaid.get_volume(glom_names,remote_instance = instance)
+    gloms = volume_cache._get_volume(glom_names, cache = cache, remote_instance = instance, listing = all_vols)
 
     # clean up glomeruli names
     if Side == 'FIB':
@@ -121,49 +189,124 @@ def get_gloms(Side = 'Right', instance = None):
 
     return (gloms)
 
-def calc_ltk(x):
-    """ Calculate Lifetime Kurtosis from a list."""
+def calc_ltk(x, axis = -1, chunk_size = 4000000):
+    """ Calculate Lifetime Kurtosis.
 
-    # Make sure there are no NaNs:
-    x = x[ ~np.isnan(x)]
-    # ltk:
-    ltk = sum( ( ( x-x.mean() ) / x.std() ) **4) / len(x) - 3
+    Works on a 1-D list/array, or along `axis` of a 2-D (or N-D) array or data frame, e.g. for every row of a
+    neuron by volume matrix in one go. NaNs are ignored.
 
-    return ltk
+    Parameters
+    ----------
+    x:              list | array | DataFrame
+                    Values to calculate the kurtosis of.
 
+    axis:           int
+                    Axis to calculate along. -1 (default) gives one value per row of a matrix.
 
-def calc_lts(x):
-    """ Calculate Lifetime Sparseness from a list."""
+    chunk_size:     int
+                    Rough number of values to work on at once, to bound memory use for very large matrices.
 
-    # Make sure there are no NaNs:
-    x = x[ ~np.isnan(x)]
+    Returns
+    -------
+    float | array | Series
+                    A single value for 1-D input, otherwise the kurtosis along `axis` (a Series, indexed by the other
+                    axis, for a data frame).
+
+    """
+    return _lifetime(x, axis, chunk_size, _ltk)
+
+def calc_lts(x, axis = -1, chunk_size = 4000000):
+    """ Calculate Lifetime Sparseness.
+
+    Works on a 1-D list/array, or along `axis` of a 2-D (or N-D) array or data frame, e.g. for every row of a
+    neuron by volume matrix in one go. NaNs are ignored.
+
+    Parameters
+    ----------
+    x:              list | array | DataFrame
+                    Values to calculate the sparseness of.
+
+    axis:           int
+                    Axis to calculate along. -1 (default) gives one value per row of a matrix.
+
+    chunk_size:     int
+                    Rough number of values to work on at once, to bound memory use for very large matrices.
 
-    N = len(x)
-    # lts:
-    lts = 1 / (1 - (1 / N) ) * ( 1 - ( sum( x / N ) **2 / sum( x**2 / N ) ) )
+    Returns
+    -------
+    float | array | Series
+                    A single value for 1-D input, otherwise the sparseness along `axis` (a Series, indexed by the
+                    other axis, for a data frame).
 
-    return lts
+    """
+    return _lifetime(x, axis, chunk_size, _lts)
+
+def _ltk(x, mask, n):
+    """ Kurtosis of each row of x, counting only values in mask."""
+    mean = x.sum(axis = 1) / n
+    d2 = np.where(mask, x - mean[:, None], 0) ** 2
+    m2 = d2.sum(axis = 1) / n
+    m4 = (d2 ** 2).sum(axis = 1) / n
+    return m4 / m2 ** 2 - 3
+
+def _lts(x, mask, n):
+    """ Sparseness of each row of x, counting only values in mask."""
+    s1 = x.sum(axis = 1) / n
+    s2 = (x ** 2).sum(axis = 1) / n
+    return (1 - s1 ** 2 / s2) / (1 - 1 / n)
+
+def _lifetime(x, axis, chunk_size, func):
+    """ Apply a row-wise statistic along `axis` of x, in chunks of rows, with NaNs masked out."""
+    frame = x if isinstance(x, pd.DataFrame) else None
+    x = np.asarray(x, dtype = np.float64)
+    if x.ndim == 0:
+        raise ValueError('Need at least one value')
+    axis = axis % x.ndim
+
+    # move the axis to reduce over to the end, and flatten the rest into rows
+    rows = np.moveaxis(x, axis, -1)
+    shape = rows.shape[:-1]
+    rows = rows.reshape(-1, rows.shape[-1])
+
+    out = np.empty(len(rows))
+    step = max(1, int(chunk_size) // max(rows.shape[1], 1))
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        for i in range(0, len(rows), step):
+            chunk = rows[i:i + step]
+            mask = ~np.isnan(chunk)
+            out[i:i + step] = func(np.where(mask, chunk, 0), mask, mask.sum(axis = 1))
+
+    if x.ndim == 1:
+        return out[0]
+    out = out.reshape(shape)
+    if frame is not None:
+        return pd.Series(out, index = frame.columns if axis == 0 else frame.index)
+    return out
 
 def point_in_vol(point, vols = None):
-    """ Find out which of the 'core' neuropils a point is in."""
+    """ Find out which of the 'core' neuropils a point is in.
+
+    `vols` can be a dictionary of volumes, or a VolumeLabeller or VoxelLabelGrid built from one, which are much faster
+    if called repeatedly.
+    """
 
     # If not provided, get core volumes
     if vols is None:
-        vols = PN.FAFB_vols()
+        vols = FAFB_vols()
 
-    test = pymaid.in_volume(point,vols)
+    test = volume_index._in_volume(point,vols)
     vol = [i for i in test.keys() if test[i][0]]
     return vol
 
-def seed_sheet(annotation, rm1 = None, rm2 = None):
+def seed_sheet(annotation, rm1 = None, rm2 = None, location = 'root'):
     """ Given an annotation for a seed region returns a sheet of nodes.
 
     You need to first find a seed region in CATMAID, and seed it with nodes/neurons which all share the same annotation.
 
-    Given this annotation, this function will return a DataFrame with some simple neuron information (size, etc), as well as a URL to both
-    the v14 manual tracing instance, and the current most recent auto-segmented instance (as of writing, v14-seg-li-190805.0).
-
-    Current remote instance use buggy...
+    Given this annotation, this function will return a DataFrame with some simple neuron information (size, etc), the
+    coordinates of one representative node per neuron, and optionally a URL to that location in up to two CATMAID
+    instances (e.g. the v14 manual tracing instance and the most recent auto-segmented one). Only one point per neuron
+    is kept, so the sheet stays small however many fragments the seed region has.
 
     Parameters
     ----------
@@ -177,24 +320,57 @@ def seed_sheet(annotation, rm1 = None, rm2 = None):
     rm2:            pymaid.remote_instance
                     Optional. If passed, function will return a URL in the data frame to the neurons coordinates within this CATMAID instance
 
+    location:       str
+                    Which point to use for each neuron. 'root' (default) for the root node, 'centroid' for the mean of
+                    all its nodes, or 'nearest' for the node closest to that mean (which, unlike the centroid, is
+                    always on the neuron).
+
     Returns
     -------
 
     DataFrame:      DataFrame
-                    Data frame for use as a seed region sampling sheet. Can be saved as .csv or imported to Google Sheets.
+                    Data frame for use as a seed region sampling sheet, one row per neuron, with x/y/z columns for the
+                    representative point (and 'rm1'/'rm2' URL columns). Can be saved as .csv or imported to Google Sheets.
     """
 
-    N_all = pymaid.get_neurons("annotation:" + annotation)
+    N_all = datasource.get_neurons("annotation:" + annotation)
+    if isinstance(N_all, pymaid.CatmaidNeuron):
+        N_all = pymaid.CatmaidNeuronList(N_all)
     df = N_all.summary()
-    df['node_loc'] = [n.nodes[['x','y','z']].values for n in N_all]
 
-    if rm1 is not None:
-        df['rm1'] = pymaid.url_to_coordinates(np.vstack(df.node_loc.values),
-                                                 stack_id = 5,
-                                                remote_instance = PS.manual())
-    if rm2 is not None:
-        df['rm2'] = pymaid.url_to_coordinates(np.vstack(df.node_loc.values),
-                                                 stack_id = 5,
-                                                remote_instance = PS.Auto_v3())
+    points = _representative_points(N_all, location)
+    df['x'], df['y'], df['z'] = points.T
+
+    # one call per instance, for every neuron at once
+    for column, rm in (('rm1', rm1), ('rm2', rm2)):
+        if rm is not None:
+            df[column] = datasource.url_to_coordinates(points, stack_id = 5, remote_instance = rm)
 
     return df
+
+def _representative_points(neurons, location = 'root'):
+    """ (N, 3) float32 array of one point per neuron - its root, centroid or node nearest the centroid."""
+    if location not in ('root', 'centroid', 'nearest'):
+        raise ValueError("location must be 'root', 'centroid' or 'nearest'")
+    counts = np.array([len(n.nodes) for n in neurons])
+    owner = np.repeat(np.arange(len(counts)), counts)
+    xyz = np.vstack([n.nodes[['x','y','z']].values for n in neurons] + [np.zeros((0, 3))]).astype(np.float64)
+
+    if location == 'root':
+        is_root = np.concatenate([n.nodes.parent_id.isnull().values for n in neurons] + [np.zeros(0, bool)])
+        pick = np.flatnonzero(is_root)
+    else:
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            centroid = np.stack([np.bincount(owner, weights = xyz[:, i], minlength = len(counts))
+                                 for i in range(3)], axis = 1) / counts[:, None]
+        if location == 'centroid':
+            return centroid.astype(np.float32)
+        # order nodes by neuron, then distance to the centroid, and take the first of each neuron
+        dist = ((xyz - centroid[owner]) ** 2).sum(axis = 1)
+        pick = np.lexsort((dist, owner))
+
+    # first picked node of each neuron (neurons without one are left as NaN)
+    points = np.full((len(counts), 3), np.nan, dtype = np.float32)
+    first = np.unique(owner[pick], return_index = True)[1]
+    points[owner[pick[first]]] = xyz[pick[first]]
+    return points
@@ -0,0 +1,124 @@
+# Helpers for running per-neuron work over a process pool
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from . import utils
+pymaid = utils.lazy_import('pymaid')
+pd = utils.lazy_import('pandas')
+tqdm = utils.lazy_import('tqdm', 'tqdm')
+
+# Objects shared with every worker once, when the pool starts (e.g. volumes)
+_shared = {}
+
+# Neuron attributes packed on their own, rather than with the other scalar attributes
+_PACKED = ('skeleton_id', 'neuron_name', 'nodes', 'connectors', 'tags')
+
+def pack_neuron(neuron):
+    """ Reduce a CatmaidNeuron to plain arrays, which are much cheaper to send to another process than the neuron.
+
+    Besides nodes, connectors and tags, the neuron's other scalar attributes (e.g. soma, date retrieved) are kept.
+    Cached graphs and other derived data are left behind, to be rebuilt when needed.
+    """
+    return {'skeleton_id': neuron.skeleton_id,
+            'neuron_name': getattr(neuron, 'neuron_name', ''),
+            'nodes': {c: neuron.nodes[c].values for c in neuron.nodes.columns},
+            'connectors': {c: neuron.connectors[c].values for c in neuron.connectors.columns},
+            'tags': dict(getattr(neuron, 'tags', {}) or {}),
+            'attributes': {k: v for k, v in vars(neuron).items()
+                           if not k.startswith('_') and k not in _PACKED and pd.api.types.is_scalar(v)}}
+
+def unpack_neuron(packed):
+    """ Rebuild a CatmaidNeuron from the output of `pack_neuron`."""
+    neuron = pymaid.CatmaidNeuron(pd.Series({'skeleton_id': packed['skeleton_id'],
+                                             'neuron_name': packed['neuron_name'],
+                                             'nodes': pd.DataFrame(packed['nodes']),
+                                             'connectors': pd.DataFrame(packed['connectors']),
+                                             'tags': packed['tags']}))
+    for k, v in packed.get('attributes', {}).items():
+        setattr(neuron, k, v)
+    return neuron
+
+def _init(shared):
+    global _shared
+    _shared = shared
+
+def _run(func, packed):
+    res = func(unpack_neuron(packed), **_shared)
+    # flag neurons, so they can be rebuilt on the way back
+    if isinstance(res, pymaid.CatmaidNeuron):
+        return True, pack_neuron(res)
+    return False, res
+
+def map_neurons(func, neurons, n_jobs = 1, shared = None, desc = None):
+    """ Apply `func(neuron, **shared)` to every neuron, optionally over a pool of processes.
+
+    Neurons are sent to workers as plain node/connector arrays, and `shared` is sent to each worker once when the
+    pool starts rather than with every neuron. `func` must be a module level function.
+
+    Parameters
+    ----------
+
+    func:       function
+                Function taking a neuron as first argument, plus the keyword arguments in `shared`.
+
+    neurons:    CatmaidNeuronList | list
+                Neurons to process.
+
+    n_jobs:     int
+                Number of processes to use. 1 (default) runs in this process, -1 uses all CPUs.
+
+    shared:     dict
+                Keyword arguments passed to every call of `func`.
+
+    desc:       str
+                Label for the progress bar, which is only shown if a label is given.
+
+    Returns
+    -------
+
+    list
+                Output of `func` for each neuron, in the same order as `neurons`. Neurons returned by `func` come
+                back as CatmaidNeurons.
+
+    """
+    shared = {} if shared is None else shared
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count()
+
+    if n_jobs == 1:
+        return [func(n, **shared) for n in tqdm(neurons, desc = desc, disable = desc is None)]
+
+    packed = (pack_neuron(n) for n in neurons)
+    chunksize = max(1, len(neurons) // (n_jobs * 4))
+    with ProcessPoolExecutor(n_jobs, initializer = _init, initargs = (shared,)) as pool:
+        res = list(tqdm(pool.map(_run, repeat(func), packed, chunksize = chunksize),
+                        total = len(neurons), desc = desc, disable = desc is None))
+    return [unpack_neuron(r) if is_neuron else r for is_neuron, r in res]
+
+def _run_task(func, task):
+    return func(task, **_shared)
+
+def map_tasks(func, tasks, n_jobs = 1, shared = None, desc = None):
+    """ Apply `func(task, **shared)` to every task, optionally over a pool of processes.
+
+    Like `map_neurons`, for work which isn't split by neuron (e.g. chunks of resamples). `shared` is sent to each
+    worker once when the pool starts, and `func` must be a module level function.
+
+    Returns
+    -------
+
+    list
+                Output of `func` for each task, in order.
+
+    """
+    shared = {} if shared is None else shared
+    tasks = list(tasks)
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count()
+
+    if n_jobs == 1:
+        return [func(t, **shared) for t in tqdm(tasks, desc = desc, disable = desc is None)]
+
+    with ProcessPoolExecutor(n_jobs, initializer = _init, initargs = (shared,)) as pool:
+        return list(tqdm(pool.map(_run_task, repeat(func), tasks), total = len(tasks), desc = desc,
+                         disable = desc is None))
@@ -1,7 +1,8 @@
 # Wrapper functions for useful plotting
-import matplotlib.pyplot as plt
-import pandas as pd
 from math import pi
+from . import utils
+plt = utils.lazy_import('matplotlib.pyplot')
+pd = utils.lazy_import('pandas')
 
 def radar_plot(data, subsets = None, size = (10,10)):
     """ Create a radar, or spider plot to show, for example, glomeruli representations in volumes
@@ -1,14 +1,18 @@
 # Various functions to determine the amount of cable a neuron has within a volume
 
-import pymaid
-import pandas as pd
 import numpy as np
-from tqdm import tqdm
 import itertools
 from . import utils
 from . import misc
-
-def ends_matrix(neurons, volumes, as_mask = False):
+from . import volume_index
+from . import topology
+from . import parallel
+pymaid = utils.lazy_import('pymaid')
+pd = utils.lazy_import('pandas')
+tqdm = utils.lazy_import('tqdm', 'tqdm')
+
+@utils.stage('ends_matrix')
+def ends_matrix(neurons, volumes, as_mask = False, batch = True):
     """ Return a count of end nodes the neuron(s) have within the given volume(s).
 
     Parameters
@@ -16,12 +20,16 @@ def ends_matrix(neurons, volumes, as_mask = False):
     neurons :   CatmaidNeuron | CatmaidNeuronList
                 Input neuron(s) of interest.
 
-    volumes :   Volume | dict
-                Either a single pymaid volume, or a dictionary of volumes.
+    volumes :   Volume | dict | VolumeLabeller
+                Either a single pymaid volume, a dictionary of volumes, or a VolumeLabeller.
 
     as_mask:    Bool
                 If True, returns a boolian array for use as a mask. False by default.
 
+    batch:      Bool
+                If True (default), leaf nodes of all neurons are found and tested against the volumes in one go, and
+                the matrix built with a single groupby. If False, neurons are processed one at a time.
+
     Returns
     -------
     DataFrame
@@ -38,12 +46,17 @@ def ends_matrix(neurons, volumes, as_mask = False):
           volumes = {volumes.name : volumes}
 
     # Get matrix of end nodes within volumes
+    if batch:
+        end_mat = _ends_matrix_batch(neurons, volumes)
+        if as_mask == True:
+            end_mat = end_mat.astype(bool)
+        return end_mat
 
     end_mat = pd.DataFrame()
     for i in tqdm(neurons):
-        # get count of end nodes
-        open_ends = set(i.nodes.treenode_id.values) - set(i.nodes.parent_id.values)
-        dictionary = pymaid.in_volume(i.nodes.loc[i.nodes['treenode_id'].isin(open_ends)][['x','y','z']], volumes)
+        # get count of end nodes (nodes without children, from the neuron's cached topology)
+        leaves = topology.cached_topology(i).leaves
+        dictionary = volume_index._in_volume(i.nodes[['x','y','z']].iloc[leaves], volumes)
         counts = pd.DataFrame(data = [np.sum(dictionary[x]) for x in dictionary.keys()],
                  index = dictionary.keys(),
                  columns = [i.skeleton_id])
@@ -55,17 +68,32 @@ def ends_matrix(neurons, volumes, as_mask = False):
 
     return end_mat.T
 
+def _ends_matrix_batch(neurons, volumes):
+    """ Neurons by volumes count of leaf nodes, for all neurons at once."""
+    with utils.stage('ends_matrix.leaves'):
+        # leaves are nodes which are nobody's parent, from each neuron's cached topology
+        leaves = [topology.cached_topology(i).leaves for i in neurons]
+        owner = np.repeat(np.arange(len(leaves)), [len(l) for l in leaves])
+        xyz = np.vstack([i.nodes[['x','y','z']].values[l] for i, l in zip(neurons, leaves)] + [np.zeros((0, 3))])
+    dictionary = volume_index._in_volume(pd.DataFrame(xyz, columns = ['x','y','z']), volumes)
+    end_mat = pd.DataFrame({k: np.asarray(v, dtype = int) for k, v in dictionary.items()})
+    end_mat = end_mat.groupby(owner).sum().reindex(np.arange(len(neurons)), fill_value = 0)
+    end_mat.index = [i.skeleton_id for i in neurons]
+    return end_mat[sorted(end_mat.columns)]
+
 def path_to_root(node,neuron):
-    """  Get path between a node and the neurons root """
-    target = neuron.soma
-    if isinstance(neuron,pymaid.CatmaidNeuron):
-        neuron = neuron.graph
-    path = []
-    while node and node !=target:
-        path.append(node)
-        node = next(neuron.successors(node), None)
+    """  Get path between a node and the neurons root
 
-    return path
+    Node IDs from `node` towards the root, stopping before the soma. For many nodes of the same neuron, get the
+    neuron's `PNtools.cached_topology` and use its `paths_to_root`, `distance_to_root` and `geodesic` methods instead.
+    """
+    target = neuron.soma
+    path = topology.cached_topology(neuron).path_to_root(node)
+    # stop before the soma, if it is along the way
+    stop = np.flatnonzero(path == target)
+    if len(stop):
+        path = path[:stop[0]]
+    return list(path)
 
 def first_branch(neurons, volume = None):
     """ Return node ID(s) for the parent node of the first branch point in the neuron(s)
@@ -76,6 +104,9 @@ def first_branch(neurons, volume = None):
     neurons     CatmaidNeuron | CatmaidNeuronList
                 A neuron, or neuron list. If neuron, returns single branch point.
 
+    volume      Volume
+                (optional) Only look at the part of the neuron(s) within this volume. The neurons are not changed.
+
     Returns
     -------
 
@@ -90,23 +121,23 @@ def first_branch(neurons, volume = None):
     nodes = []
     for i in neurons:
 
+        view = topology.NeuronView(i)
         # get the primary neurite
-        neurite = pymaid.longest_neurite(i)
-        # if volume provided, prune to that volume.
+        neurite = view.longest_neurite()
+        # if volume provided, prune to that volume (a view - the neuron itself is left as it is)
         if volume is not None:
-            i.prune_by_volume(volume, inplace = True)
-        # get all branch nodes in neuron
-        dist = set(i.nodes.loc[i.nodes.type == 'branch'].treenode_id.values)
-        # get the intersection, so branch points along the primary neurite
-        dist = dist.intersection(set(neurite.nodes.treenode_id))
-        # create a data frame with the distances to the root
-        dist = pd.DataFrame.from_dict({str(n) : pymaid.dist_between(i,n,i.root) for n in dist},
-                                       orient = 'index',
-                                       columns = ['Dist'])
-        nodes.append(i.nodes.loc[i.nodes.treenode_id.values == int(dist['Dist'].idxmin())]['parent_id'].values[0])
+            view = view.in_volume(volume)
+        # branch points of the (pruned) neuron along the primary neurite, with distances measured in the whole
+        # neuron - the part in the volume may be in pieces, each with its own root
+        topo = view.base
+        dist = topo.index((view.branch_points() & neurite).node_ids)
+        # the branch point closest to the root, and its parent
+        closest = dist[np.argmin(topo.distances[dist])]
+        nodes.append(topo.node_ids[topo.parent[closest]])
     return nodes
 
-def pruning(neurons, volume, version = 'new', vol_scale = 1, prevent_fragments = False):
+@utils.stage('pruning')
+def pruning(neurons, volume, version = 'new', vol_scale = 1, prevent_fragments = False, n_jobs = 1):
     """ Prunes a neuron to a volume in a manner which attempts to limit the neuron to cable which is likely to synapse.
     Parameters
     ----------
@@ -118,11 +149,15 @@ def pruning(neurons, volume, version = 'new', vol_scale = 1, prevent_fragments =
                         Defult to 'new', but can be 'old' if wished. See notes.
     vol_scale:          int
                         integer, determining how to reseize the volume mesh being passed. 1 (default) doesn't change the size,
-                        0.5 would halve the size, 1.5 would increase the volume by 50% etc
+                        0.5 would halve the size, 1.5 would increase the volume by 50% etc. The volume passed is not
+                        changed: a resized copy is made (once per session, see `PNtools.indexed_volume`).
     prevent_fragments:  Bool
                         If True, returns a single complete subgraph, if False (default) will potentially return a fragmented
                         neuron. The fragmented neuron will likely be better pruned, but depending on further analysis a
                         complete sub graph may be wanted.
+    n_jobs:             int
+                        Number of processes to prune neurons over. 1 (default) prunes in this process, -1 uses all CPUs.
+                        Neurons are sent to the workers as node/connector arrays, and the volume once per worker.
     Returns
     -------
     CatmaidNeuron | CatmaidNeuronList
@@ -132,57 +167,60 @@ def pruning(neurons, volume, version = 'new', vol_scale = 1, prevent_fragments =
     if isinstance(neurons, pymaid.CatmaidNeuron):
         neurons = pymaid.CatmaidNeuronList(neurons)
 
-    # resize volume if needed
-    if vol_scale is not 1:
-        volume.resize(vol_scale,inplace = True)
-    # Initilise neuron lists for pruned inhibitory and excitatory neurons
-    pruned = pymaid.CatmaidNeuronList([])
+    # resized copy of the volume, indexed once for all neurons
+    volume = volume_index.indexed_volume(volume, vol_scale)
     # loop and prune
-    if version == 'old':
-        for i in tqdm(neurons):
-            # prune the current neuron in this iteration to the AL
-            i.reroot(i.soma, inplace=True)
-            current = i.prune_by_volume(volume, prevent_fragments=True, inplace=False)
-            # prune by strahler
-            current = pymaid.prune_by_strahler(current, to_prune=slice(-1, None), inplace=False)
-            # add to initialised neuron list
+    with utils.stage('pruning.prune'):
+        if version == 'old':
+            res = parallel.map_neurons(_prune_old, neurons, n_jobs = n_jobs, shared = {'volume': volume},
+                                       desc = 'pruning')
+        elif version == 'new':
+            res = parallel.map_neurons(_prune_new, neurons, n_jobs = n_jobs,
+                                       shared = {'volume': volume, 'prevent_fragments': prevent_fragments},
+                                       desc = 'pruning')
+    # Initilise neuron lists for pruned inhibitory and excitatory neurons
+    with utils.stage('pruning.collect'):
+        pruned = pymaid.CatmaidNeuronList([])
+        for i in res:
             pruned += i
-    elif version == 'new':
-        for i in tqdm(neurons):
-            i.reroot(i.soma, inplace = True)
-            # get the longest neurite
-            neurite = pymaid.longest_neurite(i)
-            # get the last node in the longest neurite
-            last_node = list(set(neurite.nodes.treenode_id.values) - set(neurite.nodes.parent_id.values))
-            # prune the neuron to the volume of interest as a complete graph
-            vol_prune = i.prune_by_volume(volume,prevent_fragments = True, inplace = False)
-            # Get set of all branch points in the neuron
-            dist = set(i.nodes.loc[i.nodes.type == 'branch'].treenode_id.values)
-            # Get intersection of this set with set of nodes in primary neurite and vol_prune
-            dist = dist.intersection(neurite.nodes.treenode_id.values,vol_prune.nodes.treenode_id.values)
-            # Get the distance of each branch node from the root
-            dist = pd.DataFrame.from_dict({str(n) : pymaid.dist_between(i,n,i.soma) for n in dist},
-                               orient = 'index',
-                               columns = ['Dist'])
-            # if the primary neurite ends in volume of interest
-            if pymaid.in_volume(i.nodes.loc[i.nodes['treenode_id'] == last_node[0]][['x','y','z']],volume)[0]:
-                # get the parent of the branch node closest to the root
-                cut = neurite.nodes.loc[neurite.nodes.treenode_id.values == int(dist['Dist'].idxmin())]['parent_id']
-                neurite.prune_distal_to(cut,inplace = True)
-                # remove everything proximal to the root
-                subset = list(set(vol_prune.nodes.treenode_id) - set(neurite.nodes.treenode_id))
-                pymaid.subset_neuron(vol_prune,subset,clear_temp = True,inplace = True, prevent_fragments = prevent_fragments)
-            # if the neurite does not end in the volume, remove primary neurite
-            else:
-                # subtract the entire primary neurite
-                # subtract the neurite nodes from the cut neuron nodes:
-                subset = list(set(vol_prune.nodes.treenode_id) - set(neurite.nodes.treenode_id))
-                pymaid.subset_neuron(vol_prune,subset,clear_temp = True,inplace = True, prevent_fragments = prevent_fragments)
-            pruned += vol_prune
 
     return (pruned)
 
-def cable_length_matrix(neurons, volumes, mask = None, Normalisation=None):
+def _prune_old(neuron, volume):
+    """ Pruning of a single neuron, old version."""
+    # prune the current neuron in this iteration to the AL
+    neuron.reroot(neuron.soma, inplace=True)
+    current = volume_index.prune_by_volume(neuron, volume, prevent_fragments=True)
+    # prune by strahler
+    current = pymaid.prune_by_strahler(current, to_prune=slice(-1, None), inplace=False)
+    return neuron
+
+def _prune_new(neuron, volume, prevent_fragments):
+    """ Pruning of a single neuron, new version. Works on views of the neuron, which is copied once at the end."""
+    with utils.stage('prune.longest_neurite'):
+        view = topology.NeuronView(neuron, root = neuron.soma)
+        # get the longest neurite, and its last node
+        neurite = view.longest_neurite()
+        last_node = view.topology.longest_neurite()[-1]
+    # prune the neuron to the volume of interest as a complete graph
+    with utils.stage('prune.prune_by_volume'):
+        vol_prune = view.in_volume(volume, prevent_fragments = True)
+    with utils.stage('prune.branch_points'):
+        # distances to the root (soma) of every node, in one traversal
+        topo = view.topology
+        # branch points along the primary neurite, within vol_prune
+        dist = topo.index((view.branch_points() & neurite & vol_prune).node_ids)
+    # if the primary neurite ends in volume of interest
+    if volume_index._inside(neuron.nodes[['x','y','z']].values[topo.index(last_node)], volume)[0]:
+        # cut the neurite at the parent of the branch node closest to the root
+        closest = dist[np.argmin(topo.distances[dist])]
+        neurite = neurite.upstream_of(topo.node_ids[topo.parent[closest]])
+    # remove the (remaining) primary neurite
+    with utils.stage('prune.subset'):
+        return (vol_prune - neurite).materialise(prevent_fragments = prevent_fragments)
+
+@utils.stage('cable_length_matrix')
+def cable_length_matrix(neurons, volumes, mask = None, Normalisation=None, method = 'prune'):
     """ Matrix of neuron cable length (nanometers) within volume(s)
 
     If mask is provided the retruned matrix will return 0 cable where the mask is False.
@@ -192,8 +230,8 @@ def cable_length_matrix(neurons, volumes, mask = None, Normalisation=None):
     neurons:          CatmaidNeuron | CatmaidNeuronList
                       A pymaid neuron or neuron list
 
-    volumes:          Volume | dict
-                      A single pymaid volume, or a dictionary of volumes.
+    volumes:          Volume | dict | VolumeLabeller
+                      A single pymaid volume, a dictionary of volumes, or a VolumeLabeller.
 
     mask:             Boolian Array
                       A neuron(s) by volume(s) boolian array to use as a mask.
@@ -205,6 +243,12 @@ def cable_length_matrix(neurons, volumes, mask = None, Normalisation=None):
                       If 'Neuron' normalises cable length by sum of all cable in all passed volumes
                       If 'Volume' normalises cable length by the volume of the volumes passed
 
+    method:           str
+                      If 'prune' (default) cable is measured on copies of each neuron pruned to each volume with
+                      `pymaid.in_volume`. If 'clip', cable is measured on the edges of all neurons in a single pass,
+                      clipping edges where they cross a volume boundary (see `PNtools.cable_per_volume`). 'clip' is
+                      exact, far faster and lighter on memory for large matrices, and used if volumes is a VolumeLabeller.
+
     Returns
     -------
     DataFrame
@@ -218,10 +262,20 @@ def cable_length_matrix(neurons, volumes, mask = None, Normalisation=None):
     if isinstance(volumes, pymaid.Volume):
         volumes = {volumes.name: volumes}
 
-    # cut neuron list to within volumes
-    res = pymaid.in_volume(neurons,volumes)
-    # Create a data frame of cable lengths
-    cable_mat = pd.DataFrame.from_dict({g: {i.skeleton_id: i.cable_length for i in res[g]} for g in res})
+    if isinstance(volumes, volume_index.VolumeLabeller):
+        method = 'clip'
+
+    if method == 'clip':
+        cable_mat = volume_index.cable_per_volume(neurons, volumes)
+        if isinstance(volumes, volume_index.VolumeLabeller):
+            volumes = volumes.volumes
+    else:
+        # cut neuron list to within volumes
+        with utils.stage('cable_length_matrix.in_volume'):
+            res = pymaid.in_volume(neurons,volumes)
+        # Create a data frame of cable lengths
+        with utils.stage('cable_length_matrix.cable'):
+            cable_mat = pd.DataFrame.from_dict({g: {i.skeleton_id: i.cable_length for i in res[g]} for g in res})
 
     # Masking
     if mask is not None:
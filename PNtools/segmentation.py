@@ -0,0 +1,191 @@
+# Cached, concurrent look up of autoseg segmentation IDs
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from . import utils
+pd = utils.lazy_import('pandas')
+
+# Bits per axis when packing voxel coordinates into a single integer key. Voxels from -2**20 to 2**20 - 1 fit.
+_BITS = 21
+_BIAS = 1 << (_BITS - 1)
+
+_default = None
+
+class SegmentCache:
+    """ Coordinate keyed cache of segmentation IDs.
+
+    Coordinates are quantised to the voxel resolution of the segmentation, so any two points in the same voxel
+    share a single look up. Voxels not yet in the cache are fetched from the backend in chunks, several chunks at
+    a time. If a path is given, the cache is kept on disk as an .npz file and reused between sessions - use a
+    different file for each segmentation (e.g. autoseg version). The rare voxels too far out to be keyed (over 2**20
+    voxels from the origin along an axis) are not cached, and are asked about every time.
+
+    Parameters
+    ----------
+
+    path:           str
+                    (optional) .npz file to keep the cache in. If not given, the cache only lasts the session.
+
+    backend:        function
+                    Function taking an (N, 3) array of coordinates and returning N segmentation IDs. Defaults to
+                    `fafbseg.segmentation.get_seg_ids`. See `ArraySegmentation` for a local stand-in.
+
+    resolution:     tuple
+                    (x, y, z) voxel size of the segmentation. (4, 4, 40) by default, for the FAFB autoseg.
+
+    chunk_size:     int
+                    Number of coordinates per request to the backend.
+
+    max_workers:    int
+                    Number of requests to the backend to run at the same time.
+
+    """
+
+    def __init__(self, path = None, backend = None, resolution = (4, 4, 40), chunk_size = 1000, max_workers = 4):
+        self.path = path
+        self.backend = backend
+        self.resolution = np.asarray(resolution, dtype = np.float64)
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self._ids = pd.Series([], dtype = np.uint64)
+        if path is not None and os.path.isfile(path):
+            with np.load(path) as f:
+                self._ids = pd.Series(f['seg_ids'], index = f['keys'])
+
+    def __repr__(self):
+        return '<SegmentCache: {} voxels{}>'.format(len(self), '' if self.path is None else ' at ' + self.path)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get_seg_ids(self, coords):
+        """ Segmentation IDs at the given coordinates, only asking the backend about voxels not seen before.
+
+        Parameters
+        ----------
+
+        coords:     array | DataFrame
+                    (N, 3) array of x/y/z coordinates, or a data frame with ['x','y','z'] columns.
+
+        Returns
+        -------
+
+        array
+                    N segmentation IDs.
+
+        """
+        if isinstance(coords, pd.DataFrame):
+            coords = coords[['x','y','z']].values
+        voxels = np.floor(np.asarray(coords, dtype = np.float64).reshape(-1, 3) / self.resolution).astype(np.int64)
+        ok = _in_range(voxels)
+        keys = _pack(voxels[ok])
+
+        missing = pd.unique(keys[self._ids.index.get_indexer(keys) < 0])
+        if len(missing):
+            self._fetch(missing)
+
+        ids = np.empty(len(voxels), dtype = np.uint64)
+        ids[ok] = self._ids.values[self._ids.index.get_indexer(keys)]
+        if not ok.all():
+            ids[~ok] = self._query(voxels[~ok])
+        return ids
+
+    def _fetch(self, keys):
+        ids = self._query(_unpack(keys))
+        self._ids = pd.concat([self._ids, pd.Series(ids, index = keys)])
+        if self.path is not None:
+            self.save()
+
+    def _query(self, voxels):
+        """ Segmentation IDs of voxels, from the backend."""
+        backend = self.backend
+        if backend is None:
+            import fafbseg
+            backend = fafbseg.segmentation.get_seg_ids
+        # ask about the centre of each voxel
+        coords = (voxels + .5) * self.resolution
+        chunks = [coords[i:i + self.chunk_size] for i in range(0, len(coords), self.chunk_size)]
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            ids = list(pool.map(lambda c: np.asarray(backend(c), dtype = np.uint64), chunks))
+        return np.concatenate(ids)
+
+    def save(self, path = None):
+        """ Write the cache to `path`, or to the path it was created with."""
+        path = self.path if path is None else path
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, keys = self._ids.index.values.astype(np.int64), seg_ids = self._ids.values.astype(np.uint64))
+        os.replace(tmp, path)
+
+    def clear(self):
+        """ Forget every cached segmentation ID (and remove the cache file, if there is one)."""
+        self._ids = pd.Series([], dtype = np.uint64)
+        if self.path is not None and os.path.isfile(self.path):
+            os.remove(self.path)
+
+class ArraySegmentation:
+    """ Local stand-in for a segmentation service, looking up IDs in a labelled array.
+
+    Useful for testing, or for offline runs against a downloaded cutout of the segmentation. Pass it as the
+    `backend` of a SegmentCache.
+
+    Parameters
+    ----------
+
+    labels:         array
+                    (x, y, z) array of segmentation IDs.
+
+    resolution:     tuple
+                    (x, y, z) voxel size of `labels`.
+
+    offset:         tuple
+                    (x, y, z) coordinates of the corner of `labels`.
+
+    """
+
+    def __init__(self, labels, resolution = (4, 4, 40), offset = (0, 0, 0)):
+        self.labels = labels
+        self.resolution = np.asarray(resolution, dtype = np.float64)
+        self.offset = np.asarray(offset, dtype = np.float64)
+
+    def __call__(self, coords):
+        vox = np.floor((np.asarray(coords, dtype = np.float64) - self.offset) / self.resolution).astype(np.int64)
+        ok = np.all((vox >= 0) & (vox < self.labels.shape), axis = 1)
+        ids = np.zeros(len(vox), dtype = np.uint64)
+        ids[ok] = self.labels[tuple(vox[ok].T)]
+        return ids
+
+def _in_range(voxels):
+    """ Which voxels can be packed into a key."""
+    return np.all((voxels >= -_BIAS) & (voxels < _BIAS), axis = 1)
+
+def _pack(voxels):
+    if not np.all(_in_range(voxels)):
+        raise ValueError('Coordinates out of range for the segmentation cache')
+    v = voxels + _BIAS
+    return (v[:, 0] << (2 * _BITS)) | (v[:, 1] << _BITS) | v[:, 2]
+
+def _unpack(keys):
+    mask = (1 << _BITS) - 1
+    return np.stack([keys >> (2 * _BITS), (keys >> _BITS) & mask, keys & mask], axis = 1) - _BIAS
+
+def default_segment_cache():
+    """ Returns the session SegmentCache used by `upstream_sheet`, creating it on first use."""
+    global _default
+    if _default is None:
+        _default = SegmentCache()
+    return _default
+
+def set_segment_cache(cache):
+    """ Set the SegmentCache used by default in PNtools, e.g. to keep it on disk or use a different backend.
+
+    Parameters
+    ----------
+
+    cache:      SegmentCache | str
+                A SegmentCache, or a path to create one at.
+
+    """
+    global _default
+    if isinstance(cache, str):
+        cache = SegmentCache(cache)
+    _default = cache
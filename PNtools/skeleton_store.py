@@ -0,0 +1,260 @@
+# Local columnar store of skeletons (Feather / Parquet), loaded lazily through memory mapping
+import os
+import json
+import numpy as np
+from . import utils
+from . import datasource
+from . import parallel
+pymaid = utils.lazy_import('pymaid')
+pd = utils.lazy_import('pandas')
+pa = utils.lazy_import('pyarrow')
+feather = utils.lazy_import('pyarrow.feather')
+pq = utils.lazy_import('pyarrow.parquet')
+
+_TABLES = ('neurons', 'nodes', 'connectors', 'tags')
+_EXT = {'feather': '.feather', 'parquet': '.parquet'}
+
+class SkeletonStore:
+    """ Local store of the node, connector and tag tables of a set of neurons, in a columnar format.
+
+    All neurons share one table of each kind, sorted by neuron, so each neuron is a contiguous run of rows.
+    Coordinates are kept as float32, node and connector IDs as 64 bit integers (nullable, for the root's parent),
+    and skeleton IDs and other string columns (e.g. node type, tag) are dictionary encoded. Feather files (the
+    default) are written uncompressed and memory mapped when opened, so opening a store of thousands of neurons
+    reads almost nothing, and neurons are only built - one at a time - when asked for. Parquet files are smaller on
+    disk but are read into memory when opened.
+
+    Needs pyarrow (`pip install PNtools[store]`). Write a store with `SkeletonStore.write` (or
+    `SkeletonStore.fetch`), and open it with `SkeletonStore(path)`.
+
+    Parameters
+    ----------
+
+    path:       str
+                Directory of the store.
+
+    Examples
+    --------
+
+    >>> store = PNtools.SkeletonStore.fetch(skids, 'PNs')
+    >>> store = PNtools.SkeletonStore('PNs')
+    >>> nl = store.get_neurons(skids[:100])
+    >>> for n in store:
+    ...     do_something(n)
+
+    """
+
+    def __init__(self, path):
+        _require_pyarrow()
+        with open(os.path.join(path, 'store.json')) as f:
+            self.format = json.load(f)['format']
+        self.path = path
+        self._tables = {t: _read(_file(path, t, self.format), self.format) for t in _TABLES}
+        neurons = self._tables['neurons']
+        self.skeleton_ids = [str(s) for s in neurons.column('skeleton_id').to_pylist()]
+        self._names = neurons.column('neuron_name').to_pylist()
+        self._rows = {s: i for i, s in enumerate(self.skeleton_ids)}
+        self._ranges = {t: (neurons.column(t + '_start').to_numpy(), neurons.column(t + '_count').to_numpy())
+                        for t in _TABLES[1:]}
+        self._dtypes = {t: _categories(self._tables[t]) for t in _TABLES}
+
+    def __repr__(self):
+        return '<SkeletonStore: {} neurons, {} nodes at {}>'.format(len(self), self._tables['nodes'].num_rows,
+                                                                     self.path)
+
+    def __len__(self):
+        return len(self.skeleton_ids)
+
+    def __contains__(self, skid):
+        return str(skid) in self._rows
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._neuron(i)
+
+    def __getitem__(self, key):
+        """ A neuron by position or skid, or a CatmaidNeuronList for a slice or list of them."""
+        if isinstance(key, slice):
+            return pymaid.CatmaidNeuronList([self._neuron(i) for i in range(len(self))[key]])
+        if isinstance(key, (list, tuple, np.ndarray, pd.Index, pd.Series)):
+            return self.get_neurons(key)
+        if isinstance(key, str):
+            return self._neuron(self._row(key))
+        return self._neuron(range(len(self))[key])
+
+    @classmethod
+    def write(cls, neurons, path, format = 'feather'):
+        """ Write neurons to a new store, replacing any store already at `path`.
+
+        Parameters
+        ----------
+
+        neurons:    CatmaidNeuron | CatmaidNeuronList
+                    Neuron(s) to store.
+
+        path:       str
+                    Directory to write the store to.
+
+        format:     str
+                    'feather' (default) for memory mapped loading, or 'parquet' for smaller files.
+
+        Returns
+        -------
+
+        SkeletonStore
+
+        """
+        _require_pyarrow()
+        if format not in _EXT:
+            raise ValueError('format must be one of {}'.format(list(_EXT)))
+        if isinstance(neurons, pymaid.CatmaidNeuron):
+            neurons = pymaid.CatmaidNeuronList(neurons)
+        os.makedirs(path, exist_ok = True)
+
+        skids = [str(n.skeleton_id) for n in neurons]
+        tables = {'nodes': [n.nodes for n in neurons],
+                  'connectors': [n.connectors for n in neurons],
+                  'tags': [_tag_table(getattr(n, 'tags', None)) for n in neurons]}
+        index = {'skeleton_id': skids, 'neuron_name': [str(getattr(n, 'neuron_name', '')) for n in neurons]}
+        for t, frames in tables.items():
+            counts = np.array([0 if f is None else len(f) for f in frames], dtype = np.int64)
+            index[t + '_start'] = np.cumsum(counts) - counts
+            index[t + '_count'] = counts
+            tables[t] = _concat(frames, skids, counts)
+        tables['neurons'] = pd.DataFrame(index)
+
+        for t in _TABLES:
+            _write(_encode(tables[t]), _file(path, t, format), format)
+        with open(os.path.join(path, 'store.json'), 'w') as f:
+            json.dump({'format': format}, f)
+        return cls(path)
+
+    @classmethod
+    def fetch(cls, skids, path, remote_instance = None, format = 'feather'):
+        """ Fetch neurons from CATMAID and write them to a new store at `path`. See `write`."""
+        if remote_instance is None:
+            neurons = datasource.get_neurons(skids)
+        else:
+            neurons = datasource.get_neurons(skids, remote_instance = remote_instance)
+        return cls.write(neurons, path, format)
+
+    def get_neurons(self, skids = None):
+        """ Build a CatmaidNeuronList of the given skids (all neurons if not given), in the order given."""
+        rows = range(len(self)) if skids is None else [self._row(s) for s in np.atleast_1d(skids)]
+        return pymaid.CatmaidNeuronList([self._neuron(i) for i in rows])
+
+    def nodes(self, skids = None):
+        """ Node table of the given skids (all neurons if not given), with a skeleton_id column, without building
+        any neurons."""
+        return self._take('nodes', skids)
+
+    def connectors(self, skids = None):
+        """ Connector table of the given skids (all neurons if not given), with a skeleton_id column."""
+        return self._take('connectors', skids)
+
+    def _row(self, skid):
+        try:
+            return self._rows[str(skid)]
+        except KeyError:
+            raise KeyError('Neuron {} is not in the store at {}'.format(skid, self.path)) from None
+
+    def _slice(self, table, i):
+        start, count = self._ranges[table]
+        return self._tables[table].slice(int(start[i]), int(count[i]))
+
+    def _take(self, table, skids):
+        if skids is None:
+            return _frame(self._tables[table], self._dtypes[table])
+        start, count = self._ranges[table]
+        rows = [self._row(s) for s in np.atleast_1d(skids)]
+        take = np.concatenate([np.arange(start[i], start[i] + count[i]) for i in rows] + [np.zeros(0, np.int64)])
+        return _frame(self._tables[table].take(take), self._dtypes[table])
+
+    def _neuron(self, i):
+        """ Build neuron i from its rows of each table."""
+        nodes, connectors, tags = (_frame(self._slice(t, i).drop_columns(['skeleton_id']), self._dtypes[t])
+                                   for t in _TABLES[1:])
+        return parallel.unpack_neuron({'skeleton_id': self.skeleton_ids[i],
+                                       'neuron_name': self._names[i],
+                                       'nodes': nodes,
+                                       'connectors': connectors,
+                                       'tags': {t: list(v) for t, v in tags.groupby('tag', observed = True).node_id}})
+
+def _require_pyarrow():
+    """ Raise an ImportError naming the extra to install if pyarrow is missing."""
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError('SkeletonStore needs pyarrow, which is not installed. Install it with '
+                          '`pip install PNtools[store]` (or `pip install pyarrow`).') from None
+
+def _file(path, table, format):
+    return os.path.join(path, table + _EXT[format])
+
+def _tag_table(tags):
+    tags = tags or {}
+    return pd.DataFrame({'tag': [t for t in tags for _ in tags[t]],
+                         'node_id': np.array([n for t in tags for n in tags[t]], dtype = np.int64)})
+
+def _concat(frames, skids, counts):
+    """ One table of all neurons' rows, with a skeleton_id column."""
+    table = pd.concat([f for f in frames if f is not None], ignore_index = True, sort = False)
+    table = table.drop(columns = 'skeleton_id', errors = 'ignore')
+    table.insert(0, 'skeleton_id', np.repeat(np.asarray(skids, dtype = object), counts))
+    return table
+
+def _encode(table):
+    """ float32 coordinates, nullable integer IDs (e.g. parent_id of the root) and dictionary encoded strings."""
+    table = table.copy()
+    for c in table.columns:
+        if c in ('x', 'y', 'z'):
+            table[c] = table[c].astype(np.float32)
+        elif c == 'skeleton_id' or isinstance(table[c].dtype, pd.CategoricalDtype):
+            table[c] = table[c].astype(str).astype('category')
+        elif c.endswith('_id') and (table[c].dtype == object or table[c].dtype.kind == 'f'):
+            # IDs with gaps, like the root's parent, which pandas holds as objects or floats
+            table[c] = pd.to_numeric(table[c]).astype('Int64')
+        elif table[c].dtype == object or pd.api.types.is_string_dtype(table[c].dtype):
+            table[c] = table[c].astype(str).astype('category')
+    return pa.Table.from_pandas(table, preserve_index = False)
+
+def _categories(table):
+    """ Categorical dtype of each dictionary encoded column, from the dictionary it shares across the file."""
+    return {name: pd.CategoricalDtype(col.chunk(0).dictionary.to_pylist() if col.num_chunks else [])
+            for name, col in zip(table.column_names, table.columns) if pa.types.is_dictionary(col.type)}
+
+def _frame(table, dtypes):
+    """ DataFrame of (part of) a stored table, with the dtypes pymaid uses: str skids, and None for missing IDs.
+
+    Categoricals are built straight from their codes with dtypes worked out once, which is a lot quicker than
+    `to_pandas` for the few thousand rows of a single neuron.
+    """
+    data = {}
+    for name, col in zip(table.column_names, table.columns):
+        if name in dtypes:
+            codes = [c.indices.to_numpy(zero_copy_only = False) for c in col.chunks]
+            values = pd.Categorical.from_codes(np.concatenate(codes + [np.zeros(0, np.int8)]), dtype = dtypes[name])
+            if name == 'skeleton_id':
+                values = np.asarray(values, dtype = object)
+        else:
+            values = col.to_numpy()
+            if col.null_count and name.endswith('_id'):
+                ok = ~np.isnan(values)
+                ids = np.full(len(values), None, dtype = object)
+                ids[ok] = values[ok].astype(np.int64)
+                values = ids
+        data[name] = values
+    return pd.DataFrame(data, copy = False)
+
+def _write(table, file, format):
+    if format == 'feather':
+        # uncompressed, so it can be memory mapped without copying
+        feather.write_feather(table, file, compression = 'uncompressed')
+    else:
+        pq.write_table(table, file)
+
+def _read(file, format):
+    if format == 'feather':
+        # Feather (Arrow IPC) files have a single dictionary per column already
+        return feather.read_table(file, memory_map = True)
+    return pq.read_table(file, memory_map = True).unify_dictionaries()
@@ -0,0 +1,171 @@
+# Permutation and bootstrap tests of lifetime sparseness / kurtosis, on whole matrices at once
+import numpy as np
+from . import misc
+from . import utils
+from . import parallel
+pd = utils.lazy_import('pandas')
+
+_STATISTICS = {'lts': misc.calc_lts, 'ltk': misc.calc_ltk}
+
+def permutation_test(x, statistic = 'lts', n_resamples = 1000, alternative = 'greater', seed = None,
+                     chunk_size = 2e7, n_jobs = 1, return_null = False):
+    """ Test the sparseness (or kurtosis) of each row of a matrix against a shuffled null.
+
+    The null is built by shuffling every column independently across rows, so each resample keeps the
+    distribution of values within each column (e.g. each volume) but breaks which row (e.g. neuron) they belong to.
+    Resamples are drawn as one rows x resamples x columns array, in chunks of resamples of about `chunk_size`
+    values, and the statistic computed on each chunk in a single vectorised call.
+
+    Parameters
+    ----------
+
+    x:              array | DataFrame
+                    2-D matrix, e.g. neurons by volumes. Statistics are calculated along rows. NaNs are ignored.
+
+    statistic:      str | function
+                    'lts' (default) for lifetime sparseness, 'ltk' for lifetime kurtosis, or a module level function
+                    taking (x, axis = -1), like `PNtools.calc_lts`.
+
+    n_resamples:    int
+                    Number of shuffles to draw.
+
+    alternative:    str
+                    'greater' (default) tests if rows are sparser than chance, 'less' if less sparse, or 'two-sided'.
+
+    seed:           int
+                    Seed for the random number generator. Each resample gets its own stream spawned from it, so
+                    results are the same whatever n_jobs and chunk_size are.
+
+    chunk_size:     int
+                    Rough number of values to draw at once, to bound memory.
+
+    n_jobs:         int
+                    Number of processes to spread chunks over. 1 (default) runs in this process, -1 uses all CPUs.
+
+    return_null:    Bool
+                    If True, also return the rows x resamples null distribution.
+
+    Returns
+    -------
+
+    DataFrame
+                    For each row: the observed statistic, mean and standard deviation of the null, and p value.
+
+    array
+                    (only if return_null is True) rows x resamples null distribution.
+
+    """
+    values, index = _matrix(x)
+    func = _statistic(statistic)
+    observed = np.asarray(func(values, axis = -1), dtype = np.float64)
+
+    null = _resample(_permute_chunk, values, func, n_resamples, seed, chunk_size, n_jobs)
+
+    with np.errstate(invalid = 'ignore'):
+        greater = (1 + (null >= observed[:, None]).sum(axis = 1)) / (1 + n_resamples)
+        less = (1 + (null <= observed[:, None]).sum(axis = 1)) / (1 + n_resamples)
+    if alternative == 'greater':
+        p = greater
+    elif alternative == 'less':
+        p = less
+    elif alternative == 'two-sided':
+        p = np.minimum(1, 2 * np.minimum(greater, less))
+    else:
+        raise ValueError("alternative must be 'greater', 'less' or 'two-sided'")
+
+    res = pd.DataFrame({'observed': observed,
+                        'null_mean': np.nanmean(null, axis = 1),
+                        'null_std': np.nanstd(null, axis = 1),
+                        'p_value': p}, index = index)
+    if return_null:
+        return res, null
+    return res
+
+def bootstrap_ci(x, statistic = 'lts', n_resamples = 1000, confidence = 0.95, seed = None, chunk_size = 2e7,
+                 n_jobs = 1):
+    """ Bootstrap confidence intervals for the sparseness (or kurtosis) of each row of a matrix.
+
+    Each resample draws the values of a row with replacement. All resamples are drawn as one rows x resamples x
+    columns array (in chunks of about `chunk_size` values) and reduced in a single vectorised call per chunk.
+
+    Parameters
+    ----------
+
+    x:              array | DataFrame
+                    2-D matrix, e.g. neurons by volumes. Statistics are calculated along rows. NaNs are ignored.
+
+    statistic:      str | function
+                    'lts' (default), 'ltk', or a module level function taking (x, axis = -1).
+
+    n_resamples:    int
+                    Number of bootstrap resamples.
+
+    confidence:     float
+                    Confidence level of the (percentile) interval. 0.95 by default.
+
+    seed:           int
+                    Seed for the random number generator.
+
+    chunk_size:     int
+                    Rough number of values to draw at once, to bound memory.
+
+    n_jobs:         int
+                    Number of processes to spread chunks over. 1 (default) runs in this process, -1 uses all CPUs.
+
+    Returns
+    -------
+
+    DataFrame
+                    For each row: the observed statistic, and the lower and upper bounds of the interval.
+
+    """
+    values, index = _matrix(x)
+    func = _statistic(statistic)
+    observed = np.asarray(func(values, axis = -1), dtype = np.float64)
+
+    boot = _resample(_bootstrap_chunk, values, func, n_resamples, seed, chunk_size, n_jobs)
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.nanpercentile(boot, [tail, 100 - tail], axis = 1)
+    return pd.DataFrame({'observed': observed, 'ci_low': low, 'ci_high': high}, index = index)
+
+def _matrix(x):
+    if isinstance(x, pd.DataFrame):
+        return x.values.astype(np.float64), x.index
+    x = np.asarray(x, dtype = np.float64)
+    if x.ndim != 2:
+        raise ValueError('Expected a 2-D matrix, got {} dimensions'.format(x.ndim))
+    return x, pd.RangeIndex(len(x))
+
+def _statistic(statistic):
+    if callable(statistic):
+        return statistic
+    if statistic not in _STATISTICS:
+        raise ValueError('statistic must be one of {} or a function'.format(list(_STATISTICS)))
+    return _STATISTICS[statistic]
+
+def _resample(chunk_func, values, func, n_resamples, seed, chunk_size, n_jobs):
+    """ rows x resamples statistics, from chunks of resamples each drawn with their own seeded generator.
+
+    Every resample has its own stream spawned from `seed`, so how they are split into chunks (and over processes)
+    does not change what is drawn.
+    """
+    per_chunk = max(1, int(chunk_size // max(values.size, 1)))
+    seeds = np.random.SeedSequence(seed).spawn(n_resamples)
+    chunks = [seeds[i:i + per_chunk] for i in range(0, n_resamples, per_chunk)]
+    res = parallel.map_tasks(chunk_func, chunks, n_jobs = n_jobs, shared = {'values': values, 'func': func})
+    return np.concatenate(res, axis = 1)
+
+def _permute_chunk(seeds, values, func):
+    """ Statistic of each row, for one resample per seed with every column shuffled across rows."""
+    rows, cols = values.shape
+    # ranks of random numbers are a random permutation of the rows, independently for every resample and column
+    noise = np.stack([np.random.default_rng(s).random((rows, cols)) for s in seeds])
+    shuffled = values[np.argsort(noise, axis = 1), np.arange(cols)]
+    return np.asarray(func(shuffled, axis = -1)).T
+
+def _bootstrap_chunk(seeds, values, func):
+    """ Statistic of each row, for one resample per seed of the row's values with replacement."""
+    rows, cols = values.shape
+    picks = np.stack([np.random.default_rng(s).integers(0, cols, (rows, cols)) for s in seeds])
+    drawn = values[np.arange(rows)[:, None], picks]
+    return np.asarray(func(drawn, axis = -1)).T
@@ -0,0 +1,405 @@
+# Array based skeleton topology, for fast traversals of neurons
+import hashlib
+import numpy as np
+from . import utils
+from . import volume_index
+pymaid = utils.lazy_import('pymaid')
+pd = utils.lazy_import('pandas')
+
+class Topology:
+    """ Compact, array based topology of a skeleton.
+
+    Nodes are referred to by their position in `node_ids`. The tree is held as a parent index array (-1 for the
+    root), children in compressed form (children of node i are `children[child_offsets[i]:child_offsets[i + 1]]`)
+    and float32 edge lengths to the parent. Distances to the root of every node are computed in a single
+    vectorised traversal the first time they are needed.
+
+    Use `Topology.from_neuron` or `Topology.from_nodes` to build one, or `cached_topology` to get the one kept on a
+    neuron for reuse.
+
+    Parameters
+    ----------
+
+    node_ids:   array
+                Node (treenode) IDs.
+
+    parent:     array
+                Index of each node's parent in `node_ids`, -1 for the root(s).
+
+    xyz:        array
+                (N, 3) node coordinates.
+
+    """
+
+    def __init__(self, node_ids, parent, xyz):
+        self.node_ids = np.asarray(node_ids, dtype = np.int64)
+        self.parent = np.array(parent, dtype = np.int64)
+        self.xyz = np.asarray(xyz, dtype = np.float32)
+        self._update()
+
+    def __repr__(self):
+        return '<Topology: {} nodes, {} branch points, {} leaves>'.format(len(self), len(self.branch_points), len(self.leaves))
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @classmethod
+    def from_nodes(cls, nodes, root = None):
+        """ Build from a node table with treenode_id, parent_id, x, y and z columns, optionally rerooted to `root`."""
+        parent = pd.Index(nodes.treenode_id.values).get_indexer(nodes.parent_id.values)
+        topo = cls(nodes.treenode_id.values, parent, nodes[['x','y','z']].values)
+        if root is not None:
+            topo.reroot(root)
+        return topo
+
+    @classmethod
+    def from_neuron(cls, neuron, root = None):
+        """ Build from a CatmaidNeuron, optionally rerooted to `root` (e.g. neuron.soma). The neuron is not changed."""
+        return cls.from_nodes(neuron.nodes, root)
+
+    def _update(self):
+        """ Recompute everything derived from the parent array."""
+        has_parent = self.parent >= 0
+        self.edge_length = np.zeros(len(self), dtype = np.float32)
+        self.edge_length[has_parent] = np.linalg.norm(self.xyz[has_parent] - self.xyz[self.parent[has_parent]], axis = 1)
+        child = np.flatnonzero(has_parent)
+        self.children = child[np.argsort(self.parent[child], kind = 'stable')]
+        self.child_offsets = np.concatenate([[0], np.cumsum(np.bincount(self.parent[child], minlength = len(self)))])
+        self.roots = np.flatnonzero(~has_parent)
+        self.root = self.roots[0] if len(self.roots) else -1
+        self._distances = None
+        self._depth = None
+        self._up = None
+        self._longest = None
+
+    @property
+    def n_children(self):
+        """ Number of children of each node."""
+        return np.diff(self.child_offsets)
+
+    @property
+    def branch_points(self):
+        """ Indices of branch points (non-root nodes with more than one child)."""
+        return np.flatnonzero((self.n_children > 1) & (self.parent >= 0))
+
+    @property
+    def leaves(self):
+        """ Indices of leaf nodes (nodes without children)."""
+        return np.flatnonzero(self.n_children == 0)
+
+    @property
+    def distances(self):
+        """ Distance along the skeleton from every node to its root."""
+        if self._distances is None:
+            self._traverse()
+        return self._distances
+
+    @property
+    def depth(self):
+        """ Number of edges between every node and its root."""
+        if self._depth is None:
+            self._traverse()
+        return self._depth
+
+    def _traverse(self):
+        # pointer jumping: each round adds the distance to the current ancestor, then skips to its ancestor,
+        # so every node reaches its root in log2(depth) vectorised rounds
+        anc = self.parent.copy()
+        dist = self.edge_length.astype(np.float64)
+        depth = (anc >= 0).astype(np.int64)
+        todo = np.flatnonzero(anc >= 0)
+        while len(todo):
+            up = anc[todo]
+            dist[todo] += dist[up]
+            depth[todo] += depth[up]
+            anc[todo] = anc[up]
+            todo = todo[anc[todo] >= 0]
+        self._distances = dist
+        self._depth = depth
+
+    def index(self, node_ids):
+        """ Positions of the given node IDs in `node_ids`."""
+        idx = pd.Index(self.node_ids).get_indexer(np.atleast_1d(node_ids))
+        if np.any(idx < 0):
+            raise ValueError('Node ID(s) not in neuron: {}'.format(np.atleast_1d(node_ids)[idx < 0]))
+        return idx
+
+    @property
+    def ancestors(self):
+        """ Binary lifting table: ancestors[k, i] is the ancestor 2**k edges above node i (or its root)."""
+        if self._up is None:
+            up = np.where(self.parent >= 0, self.parent, np.arange(len(self)))
+            levels = [up]
+            for _ in range(max(int(self.depth.max()).bit_length() - 1, 0)):
+                levels.append(levels[-1][levels[-1]])
+            self._up = np.array(levels)
+        return self._up
+
+    def _lift(self, idx, steps):
+        """ Move each node in `idx` up by `steps` edges."""
+        idx = idx.copy()
+        for k in range(len(self.ancestors)):
+            move = (steps >> k) & 1 == 1
+            idx[move] = self.ancestors[k, idx[move]]
+        return idx
+
+    def _lca(self, a, b):
+        """ Lowest common ancestor of index arrays a and b, -1 where they are in different fragments."""
+        da, db = self.depth[a], self.depth[b]
+        # nodes in different fragments have no common ancestor
+        apart = self._lift(a, da) != self._lift(b, db)
+        a = self._lift(a, np.maximum(da - db, 0))
+        b = self._lift(b, np.maximum(db - da, 0))
+        for k in range(len(self.ancestors) - 1, -1, -1):
+            ua, ub = self.ancestors[k, a], self.ancestors[k, b]
+            move = ua != ub
+            a[move], b[move] = ua[move], ub[move]
+        lca = np.where(a == b, a, self.ancestors[0, a])
+        lca[apart] = -1
+        return lca
+
+    def lca(self, a, b):
+        """ Lowest common ancestor of each pair of node IDs in `a` and `b`, -1 for pairs in different fragments."""
+        lca = self._lca(self.index(a), self.index(b))
+        return np.where(lca >= 0, self.node_ids[lca], -1)
+
+    def geodesic(self, a, b):
+        """ Distance along the skeleton between each pair of node IDs in `a` and `b`, inf for pairs in different fragments."""
+        a, b = self.index(a), self.index(b)
+        lca = self._lca(a, b)
+        dist = self.distances[a] + self.distances[b] - 2 * self.distances[np.maximum(lca, 0)]
+        return np.where(lca >= 0, dist, np.inf)
+
+    def distance_to_root(self, nodes):
+        """ Distance along the skeleton from each node ID in `nodes` to its root."""
+        return self.distances[self.index(nodes)]
+
+    def paths_to_root(self, nodes):
+        """ For each node ID in `nodes`, an array of node IDs from that node up to and including its root."""
+        idx = self.index(nodes)
+        owner, steps = [], []
+        cur, active = idx, np.arange(len(idx))
+        # walk every path up one edge at a time, all at once
+        while len(active):
+            owner.append(active)
+            steps.append(cur)
+            keep = self.parent[cur] >= 0
+            cur, active = self.parent[cur[keep]], active[keep]
+        owner, steps = np.concatenate(owner), np.concatenate(steps)
+        order = np.argsort(owner, kind = 'stable')
+        return np.split(self.node_ids[steps[order]], np.cumsum(np.bincount(owner, minlength = len(idx)))[:-1])
+
+    def path_to_root(self, node):
+        """ Node IDs from `node` up to and including its root."""
+        return self.paths_to_root([node])[0]
+
+    def longest_neurite(self):
+        """ Node IDs from the root to the leaf furthest from it, i.e. the same nodes as `pymaid.longest_neurite`."""
+        if self._longest is None:
+            leaves = self.leaves
+            self._longest = self.path_to_root(self.node_ids[leaves[np.argmax(self.distances[leaves])]])[::-1]
+        return self._longest
+
+    def subset(self, mask):
+        """ Topology of just the nodes in boolean `mask`, with edges to nodes outside of it cut (as `pymaid.subset_neuron`)."""
+        keep = np.flatnonzero(mask)
+        new = np.full(len(self), -1, dtype = np.int64)
+        new[keep] = np.arange(len(keep))
+        parent = self.parent[keep]
+        parent[parent >= 0] = new[parent[parent >= 0]]
+        return Topology(self.node_ids[keep], parent, self.xyz[keep])
+
+    def connecting(self, mask):
+        """ Boolean mask of the smallest connected set of nodes holding every node in `mask` - the nodes on the paths
+        between them, within each fragment. This is what `pymaid.subset_neuron(..., prevent_fragments = True)` keeps."""
+        idx = np.flatnonzero(mask)
+        out = np.zeros(len(self), dtype = bool)
+        # every node on the way up from a masked node to its root, visiting each node once
+        cur = idx
+        while len(cur):
+            out[cur] = True
+            cur = np.unique(self.parent[cur])
+            cur = cur[cur >= 0]
+            cur = cur[~out[cur]]
+        # less the nodes above the lowest common ancestor of the masked nodes of each fragment
+        fragment = self._lift(idx, self.depth[idx])
+        for root in np.unique(fragment):
+            lca = idx[fragment == root]
+            while len(lca) > 1:
+                half = len(lca) // 2
+                lca = np.concatenate([self._lca(lca[:half], lca[half:2 * half]), lca[2 * half:]])
+            if self.parent[lca[0]] >= 0:
+                out[self.index(self.path_to_root(self.node_ids[self.parent[lca[0]]]))] = False
+        return out
+
+    def reroot(self, node):
+        """ Reroot the topology to the given node ID, in place."""
+        path = self.index(self.path_to_root(node))
+        self.parent[path[1:]] = path[:-1]
+        self.parent[path[0]] = -1
+        self._update()
+
+def cached_topology(neuron, root = None):
+    """ Topology of a neuron, kept on the neuron and reused until its nodes change.
+
+    The first call builds the Topology (rerooted to `root`, e.g. neuron.soma, without changing the neuron) and keeps
+    it on the neuron, along with a fingerprint of its node IDs, parents and coordinates. Later calls - from
+    `first_branch`, `pruning`, `PN_axon_prune`, `ends_matrix` or any NeuronView of the neuron - get the same Topology,
+    with everything it has worked out so far (distances to the root, the longest neurite, ...). If the neuron has
+    been changed since (e.g. pruned or rerooted in place), the fingerprint no longer matches and it is rebuilt.
+
+    The Topology is shared, so treat it as read-only: ask for another `root` rather than rerooting it.
+
+    Parameters
+    ----------
+
+    neuron:     CatmaidNeuron
+                Neuron to get the topology of.
+
+    root:       int
+                (optional) Node ID to root the topology at. The neuron's own root by default.
+
+    Returns
+    -------
+
+    Topology
+
+    """
+    key = _fingerprint(neuron.nodes)
+    cache = getattr(neuron, '_topology_cache', None)
+    if cache is None or cache[0] != key:
+        cache = (key, {})
+        neuron._topology_cache = cache
+    if root not in cache[1]:
+        cache[1][root] = Topology.from_neuron(neuron, root)
+    return cache[1][root]
+
+def _fingerprint(nodes):
+    """ Hash of the node IDs, parents and coordinates of a node table."""
+    h = hashlib.sha1(np.ascontiguousarray(nodes.treenode_id.values, dtype = np.int64).tobytes())
+    h.update(np.ascontiguousarray(pd.to_numeric(nodes.parent_id, errors = 'coerce').values, dtype = np.float64).tobytes())
+    h.update(np.ascontiguousarray(nodes[['x','y','z']].values, dtype = np.float64).tobytes())
+    return h.hexdigest()
+
+class NeuronView:
+    """ Nodes of a neuron, as a boolean mask over it, for pruning without copying the neuron at every step.
+
+    Views share their neuron, which is never changed, and its Topology. They combine like sets: `a & b` keeps the
+    nodes in both, `a | b` those in either, and `a - b` those in a but not in b. Only `materialise` makes a new
+    CatmaidNeuron, so a chain of pruning steps costs one copy of the neuron at the end, rather than one per step.
+
+    Parameters
+    ----------
+
+    neuron:     CatmaidNeuron
+                Neuron to view.
+
+    mask:       array
+                (optional) Boolean array, one per row of `neuron.nodes`. All nodes by default.
+
+    root:       int
+                (optional) Node ID (e.g. neuron.soma) to root the topology at, and the materialised neuron. The neuron
+                itself is not rerooted.
+
+    topology:   Topology
+                (optional) Topology of the whole neuron, rooted at `root`, for the view to share. By default the
+                neuron's `cached_topology` is used, so views of the same neuron share one Topology. Views derived from
+                this one (with `&`, `in_volume` etc.) share it too.
+
+    Examples
+    --------
+
+    >>> view = NeuronView(n, root = n.soma)
+    >>> axon = view.in_volume(AL, mode = 'OUT') - view.longest_neurite()
+    >>> pruned = axon.materialise()
+
+    """
+
+    def __init__(self, neuron, mask = None, root = None, topology = None):
+        self.neuron = neuron
+        self.root = root
+        self.mask = np.ones(len(neuron.nodes), dtype = bool) if mask is None else np.asarray(mask, dtype = bool)
+        self._base = topology
+        self._topology = None
+
+    def __repr__(self):
+        return '<NeuronView: {} of {} nodes of {}>'.format(len(self), len(self.mask), self.neuron.skeleton_id)
+
+    def __len__(self):
+        return int(self.mask.sum())
+
+    def __and__(self, other):
+        return self._view(self.mask & _mask(other))
+
+    def __or__(self, other):
+        return self._view(self.mask | _mask(other))
+
+    def __sub__(self, other):
+        return self._view(self.mask & ~_mask(other))
+
+    @property
+    def base(self):
+        """ Topology of the whole neuron, rooted at `root` (see `cached_topology`), shared by every view derived from this one."""
+        if self._base is None:
+            self._base = cached_topology(self.neuron, self.root)
+        return self._base
+
+    @property
+    def topology(self):
+        """ Topology of just the nodes in view, as if the neuron had been pruned to them."""
+        if self._topology is None:
+            self._topology = self.base if self.mask.all() else self.base.subset(self.mask)
+        return self._topology
+
+    @property
+    def node_ids(self):
+        """ IDs of the nodes in view."""
+        return self.base.node_ids[self.mask]
+
+    def _view(self, mask):
+        if self._base is None:
+            # build the topology now, so every derived view shares it
+            self.base
+        return NeuronView(self.neuron, mask, self.root, self._base)
+
+    def isin(self, node_ids):
+        """ View of the given node IDs (of those in this view)."""
+        return self._view(self.mask & np.isin(self.base.node_ids, node_ids))
+
+    def in_volume(self, volume, mode = 'IN', scale = 1, prevent_fragments = False):
+        """ View of the nodes inside (or with mode = 'OUT', outside) a single volume, tested with its cached index
+        (see `PNtools.indexed_volume`). If prevent_fragments is True, nodes joining them into one piece are kept too."""
+        inside = np.zeros(len(self.mask), dtype = bool)
+        inside[self.mask] = volume_index._inside(self.neuron.nodes[['x','y','z']].values[self.mask], volume, scale)
+        view = self._view(inside if mode == 'IN' else self.mask & ~inside)
+        return view.connected() if prevent_fragments else view
+
+    def connected(self):
+        """ View of the nodes in view, plus the nodes needed to join them into a single piece."""
+        return self._view(self.base.connecting(self.mask))
+
+    def longest_neurite(self):
+        """ View of the nodes from the root to the furthest leaf, like `pymaid.longest_neurite`."""
+        return self.isin(self.topology.longest_neurite())
+
+    def branch_points(self):
+        """ View of the branch points of the nodes in view."""
+        topo = self.topology
+        return self.isin(topo.node_ids[topo.branch_points])
+
+    def upstream_of(self, node):
+        """ View of the nodes from `node` up to the root, i.e. what `prune_distal_to(node)` leaves of a neurite."""
+        return self.isin(self.topology.path_to_root(node))
+
+    def materialise(self, prevent_fragments = False):
+        """ A new CatmaidNeuron of the nodes in view (rerooted at `root`, if given). The viewed neuron is not changed."""
+        view = self.connected() if prevent_fragments else self
+        if self.root is None:
+            return pymaid.subset_neuron(self.neuron, view.node_ids, inplace = False)
+        # reroot before subsetting, so fragments are oriented from the root as they would be in the neuron
+        neuron = self.neuron.reroot(self.root, inplace = False)
+        pymaid.subset_neuron(neuron, view.node_ids, inplace = True)
+        return neuron
+
+def _mask(x):
+    return x.mask if isinstance(x, NeuronView) else np.asarray(x, dtype = bool)
@@ -1,15 +1,58 @@
-import pymaid
+import os
+import json
+import time
+import threading
+import importlib
+import numpy as np
 from functools import wraps
 
+class lazy_import:
+    """ Stand-in for a module, or an attribute of one, which is only imported when first used.
+
+    Keeps `import PNtools` fast for heavy dependencies (pymaid, pandas, matplotlib...), which are then only loaded
+    by the functions that need them.
+
+    Examples
+    --------
+
+    >>> pd = lazy_import('pandas')
+    >>> tqdm = lazy_import('tqdm', 'tqdm')
+    """
+
+    def __init__(self, name, attr = None):
+        self._name = name
+        self._attr = attr
+        self._target = None
+
+    def __repr__(self):
+        return '<lazy_import: {}{}>'.format(self._name, '' if self._attr is None else '.' + self._attr)
+
+    def _load(self):
+        if self._target is None:
+            target = importlib.import_module(self._name)
+            if self._attr is not None:
+                target = getattr(target, self._attr)
+            self._target = target
+        return self._target
+
+    def __getattr__(self, attr):
+        # guard against lookups before __init__ has run (e.g. when copied)
+        if attr in ('_name', '_attr', '_target'):
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+pd = lazy_import('pandas')
+datasource = lazy_import(__package__ + '.datasource')
+
 def has_remote_instance(function):
-    """Decorator to exit function early if not CatmaidInstance."""
+    """Decorator to exit function early if not CatmaidInstance (or a replayed archive, see `datasource`)."""
     @wraps(function)
     def wrapper(*args, **kwargs):
         # Get remote instance
-        pymaid.set_loggers('ERROR')
-        rm = pymaid.utils._eval_remote_instance(None, raise_error=False)
-        pymaid.set_loggers('INFO')
-        if not rm:
+        if not datasource.get_source().is_available():
             print('No global CatmaidInstance set. Please define and rerun.')
             return
 
@@ -17,3 +60,122 @@ def has_remote_instance(function):
         res = function(*args, **kwargs)
         return res
     return wrapper
+
+# Instrumentation. Off by default - when off, every timer is a single flag check.
+_enabled = False
+_records = []
+_lock = threading.Lock()
+_t0 = time.perf_counter()
+
+def enable_instrumentation(clear = True):
+    """ Start recording stage timings and remote calls, clearing previous records unless `clear` is False."""
+    global _enabled, _t0
+    if clear:
+        clear_instrumentation()
+        _t0 = time.perf_counter()
+    _enabled = True
+
+def disable_instrumentation():
+    """ Stop recording. Records made so far are kept until cleared."""
+    global _enabled
+    _enabled = False
+
+def clear_instrumentation():
+    """ Forget all records."""
+    with _lock:
+        del _records[:]
+
+def _record(name, kind, start, end, payload = None):
+    rec = {'name': name, 'kind': kind, 'start': start - _t0, 'duration': end - start,
+           'thread': threading.get_ident(), 'pid': os.getpid(), 'payload': payload}
+    with _lock:
+        _records.append(rec)
+
+class stage:
+    """ Time a stage of work, as a context manager or as a decorator. Only records while instrumentation is enabled.
+
+    Examples
+    --------
+
+    >>> with utils.stage('pruning.subset'):
+    ...     subset_neuron(...)
+
+    >>> @utils.stage('ends_matrix')
+    ... def ends_matrix(...):
+
+    Note that work sent to other processes (n_jobs > 1) is not recorded, only the stage that sent it.
+    """
+    __slots__ = ('name', 'kind', '_start')
+
+    def __init__(self, name, kind = 'stage'):
+        self.name = name
+        self.kind = kind
+        self._start = None
+
+    def __enter__(self):
+        if _enabled:
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self._start is not None:
+            _record(self.name, self.kind, self._start, time.perf_counter())
+            self._start = None
+
+    def __call__(self, function):
+        name, kind = self.name, self.kind
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _record(name, kind, start, time.perf_counter())
+        return wrapper
+
+def payload_size(x):
+    """ Approximate size in bytes of data returned by a remote call."""
+    if x is None:
+        return 0
+    if isinstance(x, pd.DataFrame):
+        return int(x.memory_usage(index = False).sum())
+    if isinstance(x, (pd.Series, pd.Index, np.ndarray)):
+        return int(x.nbytes)
+    if isinstance(x, dict):
+        return sum(payload_size(v) for v in x.values())
+    if isinstance(x, (str, bytes)):
+        return len(x)
+    if hasattr(x, 'vertices') and hasattr(x, 'faces'):
+        return int(np.asarray(x.vertices).nbytes + np.asarray(x.faces).nbytes)
+    if hasattr(x, 'nodes') and isinstance(getattr(x, 'nodes'), pd.DataFrame):
+        return payload_size(x.nodes) + payload_size(getattr(x, 'connectors', None))
+    if isinstance(x, (list, tuple)) or hasattr(x, 'neurons'):
+        return sum(payload_size(v) for v in x)
+    return 0
+
+def instrumentation_trace():
+    """ All records as a DataFrame: one row per stage or remote call, with start and duration in seconds and the
+    response size in bytes (remote calls only)."""
+    with _lock:
+        records = list(_records)
+    return pd.DataFrame(records, columns = ['name','kind','start','duration','thread','pid','payload'])
+
+def instrumentation_summary():
+    """ Calls, total and mean time, and total payload for each stage / remote call, slowest first."""
+    trace = instrumentation_trace()
+    summary = trace.groupby(['kind','name']).agg(calls = ('duration','size'),
+                                                 total = ('duration','sum'),
+                                                 mean = ('duration','mean'),
+                                                 payload = ('payload','sum'))
+    return summary.sort_values('total', ascending = False)
+
+def export_trace(path):
+    """ Write the records as a Chrome trace (open in chrome://tracing or https://ui.perfetto.dev)."""
+    events = [{'name': r['name'], 'cat': r['kind'], 'ph': 'X', 'pid': r['pid'], 'tid': r['thread'],
+               'ts': r['start'] * 1e6, 'dur': r['duration'] * 1e6,
+               'args': {} if pd.isnull(r['payload']) else {'payload': int(r['payload'])}}
+              for r in instrumentation_trace().to_dict('records')]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,237 @@
+# Local on-disk cache of CATMAID volume meshes
+import os
+import json
+import time
+import hashlib
+import numpy as np
+from . import datasource
+from . import utils
+pymaid = utils.lazy_import('pymaid')
+
+# Where the default cache lives, unless PNTOOLS_CACHE is set
+_DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'PNtools', 'volumes')
+
+_default = None
+
+# Volumes fetched this session with _get_volume(..., session = True), by (instance, name)
+_session = {}
+
+class VolumeCache:
+    """ On-disk cache of CATMAID volume meshes.
+
+    Each mesh is stored as an uncompressed .npz file holding float32 vertices and uint32 faces, keyed by the
+    server URL, project ID and volume name of the instance it came from. On each request the cache checks the
+    volume's edition time on the server (one request for all volumes) and re-fetches any mesh which has changed.
+    If the cache grows over `max_size` bytes, the least recently used meshes are removed.
+
+    Parameters
+    ----------
+
+    path:       str
+                Directory to keep the cache in. If not given, falls back to the PNTOOLS_CACHE environment variable,
+                or ~/.cache/PNtools/volumes.
+
+    max_size:   int
+                Maximum size of the cache in bytes. 2GB by default. If None, the cache is never evicted.
+
+    """
+
+    def __init__(self, path = None, max_size = 2e9):
+        if path is None:
+            path = os.environ.get('PNTOOLS_CACHE', _DEFAULT_PATH)
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok = True)
+        self._index_file = os.path.join(self.path, 'index.json')
+        self._index = self._read_index()
+
+    def __repr__(self):
+        return '<VolumeCache: {} volumes, {:.1f}MB at {}>'.format(len(self._index), self.size / 1e6, self.path)
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def size(self):
+        """ Total size of the cached meshes in bytes."""
+        return sum(e['size'] for e in self._index.values())
+
+    def get_volume(self, names, remote_instance = None, check_freshness = True, listing = None):
+        """ Get volume(s), from the cache where possible.
+
+        Parameters
+        ----------
+
+        names:              str | list
+                            Name, or list of names, of the volumes to get.
+
+        remote_instance:    CatmaidInstance
+                            Instance to get the volumes from. If not given, falls back to the global instance.
+
+        check_freshness:    Bool
+                            If True (default), compare the edition time of each cached volume to the server and
+                            re-fetch outdated ones. If False, cached meshes are returned without asking the server.
+
+        listing:            DataFrame
+                            (optional) Output of `pymaid.get_volume()`, if you already have it, to save a request
+                            when checking freshness.
+
+        Returns
+        -------
+
+        Volume | dict
+                            A single volume if a single name is given, otherwise a dictionary of volumes.
+
+        """
+        single = isinstance(names, str)
+        if single:
+            names = [names]
+
+        instance = datasource.instance_key(remote_instance)
+        keys = {n: self._key(instance, n) for n in names}
+
+        # edition times on the server, for the volumes we need
+        editions = {}
+        if check_freshness:
+            if listing is None:
+                listing = datasource.get_volume(remote_instance = remote_instance)
+            if 'edition_time' in listing.columns:
+                listing = listing.loc[listing.name.isin(names)]
+                editions = dict(zip(listing.name, listing.edition_time.astype(str)))
+
+        vols = {}
+        missing = []
+        for n in names:
+            entry = self._index.get(keys[n])
+            if entry is None or (n in editions and editions[n] != entry['edition_time']):
+                missing.append(n)
+            else:
+                vols[n] = self._load(keys[n])
+
+        if missing:
+            fetched = datasource.get_volume(missing, remote_instance = remote_instance)
+            if isinstance(fetched, pymaid.Volume):
+                fetched = {missing[0]: fetched}
+            for n, v in fetched.items():
+                self._store(keys[n], n, v, editions.get(n))
+                # served from the cache, so it is the same (float32) mesh a later hit returns
+                vols[n] = self._load(keys[n])
+
+        self._write_index()
+        if self.max_size is not None:
+            self.evict()
+
+        if single:
+            return vols[names[0]]
+        return {n: vols[n] for n in names}
+
+    def evict(self, max_size = None):
+        """ Remove least recently used meshes until the cache is under `max_size` bytes."""
+        if max_size is None:
+            max_size = self.max_size
+        total = self.size
+        for key in sorted(self._index, key = lambda k: self._index[k]['last_access']):
+            if total <= max_size:
+                break
+            total -= self._index[key]['size']
+            self._remove(key)
+        self._write_index()
+
+    def clear(self):
+        """ Remove every mesh from the cache."""
+        for key in list(self._index):
+            self._remove(key)
+        self._write_index()
+
+    def _key(self, instance, name):
+        return hashlib.sha1('{}|{}|{}'.format(instance[0], instance[1], name).encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def _load(self, key):
+        with np.load(self._file(key)) as f:
+            vol = pymaid.Volume(f['vertices'], f['faces'], name = str(f['name']), color = tuple(f['color']))
+        self._index[key]['last_access'] = time.time()
+        return vol
+
+    def _store(self, key, name, vol, edition_time):
+        color = getattr(vol, 'color', (1, 1, 1, .1))
+        np.savez(self._file(key),
+                 vertices = np.asarray(vol.vertices, dtype = np.float32),
+                 faces = np.asarray(vol.faces, dtype = np.uint32),
+                 name = name,
+                 color = np.asarray(color, dtype = float))
+        self._index[key] = {'name': name,
+                            'edition_time': edition_time,
+                            'size': os.path.getsize(self._file(key)),
+                            'last_access': time.time()}
+
+    def _remove(self, key):
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+        self._index.pop(key, None)
+
+    def _read_index(self):
+        if not os.path.isfile(self._index_file):
+            return {}
+        with open(self._index_file) as f:
+            index = json.load(f)
+        # drop entries whose mesh file has gone missing
+        return {k: v for k, v in index.items() if os.path.isfile(self._file(k))}
+
+    def _write_index(self):
+        tmp = self._index_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self._index_file)
+
+def default_cache():
+    """ Returns the default VolumeCache, creating it on first use."""
+    global _default
+    if _default is None:
+        _default = VolumeCache()
+    return _default
+
+def set_default_cache(cache):
+    """ Set the VolumeCache used by default in PNtools, e.g. to change its location or size.
+
+    Parameters
+    ----------
+
+    cache:      VolumeCache | str
+                A VolumeCache, or a path to create one at.
+
+    """
+    global _default
+    if isinstance(cache, str):
+        cache = VolumeCache(cache)
+    _default = cache
+
+def _get_volume(names, cache = True, remote_instance = None, listing = None, session = False):
+    """ Get volume(s) through `cache` - True for the default cache, False/None to go straight to the server.
+
+    If session is True, volumes already fetched this way in this session are reused without asking the server at all.
+    """
+    if session:
+        instance = datasource.instance_key(remote_instance)
+        single = isinstance(names, str)
+        wanted = [names] if single else list(names)
+        missing = [n for n in wanted if (instance, n) not in _session]
+        if missing:
+            fetched = _get_volume(missing, cache, remote_instance, listing)
+            if len(missing) == 1 and not isinstance(fetched, dict):
+                fetched = {missing[0]: fetched}
+            _session.update({(instance, n): v for n, v in fetched.items()})
+        if single:
+            return _session[(instance, names)]
+        return {n: _session[(instance, n)] for n in wanted}
+    if cache is True:
+        cache = default_cache()
+    if not cache:
+        if remote_instance is None:
+            return datasource.get_volume(names)
+        return datasource.get_volume(names, remote_instance = remote_instance)
+    return cache.get_volume(names, remote_instance = remote_instance, listing = listing)
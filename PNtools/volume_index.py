@@ -0,0 +1,716 @@
+# Spatial indexing of volume meshes for fast point-in-volume tests
+import os
+import json
+import hashlib
+import numpy as np
+from . import utils
+pymaid = utils.lazy_import('pymaid')
+pd = utils.lazy_import('pandas')
+
+class _MeshIndex:
+    """ Uniform grid of mesh triangles over the y/z plane, for ray parity tests along +x.
+
+    All triangles of all meshes go into a single grid, so one pass over the points tests them against every mesh:
+    the triangles in each point's grid cell are intersected with a ray from the point along +x, and a point is
+    inside a mesh if the ray crosses that mesh an odd number of times.
+
+    """
+
+    def __init__(self, meshes):
+        verts = [np.asarray(v, dtype = np.float64) for v, f in meshes]
+        faces = [np.asarray(f, dtype = np.int64) for v, f in meshes]
+        self.n_meshes = len(meshes)
+        self.bounds = np.array([[v.min(axis = 0), v.max(axis = 0)] for v in verts])
+        self.tris = np.concatenate([v[f] for v, f in zip(verts, faces)])
+        self.tri_mesh = np.repeat(np.arange(self.n_meshes), [len(f) for f in faces])
+
+        # project onto y/z, triangles parallel to the ray are never hit by it
+        a, b, c = self.tris[:, 0], self.tris[:, 1], self.tris[:, 2]
+        area = (b[:, 1] - a[:, 1]) * (c[:, 2] - a[:, 2]) - (b[:, 2] - a[:, 2]) * (c[:, 1] - a[:, 1])
+        self._ray_ok = area != 0
+        uv = self.tris[:, :, 1:].copy()
+        # make every projected triangle counter clockwise
+        flip = area < 0
+        uv[flip] = uv[flip][:, [0, 2, 1]]
+        self._uv = uv
+        self._d = np.roll(uv, -1, axis = 1) - uv
+        # top-left rule, so points on a shared edge are only counted by one triangle
+        self._topleft = (self._d[..., 1] < 0) | ((self._d[..., 1] == 0) & (self._d[..., 0] < 0))
+        # edge functions are computed from the lexicographically smaller end of each edge, and flipped as needed, so
+        # the two triangles sharing an edge get exactly opposite values (no point slips between them through rounding)
+        end = np.roll(uv, -1, axis = 1)
+        swap = (end[..., 0] < uv[..., 0]) | ((end[..., 0] == uv[..., 0]) & (end[..., 1] < uv[..., 1]))
+        self._base = np.where(swap[..., None], end, uv)
+        self._dc = np.where(swap[..., None], -self._d, self._d)
+        self._sign = np.where(swap, -1., 1.)
+        # the same, in 3D, for segments in any direction: each edge from its lexicographically smaller end
+        v0 = self.tris
+        v1 = np.roll(self.tris, -1, axis = 1)
+        swap3 = (v1[..., 0] < v0[..., 0]) | ((v1[..., 0] == v0[..., 0]) & ((v1[..., 1] < v0[..., 1]) |
+                                             ((v1[..., 1] == v0[..., 1]) & (v1[..., 2] < v0[..., 2]))))
+        self._p3 = np.where(swap3[..., None], v1, v0)
+        self._q3 = np.where(swap3[..., None], v0, v1)
+        self._sign3 = np.where(swap3, -1., 1.)
+        self._xlo = self.tris[:, :, 0].min(axis = 1)
+        self._xhi = self.tris[:, :, 0].max(axis = 1)
+
+        # plane of each triangle as x = cx + cy * y + cz * z
+        n = np.cross(b - a, c - a)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            self._cy = -n[:, 1] / n[:, 0]
+            self._cz = -n[:, 2] / n[:, 0]
+            self._cx = a[:, 0] - self._cy * a[:, 1] - self._cz * a[:, 2]
+
+        # grid with roughly two triangles per cell
+        self._lo = self.tris[:, :, 1:].reshape(-1, 2).min(axis = 0)
+        hi = self.tris[:, :, 1:].reshape(-1, 2).max(axis = 0)
+        extent = np.maximum(hi - self._lo, 1e-9)
+        n_cells = max(len(self.tris) / 2, 1)
+        cell = np.sqrt(extent[0] * extent[1] / n_cells)
+        self._shape = np.clip(np.ceil(extent / cell), 1, 4096).astype(np.int64)
+        self._cell = extent / self._shape
+
+        lo = self._cell_of(uv.min(axis = 1))
+        hi = self._cell_of(uv.max(axis = 1))
+        tri, cu, cv = _expand_ranges(lo[:, 0], hi[:, 0], lo[:, 1], hi[:, 1])
+        cells = cu * self._shape[1] + cv
+        order = np.argsort(cells, kind = 'stable')
+        self._cell_tris = tri[order]
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(cells, minlength = self._shape.prod()))])
+
+    def _cell_of(self, uv):
+        return np.clip(np.floor((uv - self._lo) / self._cell).astype(np.int64), 0, self._shape - 1)
+
+    def _gather(self, lo, hi):
+        """ (item, triangle) pairs for every triangle in the inclusive y/z cell ranges lo to hi of each item."""
+        item, cu, cv = _expand_ranges(lo[:, 0], hi[:, 0], lo[:, 1], hi[:, 1])
+        cell = cu * self._shape[1] + cv
+        start = self._offsets[cell]
+        count = self._offsets[cell + 1] - start
+        k = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        return np.repeat(item, count), self._cell_tris[np.repeat(start, count) + k]
+
+    def _on_grid(self, lo, hi):
+        """ Which y/z boxes (lo, hi) overlap the grid."""
+        return np.all((hi >= self._lo) & (lo <= self._lo + self._cell * self._shape), axis = 1)
+
+    def ray_hits(self, points):
+        """ Crossings of rays cast from `points` along +x with the mesh triangles.
+
+        Returns the point index, the x coordinate of the crossing, and the mesh crossed, for each crossing.
+        """
+        uv = points[:, 1:]
+        pts = np.flatnonzero(self._on_grid(uv, uv))
+        cell = self._cell_of(uv[pts])
+        pi, t = self._gather(cell, cell)
+        pi = pts[pi]
+
+        p = uv[pi]
+        p0 = self._base[t]
+        d = self._dc[t]
+        e = self._sign[t] * (d[..., 0] * (p[:, None, 1] - p0[..., 1]) - d[..., 1] * (p[:, None, 0] - p0[..., 0]))
+        hit = np.all((e > 0) | ((e == 0) & self._topleft[t]), axis = 1) & self._ray_ok[t]
+        pi, t = pi[hit], t[hit]
+        x = self._cx[t] + self._cy[t] * uv[pi, 0] + self._cz[t] * uv[pi, 1]
+        return pi, x, self.tri_mesh[t]
+
+    def segment_hits(self, a, b):
+        """ Crossings of the segments a -> b with the mesh triangles.
+
+        Returns the segment index, the position of the crossing along the segment (0 at a, 1 at b), and the mesh
+        crossed, for each crossing.
+        """
+        lo = np.minimum(a, b)
+        hi = np.maximum(a, b)
+        on = np.flatnonzero(self._on_grid(lo[:, 1:], hi[:, 1:]))
+        seg, t = self._gather(self._cell_of(lo[on, 1:]), self._cell_of(hi[on, 1:]))
+        seg = on[seg]
+        # segments spanning several cells meet the same triangle more than once
+        key = np.unique(seg * len(self.tris) + t)
+        seg, t = key // len(self.tris), key % len(self.tris)
+        keep = (self._xlo[t] <= hi[seg, 0]) & (self._xhi[t] >= lo[seg, 0])
+        seg, t = seg[keep], t[keep]
+
+        # Signed volumes of the segment with each triangle edge: the segment passes through the triangle if they all
+        # have the same sign. Edges are evaluated from their canonical end and flipped as needed, so the two triangles
+        # sharing an edge get exactly opposite values, and a segment through a shared edge or vertex is only counted
+        # by one triangle - with the same top-left rule as `ray_hits`, in a plane across the segment.
+        d = b[seg] - a[seg]
+        pa = self._p3[t] - a[seg][:, None]
+        qa = self._q3[t] - a[seg][:, None]
+        e = self._sign3[t] * np.einsum('ik,ijk->ij', d, np.cross(pa, qa))
+        w = self._sign3[t][..., None] * (self._q3[t] - self._p3[t])
+        # flip triangles seen clockwise from the segment
+        orient = np.sign(e.sum(axis = 1))
+        e = e * orient[:, None]
+        w = w * orient[:, None, None]
+        # edge directions in a plane across the segment, with axes (u1, u2) so (u1, u2, d) is right handed
+        axis = np.eye(3)[np.argmin(np.abs(d), axis = 1)]
+        u1 = np.cross(axis, d)
+        u2 = np.cross(d, u1)
+        w1 = np.einsum('ik,ijk->ij', u1, w)
+        w2 = np.einsum('ik,ijk->ij', u2, w)
+        topleft = (w2 < 0) | ((w2 == 0) & (w1 < 0))
+        hit = (orient != 0) & np.all((e > 0) | ((e == 0) & topleft), axis = 1)
+
+        # where along the segment it crosses the triangle's plane
+        tri = self.tris[t]
+        n = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            pos = np.einsum('ij,ij->i', n, tri[:, 0] - a[seg]) / np.einsum('ij,ij->i', n, d)
+        hit &= (pos > 0) & (pos <= 1)
+        return seg[hit], pos[hit], self.tri_mesh[t[hit]]
+
+    def parity(self, points, chunk_size = 20000):
+        """ Yield (start, inside) for chunks of points, where inside is a points by meshes boolean array."""
+        lo = self.bounds[:, 0].min(axis = 0)
+        hi = self.bounds[:, 1].max(axis = 0)
+        for s in range(0, len(points), chunk_size):
+            p = points[s:s + chunk_size]
+            inside = np.zeros((len(p), self.n_meshes), dtype = bool)
+            # only bother with points in the bounding box of all meshes
+            box = np.flatnonzero(np.all((p >= lo) & (p <= hi), axis = 1))
+            if len(box):
+                pi, x, mesh = self.ray_hits(p[box])
+                front = x > p[box][pi, 0]
+                key = pi[front] * self.n_meshes + mesh[front]
+                crossings = np.bincount(key, minlength = len(box) * self.n_meshes)
+                inside[box] = (crossings % 2).astype(bool).reshape(len(box), self.n_meshes)
+            yield s, inside
+
+    def contains(self, points, chunk_size = 20000):
+        """ Points by meshes boolean array of which points are inside which mesh."""
+        out = np.zeros((len(points), self.n_meshes), dtype = bool)
+        for s, inside in self.parity(points, chunk_size):
+            out[s:s + len(inside)] = inside
+        return out
+
+def _expand_ranges(u0, u1, v0, v1):
+    """ Expand inclusive 2D cell ranges into (item, u, v) for every cell covered by each item."""
+    nv = v1 - v0 + 1
+    n = (u1 - u0 + 1) * nv
+    item = np.repeat(np.arange(len(n)), n)
+    k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    return item, u0[item] + k // nv[item], v0[item] + k % nv[item]
+
+def _as_points(points):
+    """ Coerce a DataFrame with x/y/z columns, or an array like, to an (N, 3) float array."""
+    if isinstance(points, pd.DataFrame):
+        points = points[['x','y','z']].values
+    return np.asarray(points, dtype = np.float64).reshape(-1, 3)
+
+class _Labeller:
+    """ Shared interface of VolumeLabeller and VoxelLabelGrid: subclasses provide `names` and `codes`."""
+
+    def label(self, points, fill = ''):
+        """ Name of the volume each point is in, or `fill` if it is in none.
+
+        Parameters
+        ----------
+
+        points:     DataFrame | array
+                    Either a data frame with ['x','y','z'] columns, or an (N, 3) array of coordinates.
+
+        fill:       str
+                    Label for points outside of all volumes. Empty string by default.
+
+        Returns
+        -------
+
+        array
+                    Array of volume names, one per point.
+
+        """
+        names = np.array(self.names + [fill], dtype = object)
+        return names[self.codes(points)]
+
+class VolumeLabeller(_Labeller):
+    """ Labels points with the volume they fall in, for a whole dictionary of volumes at once.
+
+    The triangles of every volume are put into one spatial index when the labeller is created, and points are
+    then tested against all volumes in a single vectorised pass, instead of once per volume as with
+    `pymaid.in_volume`. Build a labeller once (e.g. for the output of `PNtools.FAFB_vols`) and reuse it.
+
+    Parameters
+    ----------
+
+    volumes:    Volume | dict
+                A single pymaid volume, or a dictionary of volumes. Meshes should be closed (watertight).
+
+    chunk_size: int
+                Number of points tested at a time. Larger chunks are a little faster, but use more memory.
+
+    """
+
+    def __init__(self, volumes, chunk_size = 20000):
+        if isinstance(volumes, pymaid.Volume):
+            volumes = {volumes.name: volumes}
+        self.volumes = volumes
+        self.names = list(volumes.keys())
+        self.chunk_size = chunk_size
+        self._index = _MeshIndex([(v.vertices, v.faces) for v in volumes.values()])
+
+    def __repr__(self):
+        return '<VolumeLabeller: {} volumes>'.format(len(self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def volume(self):
+        """ The volume, if the labeller has a single one."""
+        if len(self.names) != 1:
+            raise ValueError('Labeller has {} volumes, not one'.format(len(self.names)))
+        return self.volumes[self.names[0]]
+
+    def in_volume(self, points):
+        """ Test which points are in which volume.
+
+        Parameters
+        ----------
+
+        points:     DataFrame | array
+                    Either a data frame with ['x','y','z'] columns, or an (N, 3) array of coordinates.
+
+        Returns
+        -------
+
+        dict
+                    Dictionary of volume name to a boolean array, in the same format as `pymaid.in_volume`.
+
+        """
+        inside = self._index.contains(_as_points(points), self.chunk_size)
+        return {n: inside[:, i] for i, n in enumerate(self.names)}
+
+    def codes(self, points):
+        """ Index (into `names`) of the volume each point is in, or -1 if it is in none.
+
+        If volumes overlap, points are given the first volume they are in.
+        """
+        points = _as_points(points)
+        codes = np.full(len(points), -1, dtype = np.int64)
+        for s, inside in self._index.parity(points, self.chunk_size):
+            found = inside.any(axis = 1)
+            codes[s:s + len(inside)][found] = inside[found].argmax(axis = 1)
+        return codes
+
+class VoxelLabelGrid(_Labeller):
+    """ Precomputed voxel grid of volume labels, for O(1) point-in-volume lookups.
+
+    Each voxel holds 0 if its centre is outside all volumes, or 1 + the index of the volume it is in. Voxels
+    whose neighbourhood contains more than one label are flagged as boundary voxels, and points falling in them
+    are tested against the exact meshes instead (if the volumes are available). Grids are saved as .npy files
+    and memory mapped when loaded, so a grid of the whole FAFB neuropil set costs almost nothing to open.
+
+    Use `VoxelLabelGrid.build` to rasterise a dictionary of volumes, and `VoxelLabelGrid.load` to open a saved grid.
+
+    Parameters
+    ----------
+
+    labels:         array
+                    (z, y, x) array of uint8/uint16 labels.
+
+    boundary:       array
+                    (z, y, x) boolean array, True for voxels near a mesh boundary.
+
+    origin:         array
+                    (x, y, z) coordinates of the corner of the grid.
+
+    resolution:     array
+                    (x, y, z) size of a voxel.
+
+    names:          list
+                    Volume names, in label order.
+
+    volumes:        dict | VolumeLabeller
+                    (optional) The volumes the grid was built from, used to label points in boundary voxels exactly.
+                    If not given, boundary points get the label of their voxel.
+
+    """
+
+    def __init__(self, labels, boundary, origin, resolution, names, volumes = None):
+        self.labels = labels
+        self.boundary = boundary
+        self.origin = np.asarray(origin, dtype = np.float64)
+        self.resolution = np.asarray(resolution, dtype = np.float64)
+        self.names = list(names)
+        if volumes is not None and not isinstance(volumes, VolumeLabeller):
+            volumes = VolumeLabeller({n: volumes[n] for n in self.names})
+        self.labeller = volumes
+
+    def __repr__(self):
+        return '<VoxelLabelGrid: {} volumes, {} voxels at {}>'.format(len(self.names), 'x'.join(str(s) for s in self.labels.shape[::-1]),
+                                                                     'x'.join('{:g}'.format(r) for r in self.resolution))
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def build(cls, volumes, resolution = 1000, path = None, slab_size = 2e7):
+        """ Rasterise a dictionary of volumes into a label grid.
+
+        Parameters
+        ----------
+
+        volumes:        Volume | dict
+                        A single pymaid volume, or a dictionary of volumes, e.g. the output of `PNtools.FAFB_vols`.
+
+        resolution:     int | tuple
+                        Voxel size, either a single value or (x, y, z). 1000 (1um, for FAFB) by default.
+
+        path:           str
+                        (optional) .npy file to save the grid to. The grid is written straight to disk, so grids larger
+                        than memory can be built.
+
+        slab_size:      int
+                        Number of voxels to rasterise at a time.
+
+        Returns
+        -------
+
+        VoxelLabelGrid
+
+        """
+        labeller = volumes if isinstance(volumes, VolumeLabeller) else VolumeLabeller(volumes)
+        index = labeller._index
+        resolution = np.broadcast_to(np.asarray(resolution, dtype = np.float64), (3,))
+        # one voxel of padding all round, so the outside of every mesh is in the grid
+        origin = index.bounds[:, 0].min(axis = 0) - resolution
+        shape = np.ceil((index.bounds[:, 1].max(axis = 0) + resolution - origin) / resolution).astype(np.int64)
+        nx, ny, nz = (int(n) for n in shape)
+        dtype = np.uint8 if len(labeller.names) < 255 else np.uint16
+
+        if path is None:
+            labels = np.zeros((nz, ny, nx), dtype = dtype)
+            boundary = np.zeros((nz, ny, nx), dtype = bool)
+        else:
+            labels = np.lib.format.open_memmap(path, mode = 'w+', dtype = dtype, shape = (nz, ny, nx))
+            boundary = np.lib.format.open_memmap(_boundary_path(path), mode = 'w+', dtype = bool, shape = (nz, ny, nx))
+
+        step = max(int(slab_size // (nx * ny)), 1)
+        for k0 in range(0, nz, step):
+            labels[k0:k0 + step] = _rasterise_slab(index, origin, resolution, shape, k0, min(k0 + step, nz))
+        for k0 in range(0, nz, step):
+            boundary[k0:k0 + step] = _boundary_slab(labels, k0, min(k0 + step, nz))
+
+        grid = cls(labels, boundary, origin, resolution, labeller.names, labeller)
+        if path is not None:
+            labels.flush()
+            boundary.flush()
+            grid._write_meta(path)
+        return grid
+
+    @classmethod
+    def load(cls, path, volumes = None, mmap_mode = 'r'):
+        """ Open a grid saved with `build` or `save`.
+
+        Parameters
+        ----------
+
+        path:       str
+                    The .npy file the grid was saved to.
+
+        volumes:    dict | VolumeLabeller
+                    (optional) The volumes the grid was built from, to label points in boundary voxels exactly.
+
+        mmap_mode:  str
+                    Passed to `numpy.load`. 'r' (default) memory maps the grid read only, None loads it into memory.
+
+        Returns
+        -------
+
+        VoxelLabelGrid
+
+        """
+        with open(_meta_path(path)) as f:
+            meta = json.load(f)
+        labels = np.load(path, mmap_mode = mmap_mode)
+        boundary = np.load(_boundary_path(path), mmap_mode = mmap_mode)
+        return cls(labels, boundary, meta['origin'], meta['resolution'], meta['names'], volumes)
+
+    def save(self, path):
+        """ Save the grid to a .npy file (plus a boundary .npy and a .json of metadata next to it)."""
+        np.save(path, self.labels)
+        np.save(_boundary_path(path), self.boundary)
+        self._write_meta(path)
+
+    def _write_meta(self, path):
+        with open(_meta_path(path), 'w') as f:
+            json.dump({'origin': self.origin.tolist(),
+                       'resolution': self.resolution.tolist(),
+                       'names': self.names}, f)
+
+    def codes(self, points):
+        """ Index (into `names`) of the volume each point is in, or -1 if it is in none."""
+        points = _as_points(points)
+        vox = np.floor((points - self.origin) / self.resolution).astype(np.int64)
+        ok = np.all((vox >= 0) & (vox < self.labels.shape[::-1]), axis = 1)
+        codes = np.full(len(points), -1, dtype = np.int64)
+        i, j, k = vox[ok].T
+        codes[ok] = self.labels[k, j, i].astype(np.int64) - 1
+        if self.labeller is not None:
+            edge = np.flatnonzero(ok)[self.boundary[k, j, i]]
+            if len(edge):
+                codes[edge] = self.labeller.codes(points[edge])
+        return codes
+
+    def in_volume(self, points):
+        """ Test which points are in which volume, returning a dictionary of volume name to a boolean array."""
+        codes = self.codes(points)
+        return {n: codes == i for i, n in enumerate(self.names)}
+
+def _boundary_path(path):
+    return os.path.splitext(path)[0] + '_boundary.npy'
+
+def _meta_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+def _rasterise_slab(index, origin, resolution, shape, k0, k1):
+    """ Labels for z slices k0 to k1, by filling voxels between pairs of ray crossings along x."""
+    nx, ny = shape[0], shape[1]
+    nk = k1 - k0
+    # one ray per voxel centre in the y/z plane, starting outside the grid
+    j, k = np.meshgrid(np.arange(ny), np.arange(k0, k1), indexing = 'xy')
+    rays = np.empty((j.size, 3))
+    rays[:, 0] = origin[0] - resolution[0]
+    rays[:, 1] = origin[1] + (j.ravel() + .5) * resolution[1]
+    rays[:, 2] = origin[2] + (k.ravel() + .5) * resolution[2]
+
+    ray, x, mesh = index.ray_hits(rays)
+    order = np.lexsort((x, mesh, ray))
+    ray, x, mesh = ray[order], x[order], mesh[order]
+    # pair up crossings (enter, exit) within each ray/mesh
+    group = ray * index.n_meshes + mesh
+    first = np.concatenate([[True], group[1:] != group[:-1]])
+    rank = np.arange(len(group)) - np.maximum.accumulate(np.where(first, np.arange(len(group)), 0))
+    enter = np.flatnonzero((rank % 2 == 0)[:-1] & (group[1:] == group[:-1]))
+    # voxels whose centres lie between the two crossings
+    i0 = np.ceil((x[enter] - origin[0]) / resolution[0] - .5).astype(np.int64)
+    i1 = np.floor((x[enter + 1] - origin[0]) / resolution[0] - .5).astype(np.int64)
+    i0, i1 = np.clip(i0, 0, nx), np.clip(i1, -1, nx - 1)
+    n = np.maximum(i1 - i0 + 1, 0)
+    run = np.repeat(np.arange(len(n)), n)
+    vox = ray[enter][run] * nx + i0[run] + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    val = mesh[enter][run]
+    # where volumes overlap, the first one wins
+    order = np.lexsort((val, vox))
+    vox, first = np.unique(vox[order], return_index = True)
+
+    out = np.zeros(nk * ny * nx, dtype = np.uint8 if index.n_meshes < 255 else np.uint16)
+    out[vox] = val[order][first] + 1
+    return out.reshape(nk, ny, nx)
+
+def _boundary_slab(labels, k0, k1):
+    """ Boundary flags for z slices k0 to k1: voxels within one voxel of a change in label."""
+    lo, hi = max(k0 - 2, 0), min(k1 + 2, labels.shape[0])
+    a = np.asarray(labels[lo:hi])
+    diff = np.zeros(a.shape, dtype = bool)
+    for axis in range(3):
+        d = np.diff(a, axis = axis) != 0
+        diff[_shifted(axis, 1)] |= d
+        diff[_shifted(axis, -1)] |= d
+    grown = diff.copy()
+    for axis in range(3):
+        grown[_shifted(axis, 1)] |= diff[_shifted(axis, -1)]
+        grown[_shifted(axis, -1)] |= diff[_shifted(axis, 1)]
+        diff = grown.copy()
+    return grown[k0 - lo:k0 - lo + (k1 - k0)]
+
+def _shifted(axis, side):
+    """ Slice dropping the first (side=1) or last (side=-1) element along `axis`."""
+    sl = [slice(None)] * 3
+    sl[axis] = slice(1, None) if side == 1 else slice(None, -1)
+    return tuple(sl)
+
+@utils.stage('cable_per_volume')
+def cable_per_volume(neurons, volumes, chunk_size = 100000):
+    """ Exact length of cable each neuron has within each volume.
+
+    Works directly on the parent-child edges of all neurons at once: each edge is tested against every volume in
+    one pass, and edges crossing a mesh boundary are clipped at the crossing, so only the part of the edge inside
+    the volume is counted. No pruned copies of the neurons are made.
+
+    Parameters
+    ----------
+
+    neurons:        CatmaidNeuron | CatmaidNeuronList
+                    Neuron(s) to measure.
+
+    volumes:        Volume | dict | VolumeLabeller
+                    A single pymaid volume, a dictionary of volumes, or a VolumeLabeller.
+
+    chunk_size:     int
+                    Number of edges processed at a time.
+
+    Returns
+    -------
+
+    DataFrame
+                    Neuron(s) by volume(s) data frame of cable length, in the units of the node coordinates (nm).
+
+    """
+    if isinstance(neurons, pymaid.CatmaidNeuron):
+        neurons = pymaid.CatmaidNeuronList(neurons)
+    labeller = volumes if isinstance(volumes, VolumeLabeller) else VolumeLabeller(volumes)
+    index = labeller._index
+    V = index.n_meshes
+
+    # child and parent coordinates of every edge, of every neuron
+    starts, ends, owner = [], [], []
+    for i, n in enumerate(neurons):
+        a, b = _edges(n.nodes)
+        starts.append(a)
+        ends.append(b)
+        owner.append(np.full(len(a), i))
+    # (empty arrays to start with, so no neurons - or neurons without edges - give a matrix of zeros)
+    starts = np.concatenate([np.zeros((0, 3))] + starts)
+    ends = np.concatenate([np.zeros((0, 3))] + ends)
+    owner = np.concatenate([np.zeros(0, dtype = np.int64)] + owner)
+
+    cable = np.zeros((len(neurons), V))
+    for s in range(0, len(starts), chunk_size):
+        a, b, o = starts[s:s + chunk_size], ends[s:s + chunk_size], owner[s:s + chunk_size]
+        inside = index.contains(a, chunk_size).astype(np.float64)
+
+        # fraction of each edge inside each volume, from where the edge starts and the crossings along it
+        seg, pos, mesh = index.segment_hits(a, b)
+        key = seg * V + mesh
+        order = np.lexsort((pos, key))
+        key, pos = key[order], pos[order]
+        first = np.concatenate([[True], key[1:] != key[:-1]])
+        rank = np.arange(len(key)) - np.maximum.accumulate(np.where(first, np.arange(len(key)), 0))
+        toggled = np.bincount(key, weights = np.where(rank % 2 == 0, 1, -1) * (1 - pos), minlength = len(a) * V)
+        frac = inside + (1 - 2 * inside) * toggled.reshape(len(a), V)
+        lengths = np.clip(frac, 0, 1) * np.linalg.norm(b - a, axis = 1)[:, None]
+
+        # edges are grouped by neuron, so sum runs of the same owner
+        run = np.flatnonzero(np.concatenate([[True], o[1:] != o[:-1]]))
+        cable[o[run]] += np.add.reduceat(lengths, run, axis = 0)
+
+    return pd.DataFrame(cable, index = [n.skeleton_id for n in neurons], columns = labeller.names)
+
+def _edges(nodes):
+    """ Coordinates of the child and parent node of every edge in a node table."""
+    xyz = nodes[['x','y','z']].values.astype(np.float64)
+    parent = pd.Index(nodes.treenode_id.values).get_indexer(nodes.parent_id.values)
+    has_parent = parent >= 0
+    return xyz[has_parent], xyz[parent[has_parent]]
+
+@utils.stage('in_volume')
+def _in_volume(points, volumes):
+    """ `pymaid.in_volume`, or the labeller's equivalent if `volumes` is a VolumeLabeller or VoxelLabelGrid."""
+    if isinstance(volumes, _Labeller):
+        return volumes.in_volume(points)
+    return pymaid.in_volume(points, volumes)
+
+@utils.stage('in_volume')
+def _hits(points, volumes):
+    """ Every (point, volume) containment as two index arrays, plus the volume names - the sparse form of
+    `_in_volume`, from one pass over the points. Points in overlapping volumes get a pair for each."""
+    if isinstance(volumes, VolumeLabeller):
+        pi, vi = [], []
+        for s, inside in volumes._index.parity(_as_points(points), volumes.chunk_size):
+            p, v = np.nonzero(inside)
+            pi.append(p + s)
+            vi.append(v)
+        if not pi:
+            return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), list(volumes.names)
+        return np.concatenate(pi), np.concatenate(vi), list(volumes.names)
+    if isinstance(volumes, VoxelLabelGrid):
+        codes = volumes.codes(points)
+        pi = np.flatnonzero(codes >= 0)
+        return pi, codes[pi], list(volumes.names)
+    dictionary = pymaid.in_volume(points, volumes)
+    names = list(dictionary.keys())
+    pi = [np.flatnonzero(dictionary[n]) for n in names]
+    vi = [np.full(len(p), i, dtype = np.int64) for i, p in enumerate(pi)]
+    if not pi:
+        return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), names
+    return np.concatenate(pi), np.concatenate(vi), names
+
+# Labellers of single (possibly rescaled) volumes built this session, by (content hash, scale)
+_indexed = {}
+
+def indexed_volume(volume, scale = 1):
+    """ A VolumeLabeller for a single volume, optionally resized, built once per session and shared.
+
+    The resized mesh is a copy, so `volume` itself is never changed, and the labeller (with its point-in-mesh index)
+    is cached by a hash of the mesh and the scale. Asking again for the same volume and scale - e.g. for every
+    neuron being pruned - returns the same labeller without rebuilding anything. Treat it as read-only.
+
+    Parameters
+    ----------
+
+    volume:     Volume | VolumeLabeller
+                Volume to index. A labeller of a single volume is returned as it is if scale is 1.
+
+    scale:      float
+                Factor to resize the volume by, around its centre. 1 (default) keeps it as it is.
+
+    Returns
+    -------
+
+    VolumeLabeller
+                Labeller of the (resized) volume, which is in its `volume` attribute.
+
+    """
+    if isinstance(volume, VolumeLabeller):
+        if scale == 1:
+            return volume
+        volume = volume.volume
+    key = (_mesh_hash(volume), float(scale))
+    if key not in _indexed:
+        scaled = volume if scale == 1 else volume.resize(scale, inplace = False)
+        _indexed[key] = VolumeLabeller({volume.name: scaled})
+    return _indexed[key]
+
+def scaled_volume(volume, scale = 1):
+    """ Resized copy of `volume` (cached, see `indexed_volume`), leaving `volume` itself unchanged."""
+    return indexed_volume(volume, scale).volume
+
+def prune_by_volume(neuron, volume, mode = 'IN', prevent_fragments = False, scale = 1):
+    """ Copy of `neuron` pruned to nodes inside (or outside) a volume, like `CatmaidNeuron.prune_by_volume`.
+
+    Nodes are tested with the cached labeller of the volume (see `indexed_volume`), so pruning many neurons to the
+    same volume builds its index only once.
+
+    Parameters
+    ----------
+
+    neuron:             CatmaidNeuron
+                        Neuron to prune. Not changed.
+
+    volume:             Volume | VolumeLabeller
+                        Volume to prune to, or the labeller of a single volume from `indexed_volume`.
+
+    mode:               str
+                        'IN' (default) keeps nodes inside the volume, 'OUT' those outside.
+
+    prevent_fragments:  Bool
+                        If True, keep the nodes needed to join what is left into a single piece.
+
+    scale:              float
+                        Factor to resize the volume by first.
+
+    Returns
+    -------
+
+    CatmaidNeuron
+
+    """
+    inside = _inside(neuron.nodes, volume, scale)
+    if mode == 'OUT':
+        inside = ~inside
+    return pymaid.subset_neuron(neuron, neuron.nodes.treenode_id.values[inside],
+                                prevent_fragments = prevent_fragments, inplace = False)
+
+def _inside(points, volume, scale = 1):
+    """ Boolean array of which points are inside a single volume."""
+    index = indexed_volume(volume, scale)
+    return index.in_volume(points)[index.names[0]]
+
+def _mesh_hash(volume):
+    """ Hash of the vertices and faces of a mesh."""
+    h = hashlib.sha1(np.ascontiguousarray(volume.vertices, dtype = np.float64).tobytes())
+    h.update(np.ascontiguousarray(volume.faces, dtype = np.int64).tobytes())
+    return h.hexdigest()
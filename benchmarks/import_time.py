@@ -0,0 +1,61 @@
+""" Time how long it takes a fresh interpreter to import PNtools, as a short-lived batch worker would.
+
+Each case runs in a new process, `--repeat` times, and the median wall time is reported. 'all names' loads every
+submodule, and 'pymaid' also the heavy dependencies, which together is what `import PNtools` did before imports
+were made lazy.
+
+Usage:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --repeat 20 -o import_time.json
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    'python':           'pass',
+    'import PNtools':   'import PNtools',
+    'calc_lts':         'import PNtools; PNtools.calc_lts',
+    'ends_matrix':      'import PNtools; PNtools.ends_matrix',
+    'all names':        'import PNtools; [getattr(PNtools, n) for n in PNtools.__all__]',
+    'pymaid':           'import PNtools; [getattr(PNtools, n) for n in PNtools.__all__]; PNtools.misc.pymaid.Volume',
+}
+
+TIMER = ('import time; _t = time.perf_counter()\n'
+         '{}\n'
+         'import sys; _s = time.perf_counter() - _t\n'
+         'print(_s, len(sys.modules))')
+
+def time_import(code, repeat = 10):
+    """ Wall times (seconds) of running `code` in `repeat` fresh interpreters, and the number of modules loaded."""
+    env = dict(os.environ, PYTHONPATH = ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    times = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', TIMER.format(code)], env = env,
+                                      stderr = subprocess.DEVNULL)
+        t, n = out.decode().split()[-2:]
+        times.append(float(t))
+    return times, int(n)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type = int, default = 10, help = 'fresh interpreters per case')
+    parser.add_argument('-o', '--output', help = 'file to write results to, as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for name, code in CASES.items():
+        times, modules = time_import(code, args.repeat)
+        results.append({'case': name, 'code': code, 'times': times, 'median': float(np.median(times)),
+                        'modules': modules})
+        print('{:<18}{:>9.1f}ms{:>7} modules'.format(name, np.median(times) * 1000, modules))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 1)
@@ -0,0 +1,157 @@
+""" Time and memory-profile the PNtools processing entry points on synthetic neurons and meshes.
+
+Runs fully offline: volumes are served by a synthetic data source, and the volume cache lives in a temporary
+directory. Results are written as JSON, and two result files can be compared to spot regressions.
+
+Usage:
+
+    python benchmarks/run.py                                # quick grid, all entry points
+    python benchmarks/run.py --grid full -o results.json    # 1 to 10k neurons, 1k to 1M nodes
+    python benchmarks/run.py --sizes 100x10000 --only ends_matrix cable_length_matrix
+    python benchmarks/run.py --compare before.json after.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import traceback
+import numpy as np
+import pandas as pd
+
+# benchmark the working tree, rather than whichever PNtools is installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pymaid
+import PNtools
+from PNtools import datasource, volume_cache
+import synthetic
+
+# (neurons, nodes per neuron)
+GRIDS = {'quick':   [(1, 1000), (10, 1000), (10, 10000)],
+         'default': [(1, 1000), (10, 10000), (100, 10000), (1, 100000)],
+         'full':    [(1, 1000), (1, 10000), (1, 100000), (1, 1000000),
+                     (10, 10000), (100, 10000), (1000, 1000), (10000, 1000)]}
+
+def _rows(neurons, seed = 0):
+    """ Neurons by 1000 matrix of positive values with some NaNs, as input to calc_ltk / calc_lts."""
+    rng = np.random.default_rng(seed)
+    x = rng.gamma(.5, size = (len(neurons), 1000))
+    x[rng.random(x.shape) < .05] = np.nan
+    return x
+
+# name: function(neurons, volumes) -> (function to time, args). Anything the entry point changes is set up afresh.
+BENCHMARKS = {
+    'ends_matrix':              lambda n, v: (PNtools.ends_matrix, (n, v)),
+    'cable_length_matrix':      lambda n, v: (PNtools.cable_length_matrix, (n, v)),
+    'cable_length_matrix_clip': lambda n, v: (lambda *a: PNtools.cable_length_matrix(*a, method = 'clip'), (n, v)),
+    'pruning':                  lambda n, v: (PNtools.pruning, (n, v['NP_0'])),
+    'first_branch':             lambda n, v: (PNtools.first_branch, (n.copy(), v['NP_0'])),
+    'PN_axon_prune':            lambda n, v: (PNtools.PN_axon_prune, (n, v)),
+    'connectors_in_vol':        lambda n, v: (PNtools.connectors_in_vol, (n, v)),
+    'connectors_in_vol_count':  lambda n, v: (lambda *a: PNtools.connectors_in_vol(*a, count = True), (n, v)),
+    'calc_ltk':                 lambda n, v: (PNtools.calc_ltk, (_rows(n),)),
+    'calc_lts':                 lambda n, v: (PNtools.calc_lts, (_rows(n),)),
+}
+
+def run_one(name, neurons, volumes, repeat = 3, memory = True):
+    """ Time `repeat` runs of a benchmark, then profile the peak memory of one more under tracemalloc."""
+    res = {'entry': name, 'n_neurons': len(neurons), 'n_nodes': int(sum(len(n.nodes) for n in neurons))}
+    try:
+        times = []
+        for _ in range(repeat):
+            func, args = BENCHMARKS[name](neurons, volumes)
+            start = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - start)
+        res.update(times = times, best = min(times), median = float(np.median(times)))
+        if memory:
+            func, args = BENCHMARKS[name](neurons, volumes)
+            tracemalloc.start()
+            func(*args)
+            res['peak_memory'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    except Exception:
+        tracemalloc.stop()
+        res['error'] = traceback.format_exc(limit = 3)
+    return res
+
+def run(sizes, only = None, repeat = 3, n_volumes = 10, memory = True, seed = 0):
+    """ Run the benchmarks for each (neurons, nodes per neuron) in `sizes`, returning the results as a dict."""
+    names = list(BENCHMARKS) if not only else only
+    out = {'meta': _meta(), 'results': []}
+
+    previous_source, previous_cache = datasource.get_source(), volume_cache._default
+    with tempfile.TemporaryDirectory() as tmp:
+        volume_cache.set_default_cache(tmp)
+        try:
+            for n_neurons, n_nodes in sizes:
+                neurons = synthetic.skeletons(n_neurons, n_nodes, seed = seed)
+                volumes = synthetic.neuropils(neurons, n_volumes, seed = seed)
+                datasource.set_source(synthetic.SyntheticSource(volumes, neurons))
+                neuropils = {k: v for k, v in volumes.items() if k.startswith('NP_')}
+                for name in names:
+                    res = run_one(name, neurons, neuropils, repeat, memory)
+                    res['n_nodes_per_neuron'] = n_nodes
+                    out['results'].append(res)
+                    print('{:<26}{:>7} x {:<9}{}'.format(name, n_neurons, n_nodes,
+                          'error' if 'error' in res else '{:.4f}s'.format(res['median'])), flush = True)
+        finally:
+            datasource.set_source(previous_source)
+            volume_cache.set_default_cache(previous_cache)
+    return out
+
+def compare(old, new, threshold = 1.2):
+    """ Table of the change in median time and peak memory between two result files, flagging regressions."""
+    key = ['entry', 'n_neurons', 'n_nodes_per_neuron']
+    old = pd.DataFrame(old['results']).set_index(key)
+    new = pd.DataFrame(new['results']).set_index(key)
+    both = old.join(new, how = 'inner', lsuffix = '_old', rsuffix = '_new')
+    table = pd.DataFrame({'time_old': both.median_old, 'time_new': both.median_new,
+                          'time_ratio': both.median_new / both.median_old})
+    if 'peak_memory_old' in both and 'peak_memory_new' in both:
+        table['memory_ratio'] = both.peak_memory_new / both.peak_memory_old
+    table['regression'] = (table.drop(columns = ['time_old', 'time_new']) > threshold).any(axis = 1)
+    return table
+
+def _meta():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd = os.path.dirname(os.path.abspath(__file__)),
+                                         stderr = subprocess.DEVNULL).decode().strip()
+    except Exception:
+        commit = None
+    return {'PNtools': PNtools.__version__, 'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'pymaid': pymaid.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+def _size(s):
+    n, m = s.lower().split('x')
+    return int(n), int(m)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--grid', choices = list(GRIDS), default = 'quick', help = 'preset sizes to run')
+    parser.add_argument('--sizes', nargs = '+', type = _size, help = 'sizes as NEURONSxNODES, e.g. 10x10000')
+    parser.add_argument('--only', nargs = '+', choices = list(BENCHMARKS), help = 'entry points to run')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'timed runs per benchmark')
+    parser.add_argument('--volumes', type = int, default = 10, help = 'number of synthetic neuropils')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'skip the tracemalloc run')
+    parser.add_argument('-o', '--output', default = 'benchmark_results.json', help = 'file to write results to')
+    parser.add_argument('--compare', nargs = 2, metavar = ('OLD', 'NEW'), help = 'compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            table = compare(json.load(f), json.load(g))
+        print(table.to_string())
+        sys.exit(int(table.regression.any()))
+
+    out = run(args.sizes or GRIDS[args.grid], args.only, args.repeat, args.volumes, not args.no_memory)
+    with open(args.output, 'w') as f:
+        json.dump(out, f, indent = 1)
+    print('Results written to', args.output)
@@ -0,0 +1,180 @@
+""" Synthetic skeletons, neuropil meshes and CATMAID data for benchmarking PNtools offline.
+
+Skeletons are grown as a primary neurite from the soma, with branches attached to random existing nodes and
+walked with some persistence, so they have the long backbone, branch points and leaves of real neurons. Node
+spacing is roughly that of FAFB tracings (~200nm). Meshes are closed ellipsoids (like CATMAID volumes) tiled
+along the neurons.
+"""
+import numpy as np
+import pandas as pd
+import pymaid
+from PNtools import parallel
+
+# nm between nodes, and along the primary neurite
+STEP = 200
+
+def skeleton(n_nodes, seed = 0, origin = (0, 0, 0), skid = 1, segment = 50, n_connectors = None):
+    """ A synthetic CatmaidNeuron with `n_nodes` nodes.
+
+    Parameters
+    ----------
+
+    n_nodes:        int
+                    Number of nodes.
+
+    seed:           int
+                    Seed for the random number generator, so the same neuron is generated every time.
+
+    origin:         tuple
+                    x/y/z of the soma.
+
+    skid:           int
+                    Skeleton ID. Node and connector IDs are offset by it, so they are unique across neurons.
+
+    segment:        int
+                    Mean number of nodes between branch points.
+
+    n_connectors:   int
+                    Number of connectors, half pre- and half postsynaptic. n_nodes // 10 if not given.
+
+    Returns
+    -------
+
+    CatmaidNeuron
+
+    """
+    rng = np.random.default_rng(seed)
+    n_nodes = max(int(n_nodes), 2)
+
+    # primary neurite takes ~ a fifth of the nodes, the rest is cut into branches
+    primary = max(n_nodes // 5, 1)
+    lengths = [primary]
+    while sum(lengths) < n_nodes:
+        lengths.append(int(rng.geometric(1 / segment)))
+    lengths[-1] -= sum(lengths) - n_nodes
+    lengths = np.array([l for l in lengths if l > 0])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+    # within a segment each node hangs off the previous one, segments hang off a random earlier node
+    parent = np.arange(n_nodes) - 1
+    parent[starts[1:]] = (rng.random(len(starts) - 1) * starts[1:]).astype(np.int64)
+    parent[0] = -1
+
+    # steps: a persistent direction per segment, plus jitter. The primary neurite runs along x
+    seg = np.repeat(np.arange(len(lengths)), lengths)
+    heading = rng.normal(size = (len(lengths), 3))
+    heading[0] = (1, .1, 0)
+    heading /= np.linalg.norm(heading, axis = 1)[:, None]
+    steps = heading[seg] + rng.normal(scale = .5, size = (n_nodes, 3))
+    steps *= STEP / np.linalg.norm(steps, axis = 1)[:, None]
+    steps[0] = origin
+
+    # position = sum of steps to the root, by pointer jumping
+    xyz = steps.copy()
+    anc = parent.copy()
+    todo = np.flatnonzero(anc >= 0)
+    while len(todo):
+        up = anc[todo]
+        xyz[todo] += xyz[up]
+        anc[todo] = anc[up]
+        todo = todo[anc[todo] >= 0]
+
+    ids = np.arange(n_nodes, dtype = np.int64) + skid * 10 ** 8
+    n_children = np.bincount(parent[parent >= 0], minlength = n_nodes)
+    types = np.where(n_children == 0, 'end', np.where(n_children > 1, 'branch', 'slab')).astype(object)
+    types[0] = 'root'
+    nodes = {'treenode_id': ids,
+             'parent_id': np.array([None] + list(ids[parent[1:]]), dtype = object),
+             'creator_id': np.zeros(n_nodes, dtype = np.int64),
+             'x': xyz[:, 0], 'y': xyz[:, 1], 'z': xyz[:, 2],
+             'radius': np.where(np.arange(n_nodes) == 0, 2000., -1.),
+             'confidence': np.full(n_nodes, 5, dtype = np.int64),
+             'type': types}
+
+    if n_connectors is None:
+        n_connectors = max(n_nodes // 10, 2)
+    on = rng.integers(1, n_nodes, n_connectors)
+    connectors = {'treenode_id': ids[on],
+                  'connector_id': np.arange(n_connectors, dtype = np.int64) + skid * 10 ** 8,
+                  'relation': np.arange(n_connectors) % 2,
+                  'x': xyz[on, 0] + 100, 'y': xyz[on, 1], 'z': xyz[on, 2]}
+
+    return parallel.unpack_neuron({'skeleton_id': str(skid),
+                                   'neuron_name': 'synthetic {}'.format(skid),
+                                   'nodes': nodes,
+                                   'connectors': connectors,
+                                   'tags': {'soma': [int(ids[0])]}})
+
+def skeletons(n_neurons, n_nodes, seed = 0):
+    """ A CatmaidNeuronList of `n_neurons` synthetic neurons with `n_nodes` nodes each, with somata close together."""
+    rng = np.random.default_rng(seed)
+    origins = rng.normal(scale = 5000, size = (n_neurons, 3))
+    return pymaid.CatmaidNeuronList([skeleton(n_nodes, seed = seed + i, origin = origins[i], skid = i + 1)
+                                     for i in range(n_neurons)])
+
+def ellipsoid(centre, radii, name, n = 24):
+    """ A closed, triangulated ellipsoid as a pymaid Volume, with `n` rings of `2n` vertices."""
+    theta = np.linspace(0, np.pi, n + 1)[1:-1]
+    phi = np.linspace(0, 2 * np.pi, 2 * n, endpoint = False)
+    t, p = np.meshgrid(theta, phi, indexing = 'ij')
+    ring = np.stack([np.cos(t), np.sin(t) * np.cos(p), np.sin(t) * np.sin(p)], axis = -1).reshape(-1, 3)
+    verts = np.vstack([[1, 0, 0], ring, [-1, 0, 0]]) * radii + centre
+
+    m = 2 * n
+    faces = []
+    # caps
+    for j in range(m):
+        faces.append([0, 1 + (j + 1) % m, 1 + j])
+        faces.append([len(verts) - 1, 1 + (n - 2) * m + j, 1 + (n - 2) * m + (j + 1) % m])
+    # bands between rings
+    for i in range(n - 2):
+        for j in range(m):
+            a, b = 1 + i * m + j, 1 + i * m + (j + 1) % m
+            faces.append([a, b, b + m])
+            faces.append([a, b + m, a + m])
+    # flip to outward facing normals
+    return pymaid.Volume(verts, np.array(faces)[:, ::-1], name = name)
+
+def neuropils(neurons, n_volumes = 10, seed = 0):
+    """ `n_volumes` ellipsoid neuropils tiled along the extent of `neurons`, named 'NP_0', 'NP_1'...
+
+    Also includes 'AL_R_manual' and 'AL_L' around the somata, as used by `PN_axon_prune`.
+    """
+    rng = np.random.default_rng(seed)
+    xyz = np.vstack([n.nodes[['x','y','z']].values for n in neurons])
+    lo, hi = xyz.min(axis = 0), xyz.max(axis = 0)
+    size = (hi - lo) / max(n_volumes, 1)
+    vols = {}
+    for i in range(n_volumes):
+        centre = lo + (hi - lo) * (i + .5) / n_volumes + rng.normal(scale = .1, size = 3) * size
+        radii = np.maximum(size * rng.uniform(.6, 1.2, 3), STEP * 5)
+        vols['NP_{}'.format(i)] = ellipsoid(centre, radii, 'NP_{}'.format(i))
+    somata = np.vstack([n.nodes[['x','y','z']].values[:1] for n in neurons])
+    vols['AL_R_manual'] = ellipsoid(somata.mean(axis = 0), np.full(3, 20000.), 'AL_R_manual')
+    vols['AL_L'] = ellipsoid(somata.mean(axis = 0) - (200000, 0, 0), np.full(3, 20000.), 'AL_L')
+    return vols
+
+class SyntheticSource:
+    """ A PNtools data source (see `PNtools.datasource`) serving synthetic volumes and neurons, without a server."""
+
+    def __init__(self, volumes, neurons = None):
+        self.volumes = volumes
+        self.neurons = neurons
+
+    def is_available(self):
+        return True
+
+    def instance_key(self, remote_instance = None):
+        return ('synthetic', 0)
+
+    def call(self, name, *args, **kwargs):
+        if name == 'get_volume':
+            if not args or args[0] is None:
+                return pd.DataFrame({'name': list(self.volumes), 'edition_time': '0'})
+            names = args[0]
+            if isinstance(names, str):
+                return self.volumes[names]
+            return {n: self.volumes[n] for n in names}
+        if name == 'get_neurons':
+            return self.neurons
+        raise KeyError('{} is not available from the synthetic source'.format(name))
@@ -22,5 +22,6 @@ setup(name='PNtools',
 	author_email='nikolasdrummond@gmail.com',
 	license='MIT',
 	packages=find_packages(),
+	extras_require={'store': ['pyarrow>=1.0']},
 	zip_safe=False
 )
@@ -0,0 +1,105 @@
+""" Small synthetic neurons and meshes for comparing PNtools' engines with pymaid / networkx."""
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class Neuron:
+    """ Bare stand-in for a CatmaidNeuron: a skeleton ID and a node table."""
+
+    def __init__(self, nodes, skeleton_id = '1'):
+        self.nodes = nodes
+        self.skeleton_id = skeleton_id
+
+    def __repr__(self):
+        return '<Neuron {}: {} nodes>'.format(self.skeleton_id, len(self.nodes))
+
+class Volume:
+    """ Bare stand-in for a pymaid Volume: vertices, faces and a name."""
+
+    def __init__(self, vertices, faces, name):
+        self.vertices = np.asarray(vertices, dtype = np.float64)
+        self.faces = np.asarray(faces)
+        self.name = name
+
+def neuron(xyz, parent, skeleton_id = '1'):
+    """ Neuron with nodes at `xyz`, where parent[i] is the row of node i's parent (-1 for the root)."""
+    xyz = np.asarray(xyz, dtype = np.float64)
+    ids = np.arange(len(xyz)) + 100
+    parent = np.asarray(parent)
+    nodes = pd.DataFrame({'treenode_id': ids,
+                          'parent_id': np.where(parent >= 0, ids[parent], -1),
+                          'x': xyz[:, 0], 'y': xyz[:, 1], 'z': xyz[:, 2]})
+    nodes['parent_id'] = nodes.parent_id.astype(object).where(parent >= 0, None)
+    return Neuron(nodes, skeleton_id)
+
+def random_tree(n_nodes, seed = 0, skeleton_id = '1', scale = 10):
+    """ Random tree: each node hangs off a random earlier node, a short random step away from it."""
+    rng = np.random.default_rng(seed)
+    parent = np.concatenate([[-1], (rng.random(n_nodes - 1) * np.arange(1, n_nodes)).astype(np.int64)])
+    xyz = np.zeros((n_nodes, 3))
+    for i in range(1, n_nodes):
+        xyz[i] = xyz[parent[i]] + rng.normal(scale = scale, size = 3)
+    return neuron(xyz, parent, skeleton_id)
+
+def box(lo, hi, name):
+    """ Axis aligned box, with each face split into two triangles along a shared diagonal."""
+    lo, hi = np.asarray(lo, dtype = np.float64), np.asarray(hi, dtype = np.float64)
+    corners = np.array([[(hi if i >> k & 1 else lo)[k] for k in range(3)] for i in range(8)])
+    quads = [[0, 2, 3, 1], [4, 5, 7, 6], [0, 1, 5, 4], [2, 6, 7, 3], [0, 4, 6, 2], [1, 3, 7, 5]]
+    faces = [f for a, b, c, d in quads for f in ([a, b, c], [a, c, d])]
+    return Volume(corners, faces, name)
+
+def ellipsoid(centre, radii, name, n = 12):
+    """ Closed, triangulated ellipsoid with `n` rings of `2n` vertices."""
+    theta = np.linspace(0, np.pi, n + 1)[1:-1]
+    phi = np.linspace(0, 2 * np.pi, 2 * n, endpoint = False)
+    t, p = np.meshgrid(theta, phi, indexing = 'ij')
+    ring = np.stack([np.cos(t), np.sin(t) * np.cos(p), np.sin(t) * np.sin(p)], axis = -1).reshape(-1, 3)
+    verts = np.vstack([[1, 0, 0], ring, [-1, 0, 0]]) * radii + centre
+    m = 2 * n
+    faces = []
+    for j in range(m):
+        faces.append([0, 1 + (j + 1) % m, 1 + j])
+        faces.append([len(verts) - 1, 1 + (n - 2) * m + j, 1 + (n - 2) * m + (j + 1) % m])
+    for i in range(n - 2):
+        for j in range(m):
+            a, b = 1 + i * m + j, 1 + i * m + (j + 1) % m
+            faces.append([a, b, b + m])
+            faces.append([a, b + m, a + m])
+    return Volume(verts, np.array(faces)[:, ::-1], name)
+
+@pytest.fixture
+def volumes():
+    return {'box': box((0, 0, 0), (20, 20, 20), 'box'),
+            'ball': ellipsoid((15, 10, 5), (12, 9, 7), 'ball'),
+            'far': ellipsoid((100, 100, 100), (5, 5, 5), 'far')}
+
+def in_volume(points, volume):
+    """ `pymaid.in_volume` of a single volume - or, with pymaid 2 which no longer has it, `navis.in_volume`."""
+    import pymaid
+    mesh = pymaid.Volume(volume.vertices, volume.faces, name = volume.name)
+    if hasattr(pymaid, 'in_volume'):
+        return np.asarray(pymaid.in_volume(points, mesh), dtype = bool)
+    import navis
+    return np.asarray(navis.in_volume(points, mesh), dtype = bool)
+
+def random_points(n, lo, hi, seed = 0):
+    """ `n` uniformly random points in the box from `lo` to `hi`."""
+    rng = np.random.default_rng(seed)
+    return rng.uniform(lo, hi, size = (n, 3))
+
+def graph(n):
+    """ networkx DiGraph of a neuron, edges from parent to child weighted by their length."""
+    import networkx as nx
+    nodes = n.nodes.set_index('treenode_id')
+    g = nx.DiGraph()
+    g.add_nodes_from(nodes.index)
+    for node, row in nodes[nodes.parent_id.notnull()].iterrows():
+        parent = nodes.loc[row.parent_id]
+        g.add_edge(row.parent_id, node, weight = np.linalg.norm(row[['x','y','z']].values.astype(float) -
+                                                                parent[['x','y','z']].values.astype(float)))
+    return g
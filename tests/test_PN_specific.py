@@ -0,0 +1,38 @@
+import pytest
+import pymaid
+from conftest import box, neuron
+from PNtools import PN_specific, topology, volume_index
+
+@pytest.fixture
+def pn(monkeypatch):
+    """ A PN-like neuron: primary neurite along x from the soma at 0, with side branches every 5 nodes."""
+    # materialising needs a real CatmaidNeuron, so the tests look at the view that would be materialised
+    monkeypatch.setattr(topology.NeuronView, 'materialise', lambda self, prevent_fragments = False: self)
+    xyz = [(x, 0, 0) for x in range(41)]
+    parent = list(range(-1, 40))
+    for x in range(5, 40, 5):
+        xyz += [(x, 1, 0), (x, 2, 0)]
+        parent += [x, len(xyz) - 2]
+    n = neuron(xyz, parent)
+    n.soma = n.nodes.treenode_id.values[0]
+    return n
+
+@pytest.mark.parametrize('kind', [pytest.param('dict', marks = pytest.mark.skipif(not hasattr(pymaid, 'in_volume'),
+                                                                      reason = 'needs pymaid.in_volume')),
+                                  'VolumeLabeller', 'VoxelLabelGrid'])
+def test_axon_prune_volumes(pn, kind):
+    vols = {'AL': box((-2, -1, -1), (7.5, 3, 1), 'AL'),
+            'MB': box((12.5, -1, -1), (22.5, 3, 1), 'MB'),
+            'LH': box((27.5, -1, -1), (42, 3, 1), 'LH')}
+    if kind == 'VolumeLabeller':
+        vols = volume_index.VolumeLabeller(vols)
+    elif kind == 'VoxelLabelGrid':
+        vols = volume_index.VoxelLabelGrid.build(vols, resolution = .5)
+    AL = volume_index.indexed_volume(box((-2, -1, -1), (7.5, 3, 1), 'AL_R'))
+    far = volume_index.indexed_volume(box((100, 100, 100), (101, 101, 101), 'AL_L'))
+
+    view = PN_specific._axon_prune(pn, vols, AL, far)
+    # the longest neurite ends in the LH, whose first branch point is at x = 30: the axon is the neurite from
+    # there on and the side branches, less those in the AL
+    x = pn.nodes.x.values[view.mask]
+    assert x.min() == 10 and not view.mask[:30].any() and view.mask[30:41].all()
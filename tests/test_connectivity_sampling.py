@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import in_volume, neuron, random_points
+from PNtools import connectivity_sampling, volume_index
+
+def test_upstream_node_check_nothing_to_check(monkeypatch):
+    def get_connector_details(connectors):
+        raise AssertionError('nothing should be fetched')
+    monkeypatch.setattr(connectivity_sampling.connectors, 'get_connector_details', get_connector_details)
+
+    n = neuron([(0, 0, 0), (1, 0, 0)], [-1, 0])
+    n.connectors = pd.DataFrame(columns = ['connector_id', 'treenode_id', 'relation', 'x', 'y', 'z'])
+    n.postsynapses = n.connectors
+    assert connectivity_sampling.upstream_node_check([]) is None
+    assert connectivity_sampling.upstream_node_check([n]) is None
+
+@pytest.fixture
+def connectors():
+    points = random_points(300, -5, 30, seed = 3)
+    skids = np.random.default_rng(3).choice(['11', '22', '33', '44'], size = len(points))
+    data = pd.DataFrame(points, columns = ['x', 'y', 'z'])
+    data.insert(0, 'skeleton_id', skids)
+    data.insert(0, 'connector_id', np.arange(len(points)))
+    return data
+
+def _per_skeleton(source, volumes):
+    """ The original count: one `in_volume` per skeleton and volume."""
+    data = pd.DataFrame()
+    for s in set(source.skeleton_id):
+        points = source.loc[source.skeleton_id == s, ['x', 'y', 'z']].values
+        data = pd.concat([data, pd.DataFrame.from_dict({n : in_volume(points, v).sum() for n, v in volumes.items()},
+                                                       orient = 'index', columns = [str(s)])], axis = 1)
+    return data
+
+def test_connectors_in_vol_counts(connectors, volumes):
+    expected = _per_skeleton(connectors, volumes)
+    labeller = volume_index.VolumeLabeller(volumes)
+
+    dense = connectivity_sampling.connectors_in_vol(connectors, labeller, count = True)
+    assert dense.shape == expected.shape
+    pd.testing.assert_frame_equal(dense.loc[expected.index, expected.columns], expected, check_dtype = False)
+
+    counts, names, skids = connectivity_sampling.connectors_in_vol(connectors, labeller, count = True, sparse = True)
+    sparse = pd.DataFrame(counts.toarray(), index = names, columns = skids)
+    pd.testing.assert_frame_equal(sparse, dense)
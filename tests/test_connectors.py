@@ -0,0 +1,46 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pytest
+from PNtools import connectors
+
+@pytest.fixture
+def server(monkeypatch):
+    """ Fake CATMAID server, recording which connectors were requested."""
+    requested = []
+    lock = threading.Lock()
+    def get_connector_details(ids, remote_instance = None):
+        with lock:
+            requested.extend(ids)
+        return pd.DataFrame({'connector_id': [str(i) for i in ids],
+                             'presynaptic_to': [i % 7 for i in ids],
+                             'postsynaptic_to': [[i % 5] for i in ids],
+                             'presynaptic_to_node': [i * 10 for i in ids],
+                             'postsynaptic_to_node': [[i * 10 + 1] for i in ids]})
+    monkeypatch.setattr(connectors.datasource, 'get_connector_details', get_connector_details)
+    monkeypatch.setattr(connectors.datasource, 'instance_key', lambda remote_instance = None: 'server')
+    connectors.clear_connector_cache()
+    yield requested
+    connectors.clear_connector_cache()
+
+def test_fetched_once_in_order(server):
+    first = connectors.get_connector_details([5, 3, 9, 3], chunk_size = 2)
+    assert first.connector_id.tolist() == [5, 3, 9]
+    assert first.presynaptic_to_node.tolist() == [50, 30, 90]
+
+    again = connectors.get_connector_details(pd.DataFrame({'connector_id': [9, 11, 5]}), chunk_size = 2)
+    assert again.connector_id.tolist() == [9, 11, 5]
+    assert again.presynaptic_to.tolist() == [9 % 7, 11 % 7, 5 % 7]
+    assert sorted(server) == [3, 5, 9, 11]
+
+def test_empty(server):
+    assert connectors.get_connector_details([]).empty
+
+def test_threads(server):
+    ids = np.arange(2000)
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda s: connectors.get_connector_details(ids[s::8], chunk_size = 50), range(8)))
+    for s, details in enumerate(results):
+        assert details.connector_id.tolist() == ids[s::8].tolist()
+    assert connectors.get_connector_details(ids[::-1]).connector_id.tolist() == ids[::-1].tolist()
@@ -0,0 +1,55 @@
+import types
+import numpy as np
+import pandas as pd
+import pytest
+import PNtools
+from PNtools import datasource
+
+@pytest.fixture
+def server(monkeypatch):
+    """ Stand-in for pymaid with no global CatmaidInstance, counting the calls that reach it."""
+    calls = []
+    def get_volume(names, remote_instance = None):
+        calls.append(names)
+        return {n: 'mesh of {} on {}'.format(n, remote_instance.server) for n in names}
+    def eval_remote_instance(remote_instance, raise_error = True):
+        if remote_instance is None and raise_error:
+            raise Exception('No global CatmaidInstance')
+        return remote_instance
+    stub = types.SimpleNamespace(get_volume = get_volume,
+                                 utils = types.SimpleNamespace(_eval_remote_instance = eval_remote_instance))
+    monkeypatch.setattr(datasource, 'pymaid', stub)
+    return calls
+
+def test_record_and_replay(server, tmp_path):
+    rm = types.SimpleNamespace(server = 'https://catmaid', project_id = 1)
+    with PNtools.recording(str(tmp_path)) as source:
+        assert datasource.get_source() is source
+        recorded = [datasource.get_volume(['v1', 'v2'], remote_instance = rm),
+                    datasource.get_volume(['v3'], remote_instance = rm)]
+    assert isinstance(datasource.get_source(), datasource.LiveSource)
+    assert len(server) == 2
+
+    # a different object pointing at the same server and project replays the same responses
+    same = types.SimpleNamespace(server = 'https://catmaid', project_id = 1)
+    with PNtools.replaying(str(tmp_path)) as source:
+        assert source.instance_key() == ('https://catmaid', 1)
+        replayed = [datasource.get_volume(['v1', 'v2'], remote_instance = same),
+                    datasource.get_volume(['v3'], remote_instance = same)]
+        with pytest.raises(KeyError):
+            datasource.get_volume(['v4'], remote_instance = same)
+        with pytest.raises(KeyError):
+            datasource.get_volume(['v3'], remote_instance = types.SimpleNamespace(server = 'other', project_id = 1))
+    assert replayed == recorded
+    assert len(server) == 2
+
+def test_fingerprint_tables():
+    table = pd.DataFrame({'connector_id': np.arange(5), 'x': np.linspace(0, 1, 5), 'relation': list('abcab')})
+    key = datasource.fingerprint('f', [table], {})
+    assert datasource.fingerprint('f', [table.copy()], {}) == key
+    for column, value in [('connector_id', 9), ('x', 0.3), ('relation', 'z')]:
+        changed = table.copy()
+        changed.loc[2, column] = value
+        assert datasource.fingerprint('f', [changed], {}) != key
+    assert datasource.fingerprint('f', [table.rename(columns = {'x': 'y'})], {}) != key
+    assert datasource.fingerprint('f', [np.arange(5)], {}) != datasource.fingerprint('f', [np.arange(5.)], {})
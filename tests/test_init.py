@@ -0,0 +1,32 @@
+import importlib
+import pytest
+import PNtools
+
+# Public names of PNtools 0.0.1, which star imported misc, processing, connectivity_sampling, PN_specific and plotting
+BASELINE = ['FAFB_vols', 'PN_axon_prune', 'PN_specific', 'cable_length_matrix', 'calc_ltk', 'calc_lts',
+            'connectivity_sampling', 'connectors_in_vol', 'ends_matrix', 'fafbseg', 'first_branch', 'get_gloms',
+            'itertools', 'misc', 'np', 'path_to_root', 'pd', 'pi', 'plotting', 'plt', 'point_in_vol', 'processing',
+            'pruning', 'pymaid', 'radar_plot', 'seed_sheet', 'tqdm', 'upstream_node_check', 'upstream_sheet', 'utils',
+            'vol_of_vol']
+
+def test_baseline_names():
+    assert set(BASELINE) <= set(dir(PNtools))
+
+def test_entry_points():
+    names = set(dir(PNtools))
+    for module in ['datasource', 'parallel', 'stats']:
+        assert module in names
+    for name in ['set_source', 'recording', 'replaying', 'map_neurons', 'map_tasks', 'permutation_test',
+                 'bootstrap_ci']:
+        assert name in PNtools.__all__
+
+@pytest.mark.parametrize('name', PNtools.__all__)
+def test_exports_resolve(name):
+    assert getattr(PNtools, name) is getattr(importlib.import_module('PNtools.' + PNtools._lookup[name]), name)
+
+def test_legacy_names():
+    import numpy as np
+    from math import pi
+    assert PNtools.np is np and PNtools.pi == pi
+    with pytest.raises(AttributeError):
+        PNtools.not_a_name
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+from PNtools import matrix_store
+
+@pytest.mark.parametrize('values', [np.array([[True, False], [False, False]]),
+                                    np.array([[1, 0], [3, 2]]),
+                                    np.array([[1.5, 0], [3, 2]])])
+def test_round_trip(tmp_path, values):
+    store = matrix_store.MatrixStore(str(tmp_path))
+    rows = pd.DataFrame(values, index = ['1', '2'], columns = ['AL', 'LH'])
+    store._save('key', rows, {'1': 'a', '2': 'b'})
+    loaded, stored = store._load('key')
+    pd.testing.assert_frame_equal(loaded, rows, check_dtype = False)
+    assert loaded.values.dtype == values.dtype
+    assert stored == {'1': 'a', '2': 'b'}
+
+def test_mask_with_missing_rows(tmp_path, monkeypatch):
+    # neurons missing from a mask (as_mask = True) are filled in as False, and the mask is read back from disk
+    def mask(neurons, volumes):
+        return pd.DataFrame([[True, False]], index = [1], columns = ['AL', 'LH'])
+    monkeypatch.setitem(matrix_store._KINDS, 'mask', (mask, False))
+    monkeypatch.setattr(matrix_store.datasource, 'get_neurons', lambda skids: list(skids))
+    monkeypatch.setattr(matrix_store, '_volume_hash', lambda volumes: 'volumes')
+
+    store = matrix_store.MatrixStore(str(tmp_path))
+    first = store.matrix('mask', ['1', '2'], None, editions = {'1': 'a', '2': 'b'})
+    again = store.matrix('mask', ['1', '2'], None, editions = {'1': 'a', '2': 'b'})
+    for out in (first, again):
+        assert (out.dtypes == bool).all()
+        assert out.values.tolist() == [[True, False], [False, False]]
+
+def test_mask_edits_only_restale_their_rows(tmp_path, monkeypatch):
+    computed = []
+    def masked(neurons, volumes, mask = None, scale = 1):
+        computed.append(sorted(neurons))
+        ones = pd.DataFrame(scale, index = list(neurons), columns = ['AL', 'LH'])
+        return ones.where(mask.set_axis(mask.index.astype(str), axis = 0)).fillna(0)
+    monkeypatch.setitem(matrix_store._KINDS, 'masked', (masked, False))
+    monkeypatch.setattr(matrix_store.datasource, 'get_neurons', lambda skids: list(skids))
+    monkeypatch.setattr(matrix_store, '_volume_hash', lambda volumes: 'volumes')
+
+    store = matrix_store.MatrixStore(str(tmp_path))
+    editions = {'1': 'a', '2': 'b', '3': 'c'}
+    mask = pd.DataFrame([[True, False], [True, True], [False, False]], index = [1, 2, 3], columns = ['AL', 'LH'])
+    first = store.matrix('masked', ['1', '2', '3'], None, editions = editions, mask = mask)
+    assert first.values.tolist() == [[1, 0], [1, 1], [0, 0]]
+    assert store.matrix('masked', ['1', '2', '3'], None, editions = editions, mask = mask.copy()).equals(first)
+    assert computed == [['1', '2', '3']]
+
+    # editing one neuron's row of the mask recomputes that row only, in the same table
+    edited = mask.copy()
+    edited.loc[3, 'LH'] = True
+    out = store.matrix('masked', ['1', '2', '3'], None, editions = editions, mask = edited)
+    assert out.values.tolist() == [[1, 0], [1, 1], [0, 1]]
+    assert computed[1:] == [['3']] and len(store) == 1
+
+    # other arguments still key tables of their own
+    out = store.matrix('masked', ['1', '2', '3'], None, editions = editions, mask = edited, scale = 2)
+    assert out.values.tolist() == [[2, 0], [2, 2], [0, 2]]
+    assert computed[2:] == [['1', '2', '3']] and len(store) == 2
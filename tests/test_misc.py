@@ -0,0 +1,107 @@
+import types
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import Volume, random_tree
+from PNtools import datasource, misc
+
+@pytest.mark.parametrize('side', ['Right', 'FIB'])
+def test_get_gloms_one_instance(monkeypatch, side):
+    # the listing used to pick (and check the freshness of) the glomeruli comes from the instance asked for
+    instance = types.SimpleNamespace(server = 'https://local', project_id = 2)
+    calls = []
+    def get_volume(names = None, remote_instance = None):
+        calls.append(remote_instance)
+        if names is None:
+            return pd.DataFrame({'name': ['v14.DA1', 'v14.DA1_L', 'FIB.DA1', 'FIB.neuropil']})
+        return {n: n for n in names}
+    monkeypatch.setattr(datasource.LiveSource, 'is_available', lambda self: True)
+    monkeypatch.setattr(datasource, 'get_volume', get_volume)
+
+    gloms = misc.get_gloms(side, instance = instance, cache = False)
+    assert list(gloms) == ['DA1']
+    assert calls == [instance, instance]
+
+def _ltk(x):
+    """ Lifetime kurtosis of a single list, as calc_ltk computed it before."""
+    x = x[~np.isnan(x)]
+    return sum(((x - x.mean()) / x.std()) ** 4) / len(x) - 3
+
+def _lts(x):
+    """ Lifetime sparseness of a single list, as calc_lts computed it before."""
+    x = x[~np.isnan(x)]
+    N = len(x)
+    return 1 / (1 - (1 / N)) * (1 - (sum(x / N) ** 2 / sum(x ** 2 / N)))
+
+@pytest.fixture
+def matrix():
+    """ Neuron by volume matrix with NaNs, an all-zero row and an all-zero column."""
+    rng = np.random.default_rng(0)
+    x = rng.gamma(.5, 100, size = (40, 12))
+    x[rng.random(x.shape) < .1] = np.nan
+    x[5] = 0
+    x[:, 3] = 0
+    return pd.DataFrame(x, index = ['n{}'.format(i) for i in range(40)], columns = ['v{}'.format(i) for i in range(12)])
+
+@pytest.mark.parametrize('func, single', [(misc.calc_ltk, _ltk), (misc.calc_lts, _lts)])
+@pytest.mark.parametrize('axis', [0, 1])
+@pytest.mark.parametrize('chunk_size', [4000000, 30, 1])
+def test_lifetime_matches_per_row(matrix, func, single, axis, chunk_size):
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        expected = matrix.apply(lambda r: single(r.values), axis = axis)
+    out = func(matrix, axis = axis, chunk_size = chunk_size)
+    assert out.index.equals(matrix.columns if axis == 0 else matrix.index)
+    np.testing.assert_allclose(out.values, expected.values, rtol = 1e-10, equal_nan = True)
+    assert np.isnan(out.loc['v3' if axis == 0 else 'n5'])
+
+    arr = func(matrix.values, axis = axis, chunk_size = chunk_size)
+    np.testing.assert_allclose(arr, expected.values, rtol = 1e-10, equal_nan = True)
+
+@pytest.mark.parametrize('func, single', [(misc.calc_ltk, _ltk), (misc.calc_lts, _lts)])
+def test_lifetime_single_list(matrix, func, single):
+    row = matrix.values[0]
+    assert func(row) == pytest.approx(single(row))
+    assert func(list(row)) == pytest.approx(single(row))
+
+def _flip(volume, rows):
+    faces = np.array(volume.faces)
+    faces[rows] = faces[rows, ::-1]
+    return Volume(volume.vertices, faces, volume.name)
+
+def test_volume_matches_trimesh(volumes):
+    trimesh = pytest.importorskip('trimesh')
+    b = volumes['box']
+    meshes = dict(volumes, inverted = _flip(b, slice(None)), mixed = _flip(b, [0, 5]))
+    metrics = misc.volume_metrics(meshes)
+    for name, v in meshes.items():
+        assert metrics.Volume[name] == pytest.approx(abs(trimesh.Trimesh(v.vertices, v.faces).volume))
+    assert metrics.Volume['inverted'] == pytest.approx(8000)
+    assert metrics.Watertight['inverted'] and not metrics.Watertight['mixed']
+
+def test_clear_volume_metrics(volumes):
+    misc.volume_metrics(volumes)
+    assert misc._metrics
+    misc.clear_volume_metrics()
+    assert not misc._metrics
+
+@pytest.mark.parametrize('location', ['root', 'centroid', 'nearest'])
+def test_representative_points(location):
+    neurons = [random_tree(n, seed = n, skeleton_id = str(n)) for n in (40, 1, 7)]
+    points = misc._representative_points(neurons, location)
+    assert points.shape == (3, 3) and points.dtype == np.float32
+    for n, p in zip(neurons, points):
+        xyz = n.nodes[['x', 'y', 'z']].values
+        centroid = xyz.mean(axis = 0)
+        if location == 'root':
+            expected = xyz[n.nodes.parent_id.isnull().values][0]
+        elif location == 'centroid':
+            expected = centroid
+        else:
+            # an actual node of the neuron, and the one nearest its centroid
+            expected = xyz[np.argmin(((xyz - centroid) ** 2).sum(axis = 1))]
+            assert np.any(np.all(xyz.astype(np.float32) == p, axis = 1))
+        assert np.allclose(p, expected, rtol = 1e-6)
+
+def test_representative_points_bad_location():
+    with pytest.raises(ValueError):
+        misc._representative_points([random_tree(5)], 'middle')
@@ -0,0 +1,51 @@
+import datetime
+import types
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import random_tree
+from PNtools import parallel
+
+class CatmaidNeuron:
+    """ Stand-in for pymaid's CatmaidNeuron, built from a Series of its attributes."""
+
+    def __init__(self, x):
+        for k, v in x.items():
+            setattr(self, k, v)
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(parallel, 'pymaid', types.SimpleNamespace(CatmaidNeuron = CatmaidNeuron))
+
+def test_pack_round_trip(stub):
+    n = random_tree(20, skeleton_id = '16')
+    n.neuron_name = 'PN 16'
+    n.connectors = pd.DataFrame({'connector_id': [1, 2], 'treenode_id': [100, 105], 'relation': [0, 1],
+                                 'x': [0., 1.], 'y': [0., 1.], 'z': [0., 1.]})
+    n.tags = {'soma': [100]}
+    n.soma = 100
+    n.date_retrieved = datetime.datetime(2020, 1, 1)
+    n.units = None
+    n.graph = object()
+    n._cache = 1
+
+    rebuilt = parallel.unpack_neuron(parallel.pack_neuron(n))
+    assert (rebuilt.skeleton_id, rebuilt.neuron_name, rebuilt.tags) == ('16', 'PN 16', {'soma': [100]})
+    pd.testing.assert_frame_equal(rebuilt.nodes, n.nodes)
+    pd.testing.assert_frame_equal(rebuilt.connectors, n.connectors)
+    assert (rebuilt.soma, rebuilt.date_retrieved, rebuilt.units) == (100, n.date_retrieved, None)
+    assert not hasattr(rebuilt, 'graph') and not hasattr(rebuilt, '_cache')
+
+def _size(x, add = 0):
+    return len(x) + add
+
+@pytest.mark.parametrize('desc', [None, 'sizes'])
+def test_progress_bar(monkeypatch, desc):
+    shown = []
+    def tqdm(iterable, disable = False, **kwargs):
+        shown.append(not disable)
+        return iterable
+    monkeypatch.setattr(parallel, 'tqdm', tqdm)
+    assert parallel.map_neurons(_size, [[1], [1, 2]], shared = {'add': 1}, desc = desc) == [2, 3]
+    assert parallel.map_tasks(_size, [[1], [1, 2]], desc = desc) == [1, 2]
+    assert shown == [desc is not None] * 2
@@ -0,0 +1,31 @@
+import pytest
+from conftest import box, in_volume, neuron, random_tree
+from PNtools import processing, volume_index
+
+def test_first_branch_in_pieces():
+    # primary neurite runs along y = 0, leaves the volume up x = 10 and comes back down x = 12, so the part in
+    # the volume is in two pieces; the branch at x = 5 is nearer the root than the one at x = 13, although
+    # it is further from the start of its own piece
+    xyz = ([(x, 0, 0) for x in range(11)] + [(10, y, 0) for y in range(1, 11)] +
+           [(12, y, 0) for y in range(10, 0, -1)] + [(x, 0, 0) for x in range(12, 21)])
+    parent = [-1] + list(range(len(xyz) - 1))
+    parent += [xyz.index((5, 0, 0)), xyz.index((13, 0, 0))]
+    xyz += [(5, 1, 0), (13, 1, 0)]
+    n = neuron(xyz, parent)
+    ids = n.nodes.treenode_id.values
+
+    assert processing.first_branch([n]) == [ids[4]]
+    assert processing.first_branch([n], box((1.5, -1, -1), (20.5, 2, 1), 'volume')) == [ids[4]]
+
+@pytest.mark.parametrize('batch', [True, False])
+def test_ends_matrix(volumes, batch):
+    neurons = [random_tree(200, seed, skeleton_id = str(seed), scale = 3) for seed in range(3)]
+    labeller = volume_index.VolumeLabeller(volumes)
+    ends = processing.ends_matrix(neurons, labeller, batch = batch)
+
+    # open ends as they were found before the cached topology, tested against each volume with pymaid
+    for n in neurons:
+        open_ends = set(n.nodes.treenode_id.values) - set(n.nodes.parent_id.values)
+        xyz = n.nodes.loc[n.nodes.treenode_id.isin(open_ends), ['x','y','z']].values
+        for name, volume in volumes.items():
+            assert ends.loc[n.skeleton_id, name] == in_volume(xyz, volume).sum()
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from PNtools import segmentation
+
+@pytest.fixture
+def labelled():
+    """ Segmentation of a small block starting below the origin, and points in (and around) it."""
+    rng = np.random.default_rng(0)
+    labels = rng.integers(1, 50, size = (30, 20, 10)).astype(np.uint64)
+    seg = segmentation.ArraySegmentation(labels, resolution = (4, 4, 40), offset = (-40, -20, -200))
+    points = rng.uniform((-50, -30, -250), (90, 70, 250), size = (500, 3))
+    # and some too far out to key
+    points[:5] = [[-4 * 2**21, 0, 0], [4 * 2**20, 0, 0], [0, 4 * 2**22, 0], [0, 0, -40 * 2**20 - 1], [0, 0, 40 * 2**20]]
+    return seg, points
+
+class Counting:
+    def __init__(self, backend):
+        self.backend = backend
+        self.asked = 0
+
+    def __call__(self, coords):
+        self.asked += len(coords)
+        return self.backend(coords)
+
+def test_cache_matches_array(labelled):
+    seg, points = labelled
+    backend = Counting(seg)
+    cache = segmentation.SegmentCache(backend = backend, chunk_size = 64)
+    expected = seg(points)
+    assert np.array_equal(cache.get_seg_ids(points), expected)
+    n_voxels = len(np.unique(np.floor(points[5:] / (4, 4, 40)), axis = 0))
+    assert len(cache) == n_voxels
+    assert backend.asked == n_voxels + 5
+
+    # only the voxels too far out are asked about again
+    assert np.array_equal(cache.get_seg_ids(points), expected)
+    assert backend.asked == n_voxels + 10
+
+def test_pack_round_trip():
+    voxels = np.array([[0, 0, 0], [-1, 2, -3], [-2**20, 2**20 - 1, 5], [2**20 - 1, -2**20, -2**20]])
+    keys = segmentation._pack(voxels)
+    assert len(np.unique(keys)) == len(voxels)
+    assert np.array_equal(segmentation._unpack(keys), voxels)
+    with pytest.raises(ValueError):
+        segmentation._pack(np.array([[2**20, 0, 0]]))
+
+def test_save_load(labelled, tmp_path):
+    seg, points = labelled
+    path = str(tmp_path / 'seg.npz')
+    cache = segmentation.SegmentCache(path, backend = seg)
+    expected = cache.get_seg_ids(points[5:])
+
+    def offline(coords):
+        raise AssertionError('all voxels should be cached')
+    loaded = segmentation.SegmentCache(path, backend = offline)
+    assert len(loaded) == len(cache)
+    assert np.array_equal(loaded.get_seg_ids(points[5:]), expected)
+
+    loaded.clear()
+    assert len(loaded) == 0
+    assert not (tmp_path / 'seg.npz').exists()
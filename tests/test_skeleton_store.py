@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import random_tree
+from PNtools import skeleton_store
+
+pytest.importorskip('pyarrow')
+
+def _neurons():
+    neurons = []
+    for i, n_nodes in enumerate([30, 1, 12]):
+        n = random_tree(n_nodes, seed = i, skeleton_id = str(i + 1))
+        n.nodes['type'] = np.where(n.nodes.parent_id.isnull(), 'root', 'slab')
+        rng = np.random.default_rng(i)
+        nodes = n.nodes.treenode_id.values[rng.integers(0, n_nodes, 2 * i)]
+        n.connectors = pd.DataFrame({'connector_id': np.arange(2 * i) + 1000 * i, 'treenode_id': nodes,
+                                     'relation': rng.integers(0, 2, 2 * i), 'x': rng.normal(size = 2 * i),
+                                     'y': rng.normal(size = 2 * i), 'z': rng.normal(size = 2 * i)})
+        n.tags = {'ends': list(nodes), 'soma': [n.nodes.treenode_id[0]]} if i else {}
+        n.neuron_name = 'neuron {}'.format(i)
+        neurons.append(n)
+    return neurons
+
+def _expected(neurons, table, skids):
+    frames = [getattr(neurons[int(s) - 1], table) for s in skids]
+    frame = pd.concat(frames, ignore_index = True)
+    frame.insert(0, 'skeleton_id', np.repeat(skids, [len(f) for f in frames]))
+    return frame
+
+@pytest.mark.parametrize('format', ['feather', 'parquet'])
+def test_round_trip(monkeypatch, tmp_path, format):
+    neurons = _neurons()
+    store = skeleton_store.SkeletonStore.write(neurons, str(tmp_path / 'store'), format = format)
+    store = skeleton_store.SkeletonStore(str(tmp_path / 'store'))
+    assert store.skeleton_ids == ['1', '2', '3'] and len(store) == 3
+
+    skids = ['3', '1', '2']
+    nodes = store.nodes(skids)
+    expected = _expected(neurons, 'nodes', skids)
+    # the root's parent is missing in the stored table, and comes back as None
+    assert store._tables['nodes'].schema.field('parent_id').type == 'int64'
+    assert [p for p in nodes.parent_id if not isinstance(p, (int, np.integer))] == [None] * 3
+    assert nodes.type.dtype == 'category' and nodes.x.dtype == np.float32
+    pd.testing.assert_frame_equal(nodes.astype({'type': str}), expected, check_dtype = False)
+
+    pd.testing.assert_frame_equal(store.connectors(skids), _expected(neurons, 'connectors', skids),
+                                  check_dtype = False)
+    pd.testing.assert_frame_equal(store.connectors(), _expected(neurons, 'connectors', ['1', '2', '3']),
+                                  check_dtype = False)
+
+    # neurons are built from their own rows of each table
+    monkeypatch.setattr(skeleton_store.parallel, 'unpack_neuron', lambda packed: packed)
+    for n, stored in zip(neurons, store):
+        assert stored['skeleton_id'] == n.skeleton_id and stored['neuron_name'] == n.neuron_name
+        pd.testing.assert_frame_equal(stored['nodes'].astype({'type': str}), n.nodes, check_dtype = False)
+        pd.testing.assert_frame_equal(stored['connectors'], n.connectors, check_dtype = False)
+        assert {t: sorted(v) for t, v in stored['tags'].items()} == {t: sorted(v) for t, v in n.tags.items()}
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+from PNtools import stats
+
+@pytest.fixture
+def matrix():
+    rng = np.random.default_rng(0)
+    x = rng.gamma(2, 10, size = (12, 15))
+    # a few sparse rows, concentrated in one or two columns
+    x[:4] *= rng.random((4, 15)) < .15
+    x[:4, 0] += 50
+    return pd.DataFrame(x, index = ['n{}'.format(i) for i in range(12)])
+
+@pytest.mark.parametrize('test', [stats.permutation_test, stats.bootstrap_ci])
+def test_same_for_any_n_jobs(matrix, test):
+    one = test(matrix, n_resamples = 50, seed = 3, n_jobs = 1, chunk_size = matrix.size * 10)
+    two = test(matrix, n_resamples = 50, seed = 3, n_jobs = 2, chunk_size = matrix.size * 10)
+    pd.testing.assert_frame_equal(one, two)
+
+@pytest.mark.parametrize('test', [stats.permutation_test, stats.bootstrap_ci])
+def test_same_for_any_chunk_size(matrix, test):
+    whole = test(matrix, n_resamples = 40, seed = 5)
+    for chunk_size in (matrix.size * 7, matrix.size, 1):
+        pd.testing.assert_frame_equal(test(matrix, n_resamples = 40, seed = 5, chunk_size = chunk_size), whole)
+    assert not whole.equals(test(matrix, n_resamples = 40, seed = 6))
+
+def test_p_values(matrix):
+    n = 200
+    res, null = stats.permutation_test(matrix, n_resamples = n, seed = 1, return_null = True)
+    assert null.shape == (len(matrix), n)
+    greater = (1 + (null >= res.observed.values[:, None]).sum(axis = 1)) / (1 + n)
+    less = (1 + (null <= res.observed.values[:, None]).sum(axis = 1)) / (1 + n)
+    assert np.allclose(res.p_value, greater)
+    assert np.allclose(stats.permutation_test(matrix, n_resamples = n, seed = 1, alternative = 'less').p_value, less)
+    two = stats.permutation_test(matrix, n_resamples = n, seed = 1, alternative = 'two-sided').p_value
+    assert np.allclose(two, np.minimum(1, 2 * np.minimum(greater, less)))
+    # the sparse rows are sparser than any shuffle: p is its smallest possible value, 1 / (1 + n)
+    assert np.allclose(res.p_value[:4], 1 / (1 + n))
+
+def test_p_value_constant_columns():
+    # every shuffle of constant columns gives back the same matrix, so the null always equals the observed
+    # statistic: (1 + n) / (1 + n) = 1 whichever way round
+    x = np.tile(np.array([[1., 5., 0., 2.]]), (6, 1))
+    for alternative in ('greater', 'less', 'two-sided'):
+        res = stats.permutation_test(x, 'ltk', n_resamples = 30, seed = 0, alternative = alternative)
+        assert (res.p_value == 1).all()
+
+def test_bootstrap_brackets_observed(matrix):
+    ci = stats.bootstrap_ci(matrix, n_resamples = 400, seed = 2)
+    assert (ci.ci_low <= ci.observed).all() and (ci.observed <= ci.ci_high).all()
+    narrow = stats.bootstrap_ci(matrix, n_resamples = 400, seed = 2, confidence = .5)
+    assert (ci.ci_low <= narrow.ci_low).all() and (narrow.ci_high <= ci.ci_high).all()
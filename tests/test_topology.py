@@ -0,0 +1,163 @@
+import networkx as nx
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import Neuron, graph, random_tree
+from PNtools import topology
+
+def forest(seed = 0):
+    """ Two random trees as one neuron, as pruning can leave."""
+    a, b = random_tree(150, seed), random_tree(100, seed + 1)
+    nodes = b.nodes.copy()
+    nodes['treenode_id'] += 1000
+    nodes['parent_id'] = nodes.parent_id.map(lambda p: None if p is None else p + 1000)
+    return Neuron(pd.concat([a.nodes, nodes], ignore_index = True))
+
+@pytest.mark.parametrize('seed', range(3))
+def test_distances(seed):
+    n = random_tree(300, seed)
+    topo = topology.Topology.from_neuron(n)
+    g = graph(n)
+    root = topo.node_ids[topo.root]
+    dist = nx.shortest_path_length(g, root, weight = 'weight')
+    depth = nx.shortest_path_length(g, root)
+    assert np.allclose(topo.distances, [dist[i] for i in topo.node_ids], rtol = 1e-5)
+    assert topo.depth.tolist() == [depth[i] for i in topo.node_ids]
+
+def test_distances_fragments():
+    n = forest()
+    topo = topology.Topology.from_neuron(n)
+    g = graph(n)
+    assert len(topo.roots) == 2
+    for root in topo.node_ids[topo.roots]:
+        dist = nx.shortest_path_length(g, root, weight = 'weight')
+        idx = topo.index(list(dist))
+        assert np.allclose(topo.distances[idx], list(dist.values()), rtol = 1e-5)
+
+def test_structure():
+    n = random_tree(300, 4)
+    topo = topology.Topology.from_neuron(n)
+    g = graph(n)
+    root = topo.node_ids[topo.root]
+    assert set(topo.node_ids[topo.leaves]) == {i for i in g if g.out_degree(i) == 0}
+    assert set(topo.node_ids[topo.branch_points]) == {i for i in g if g.out_degree(i) > 1 and i != root}
+    assert [set(topo.node_ids[topo.children[topo.child_offsets[i]:topo.child_offsets[i + 1]]]) for i in range(len(topo))] == \
+           [set(g.successors(i)) for i in topo.node_ids]
+
+    # longest neurite: root to the leaf furthest from it
+    dist = nx.shortest_path_length(g, root, weight = 'weight')
+    leaf = max((i for i in g if g.out_degree(i) == 0), key = dist.get)
+    assert topo.longest_neurite().tolist() == nx.shortest_path(g, root, leaf)
+
+@pytest.mark.parametrize('seed', range(2))
+def test_reroot(seed):
+    n = random_tree(200, seed)
+    root = n.nodes.treenode_id.values[137]
+    topo = topology.Topology.from_neuron(n, root = root)
+    u = graph(n).to_undirected()
+    dist = nx.shortest_path_length(u, root, weight = 'weight')
+    assert topo.node_ids[topo.root] == root
+    assert np.allclose(topo.distances, [dist[i] for i in topo.node_ids], rtol = 1e-5)
+    # every parent is one edge nearer the new root
+    has_parent = topo.parent >= 0
+    hops = nx.shortest_path_length(u, root)
+    assert all(hops[p] + 1 == hops[c] for c, p in zip(topo.node_ids[has_parent], topo.node_ids[topo.parent[has_parent]]))
+
+@pytest.mark.parametrize('seed', range(3))
+def test_lca_geodesic(seed):
+    n = random_tree(300, seed)
+    topo = topology.Topology.from_neuron(n)
+    g = graph(n)
+    rng = np.random.default_rng(seed)
+    a, b = rng.choice(topo.node_ids, 200), rng.choice(topo.node_ids, 200)
+    a[:5] = b[:5]
+
+    lca = dict(nx.all_pairs_lowest_common_ancestor(g, pairs = list(zip(a, b))))
+    assert topo.lca(a, b).tolist() == [lca[p] for p in zip(a, b)]
+    u = g.to_undirected()
+    assert np.allclose(topo.geodesic(a, b), [nx.shortest_path_length(u, i, j, weight = 'weight') for i, j in zip(a, b)],
+                       rtol = 1e-5, atol = 1e-6)
+
+def test_lca_fragments():
+    n = forest()
+    topo = topology.Topology.from_neuron(n)
+    g = graph(n)
+    a, b = topo.node_ids[[3, 40, 160, 10]], topo.node_ids[[180, 90, 200, 11]]
+    lca = topo.lca(a, b)
+    assert lca[0] == -1 and np.isinf(topo.geodesic(a[:1], b[:1])[0])
+    assert lca[1:].tolist() == [nx.lowest_common_ancestor(g, i, j) for i, j in zip(a[1:], b[1:])]
+
+def test_paths_to_root():
+    n = random_tree(300, 5)
+    topo = topology.Topology.from_neuron(n)
+    g = graph(n)
+    root = topo.node_ids[topo.root]
+    nodes = topo.node_ids[[0, 5, 77, 299, 150]]
+    paths = topo.paths_to_root(nodes)
+    assert [p.tolist() for p in paths] == [nx.shortest_path(g, root, i)[::-1] for i in nodes]
+    assert topo.path_to_root(nodes[2]).tolist() == paths[2].tolist()
+    dist = nx.shortest_path_length(g, root, weight = 'weight')
+    assert np.allclose(topo.distance_to_root(nodes), [dist[i] for i in nodes], rtol = 1e-5)
+
+@pytest.mark.parametrize('seed', range(3))
+def test_connecting(seed):
+    # the smallest connected set holding some nodes is the union of the paths between them
+    n = random_tree(200, seed)
+    topo = topology.Topology.from_neuron(n)
+    u = graph(n).to_undirected()
+    rng = np.random.default_rng(seed)
+    mask = np.zeros(len(topo), dtype = bool)
+    mask[rng.choice(len(topo), 6, replace = False)] = True
+    picked = topo.node_ids[mask]
+    expected = {i for a in picked for b in picked for i in nx.shortest_path(u, a, b)}
+    assert set(topo.node_ids[topo.connecting(mask)]) == expected
+
+def test_cached_topology_reused():
+    n = random_tree(200, 6)
+    topo = topology.cached_topology(n)
+    assert topology.cached_topology(n) is topo
+    # everything worked out is kept with it
+    assert topology.cached_topology(n).distances is topo.distances
+
+    root = n.nodes.treenode_id.values[50]
+    rooted = topology.cached_topology(n, root)
+    assert rooted is not topo and rooted is topology.cached_topology(n, root)
+    assert rooted.node_ids[rooted.root] == root
+    assert topology.cached_topology(n) is topo
+
+    view = topology.NeuronView(n)
+    assert view.base is topo
+    assert (view & view.longest_neurite()).base is topo
+    assert topology.NeuronView(n, root = root).base is rooted
+
+def test_cached_topology_rebuilt():
+    n = random_tree(200, 7)
+    topo = topology.cached_topology(n)
+
+    # moved node
+    n.nodes.loc[10, 'x'] += 5
+    moved = topology.cached_topology(n)
+    assert moved is not topo
+    assert np.allclose(moved.distances, topology.Topology.from_neuron(n).distances)
+
+    # removed leaves
+    leaves = set(n.nodes.treenode_id) - set(n.nodes.parent_id)
+    n.nodes = n.nodes[~n.nodes.treenode_id.isin(leaves)].reset_index(drop = True)
+    pruned = topology.cached_topology(n)
+    assert pruned is not moved and len(pruned) == len(n.nodes)
+
+    # rerooted in place: same nodes and coordinates, different parents
+    fresh = topology.Topology.from_neuron(n, root = n.nodes.treenode_id.values[30])
+    ids = fresh.node_ids
+    n.nodes['parent_id'] = pd.Series(ids[fresh.parent], dtype = object).where(fresh.parent >= 0, None).values
+    rerooted = topology.cached_topology(n)
+    assert rerooted is not pruned and rerooted.node_ids[rerooted.root] == ids[30]
+    assert np.allclose(rerooted.distances, fresh.distances)
+
+@pytest.mark.parametrize('seed', range(3))
+def test_cached_leaves(seed):
+    # leaves are the nodes which are nobody's parent, as the open ends were found before
+    n = random_tree(300, seed)
+    open_ends = set(n.nodes.treenode_id.values) - set(n.nodes.parent_id.values)
+    topo = topology.cached_topology(n)
+    assert set(topo.node_ids[topo.leaves]) == open_ends
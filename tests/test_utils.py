@@ -0,0 +1,63 @@
+import json
+import time
+import numpy as np
+import pytest
+from PNtools import datasource, utils
+
+class Source:
+    """ Source answering every call with ten float64s."""
+
+    def call(self, name, *args, **kwargs):
+        return np.zeros(10)
+
+@pytest.fixture
+def instrumented():
+    datasource.set_source(Source())
+    yield
+    utils.disable_instrumentation()
+    utils.clear_instrumentation()
+    datasource.set_source(None)
+
+@utils.stage('outer')
+def _outer():
+    with utils.stage('inner'):
+        time.sleep(.01)
+        datasource.get_volume('v')
+    return 'done'
+
+def test_disabled_records_nothing(instrumented):
+    utils.clear_instrumentation()
+    assert _outer() == 'done'
+    assert len(utils.instrumentation_trace()) == 0
+
+def test_records(instrumented, tmp_path):
+    utils.enable_instrumentation()
+    assert _outer() == 'done'
+    assert _outer() == 'done'
+    utils.disable_instrumentation()
+    _outer()
+
+    summary = utils.instrumentation_summary()
+    assert summary.calls.to_dict() == {('stage', 'outer'): 2, ('stage', 'inner'): 2, ('remote', 'get_volume'): 2}
+    assert summary.payload[('remote', 'get_volume')] == 2 * 80
+
+    # each inner stage (and its remote call) lies within an outer one
+    trace = utils.instrumentation_trace()
+    trace['end'] = trace.start + trace.duration
+    outer = trace[trace.name == 'outer'].sort_values('start')
+    for name in ['inner', 'get_volume']:
+        inner = trace[trace.name == name].sort_values('start')
+        assert np.all(inner.start.values >= outer.start.values)
+        assert np.all(inner.end.values <= outer.end.values)
+    assert np.all(trace[trace.name == 'inner'].duration >= .01)
+
+    utils.export_trace(str(tmp_path / 'trace.json'))
+    with open(str(tmp_path / 'trace.json')) as f:
+        exported = json.load(f)
+    events = exported['traceEvents']
+    assert len(events) == 6
+    for e in events:
+        assert set(e) == {'name', 'cat', 'ph', 'pid', 'tid', 'ts', 'dur', 'args'}
+        assert e['ph'] == 'X' and e['dur'] >= 0
+    assert sorted(e['args'].get('payload', 0) for e in events) == [0, 0, 0, 0, 80, 80]
+    assert {e['cat'] for e in events} == {'stage', 'remote'}
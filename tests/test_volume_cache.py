@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+import pymaid
+from conftest import ellipsoid
+from PNtools import volume_cache, volume_index
+
+def test_hit_same_as_miss(tmp_path, monkeypatch):
+    mesh = ellipsoid((15, 10, 5), (12.3456789, 9.87654321, 7.1234567), 'ball')
+    fetched = []
+    def get_volume(names = None, remote_instance = None):
+        if names is None:
+            return pd.DataFrame({'name': ['ball'], 'edition_time': ['2020-01-01']})
+        fetched.append(names)
+        return pymaid.Volume(mesh.vertices, mesh.faces, name = 'ball')
+    monkeypatch.setattr(volume_cache.datasource, 'get_volume', get_volume)
+    monkeypatch.setattr(volume_cache.datasource, 'instance_key', lambda remote_instance = None: ('server', 1))
+
+    cache = volume_cache.VolumeCache(str(tmp_path))
+    miss = cache.get_volume('ball')
+    hit = cache.get_volume('ball')
+    assert len(fetched) == 1
+    assert np.array_equal(miss.vertices, hit.vertices) and np.array_equal(miss.faces, hit.faces)
+    assert volume_index._mesh_hash(miss) == volume_index._mesh_hash(hit)
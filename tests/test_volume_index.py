@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+from conftest import box, in_volume, neuron, random_points, random_tree
+from PNtools import volume_index
+
+def test_labeller_matches_in_volume(volumes):
+    points = random_points(5000, (-5, -5, -5), (30, 25, 25))
+    inside = volume_index.VolumeLabeller(volumes).in_volume(points)
+    assert list(inside) == list(volumes)
+    for name, volume in volumes.items():
+        assert np.array_equal(inside[name], in_volume(points, volume)), name
+
+def test_labeller_vertices_in_line(volumes):
+    # points level with the ball's vertices and the box's face diagonals, so rays (which run along x) pass
+    # through vertices and edges shared by several triangles
+    t = np.linspace(1, 19, 7)
+    lines = np.concatenate([volumes['ball'].vertices, np.stack([np.zeros(7), t, t], axis = 1)])
+    points = np.concatenate([lines + [x, 0, 0] for x in (-3.3, .7, 4.1)])
+    points = points[~np.any([np.isin(points[:, 0], v.vertices[:, 0]) for v in volumes.values()], axis = 0)]
+    inside = volume_index.VolumeLabeller(volumes).in_volume(points)
+    for name, volume in volumes.items():
+        assert np.array_equal(inside[name], in_volume(points, volume)), name
+
+def test_labeller_codes(volumes):
+    # box and ball overlap: points in both are labelled with the first
+    points = random_points(3000, (-5, -5, -5), (30, 25, 25), seed = 1)
+    labeller = volume_index.VolumeLabeller(volumes)
+    inside = np.stack([in_volume(points, v) for v in volumes.values()], axis = 1)
+    expected = np.where(inside.any(axis = 1), inside.argmax(axis = 1), -1)
+    assert inside[:, :2].all(axis = 1).any()
+    assert np.array_equal(labeller.codes(points), expected)
+    assert labeller.label(points, fill = 'none').tolist() == [(list(volumes) + ['none'])[c] for c in expected]
+
+@pytest.mark.parametrize('resolution', [1, (2, 1.5, 3)])
+def test_grid_matches_labeller(volumes, resolution):
+    # with the volumes, points in boundary voxels are tested against the meshes, so every point is exact
+    points = random_points(5000, (-5, -5, -5), (30, 25, 25), seed = 2)
+    labeller = volume_index.VolumeLabeller(volumes)
+    grid = volume_index.VoxelLabelGrid.build(volumes, resolution = resolution)
+    assert grid.names == labeller.names
+    assert np.array_equal(grid.codes(points), labeller.codes(points))
+    inside = grid.in_volume(points)
+    assert np.array_equal(inside['ball'], labeller.codes(points) == 1)
+    assert np.array_equal(inside['far'], in_volume(points, volumes['far']))
+
+def test_grid_without_volumes(volumes, tmp_path):
+    # saved and loaded without the volumes, only points in boundary voxels may be labelled differently
+    points = random_points(5000, (-5, -5, -5), (30, 25, 25), seed = 3)
+    path = str(tmp_path / 'grid.npy')
+    built = volume_index.VoxelLabelGrid.build(volumes, resolution = 1, path = path)
+    exact = volume_index.VoxelLabelGrid.load(path, volumes)
+    approx = volume_index.VoxelLabelGrid.load(path)
+    expected = volume_index.VolumeLabeller(volumes).codes(points)
+    assert np.array_equal(exact.codes(points), expected)
+    assert np.array_equal(built.labels, approx.labels)
+
+    vox = np.floor((points - approx.origin) / approx.resolution).astype(np.int64)
+    edge = approx.boundary[vox[:, 2], vox[:, 1], vox[:, 0]]
+    assert np.array_equal(approx.codes(points)[~edge], expected[~edge])
+    # points outside the grid are outside every volume
+    assert (approx.codes([[-100, -100, -100], [1e6, 0, 0]]) == -1).all()
+
+def _segment(a, b):
+    return neuron([a, b], [-1, 0])
+
+@pytest.mark.parametrize('a, b', [((10, 10, -10), (10, 10, 30)),   # through the diagonal of two faces
+                                  ((-10, 10, 10), (30, 10, 10)),
+                                  ((10, -10, 10), (10, 30, 10)),
+                                  ((-10, -10, -10), (30, 30, 30)),  # through two corners
+                                  ((5, 12, -10), (5, 12, 30))])     # through the middle of a triangle
+def test_cable_through_shared_edges(a, b):
+    # each face of the box is two triangles sharing a diagonal, so these segments cross the mesh on an edge
+    # or vertex of more than one triangle, which must still count as a single crossing
+    cable = volume_index.cable_per_volume([_segment(a, b)], {'box': box((0, 0, 0), (20, 20, 20), 'box')})
+    inside = np.clip(np.minimum(a, b), 0, 20), np.clip(np.maximum(a, b), 0, 20)
+    expected = np.linalg.norm(np.asarray(a) - b) * (inside[1] - inside[0]).max() / np.abs(np.subtract(b, a)).max()
+    assert cable.values[0, 0] == pytest.approx(expected)
+
+def test_segment_hits_agree_with_ray_hits():
+    # a segment from inside to far outside crosses the mesh as often as a ray from the same point
+    index = volume_index.VolumeLabeller({'box': box((0, 0, 0), (20, 20, 20), 'box')})._index
+    points = np.array([[10, 10, 10], [10, 5, 5], [5, 10, 10], [15, 15, 5], [10, 15, 15]], dtype = np.float64)
+    seg, _, _ = index.segment_hits(points, points + [1e3, 0, 0])
+    assert np.bincount(seg, minlength = len(points)).tolist() == [1, 1, 1, 1, 1]
+
+def test_cable_matches_sampling(volumes):
+    n = random_tree(200, seed = 1, scale = 4)
+    cable = volume_index.cable_per_volume([n], volumes)
+
+    # midpoints of many short pieces of each edge
+    a, b = volume_index._edges(n.nodes)
+    t = (np.arange(500) + .5) / 500
+    points = (a[:, None] + (b - a)[:, None] * t[:, None]).reshape(-1, 3)
+    pieces = np.repeat(np.linalg.norm(b - a, axis = 1) / 500, 500)
+    inside = volume_index.VolumeLabeller(volumes).in_volume(points)
+    for name in volumes:
+        assert cable.loc['1', name] == pytest.approx((inside[name] * pieces).sum(), rel = 1e-2, abs = 1e-2)
+
+def test_cable_no_neurons(volumes):
+    cable = volume_index.cable_per_volume([], volumes)
+    assert cable.shape == (0, len(volumes))
+    assert list(cable.columns) == list(volumes)